@@ -0,0 +1,71 @@
+"""Compares the CLIXML stderr conversion of run_ps with the previous one.
+
+Usage: python -m benchmarks.bench_clixml [--records 20000]
+
+PowerShell writes a progress record for every module it loads and for every
+step of a cmdlet that reports progress, the stderr of a script can be many
+megabytes of progress records around a few lines of error.
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import timeit
+import xml.etree.ElementTree as ET
+
+from winrm import Session
+
+PROGRESS = (
+    '<Obj S="progress" RefId="{0}"><TNRef RefId="0" /><MS><I64 N="SourceId">1</I64><PR N="Record"><AV>Preparing modules for first use.</AV>'
+    "<AI>0</AI><Nil /><PI>-1</PI><PC>-1</PC><T>Processing</T><SR>-1</SR><SD>{0} of many</SD></PR></MS></Obj>"
+)
+
+
+def legacy_clean_error_msg(msg: bytes) -> bytes:
+    """The conversion before the streaming decoder, kept as the baseline"""
+    msg_xml = msg[11:]
+    for match in re.compile(b'xmlns=*[""][^""]*[""]').finditer(msg_xml):
+        msg_xml = msg_xml.replace(match.group(), b"")
+    root = ET.fromstring(msg_xml)
+    new_msg = ""
+    for s in root.findall("./S"):
+        if s.text:
+            new_msg += s.text.replace("_x000D__x000A_", "\n")
+    return new_msg.strip().encode("utf-8") if new_msg else msg
+
+
+def build_stderr(records: int) -> bytes:
+    parts = [
+        '#< CLIXML\r\n<Objs Version="1.1.0.1" xmlns="http://schemas.microsoft.com/powershell/2004/04">',
+        '<Obj S="progress" RefId="0"><TN RefId="0"><T>System.Management.Automation.PSCustomObject</T><T>System.Object</T></TN><MS /></Obj>',
+    ]
+    for i in range(1, records):
+        parts.append(PROGRESS.format(i))
+        if i % 1000 == 0:
+            parts.append('<S S="Error">error {0}_x000D__x000A_</S>'.format(i))
+    parts.append("</Objs>")
+    return "".join(parts).encode()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=20000, help="progress records in stderr")
+    parser.add_argument("--number", type=int, default=3, help="conversions per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements, the best one is reported")
+    args = parser.parse_args()
+
+    stderr = build_stderr(args.records)
+    assert legacy_clean_error_msg(stderr) == Session._clean_error_msg(stderr)
+    print("stderr: {0:.1f} MiB".format(len(stderr) / 1024 / 1024))
+
+    results = {}
+    for name, convert in [("streaming", Session._clean_error_msg), ("legacy", legacy_clean_error_msg)]:
+        best = min(timeit.repeat(lambda: convert(stderr), number=args.number, repeat=args.repeat)) / args.number
+        results[name] = best
+        print("{0:>10}: {1:8.1f} ms {2:8.1f} MiB/s".format(name, best * 1000, len(stderr) / 1024 / 1024 / best))
+    print("{0:>10}: {1:8.1f}x".format("speedup", results["legacy"] / results["streaming"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Measures the bytes on the wire with and without compress_output.
+
+Usage: python -m benchmarks.bench_compression [--size 20]
+
+The output is a synthetic dump in the format of Get-WinEvent | Format-List,
+compressed with Python's gzip at its default level as a stand in for .NET's
+GZipStream. Both run against the local test double of a Windows host used by
+the tests, the bytes counted are the Receive responses.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import random
+import time
+
+from winrm import Session
+from winrm.compression import WRAPPER_SCRIPT
+from winrm.tests.fake_host import FakeHost, Process
+
+PROVIDERS = ["Service Control Manager", "Microsoft-Windows-Kernel-General", "Microsoft-Windows-WindowsUpdateClient", "EventLog", "Schannel"]
+MESSAGES = [
+    "The {0} service entered the {1} state.",
+    "The system time has changed to {2}.",
+    "Installation Successful: Windows successfully installed the following update: {0}",
+    "A fatal alert was generated and sent to the remote endpoint. The TLS protocol defined fatal alert code is {3}.",
+]
+WORDS = ["Windows Update", "Background Intelligent Transfer Service", "WinHTTP Web Proxy Auto-Discovery Service", "running", "stopped"]
+
+
+def event_log(size: int) -> bytes:
+    rng = random.Random(0)
+    records = []
+    length = 0
+    while length < size:
+        record = (
+            "TimeCreated  : 10/{0:02d}/2026 {1:02d}:{2:02d}:{3:02d}\r\n" "ProviderName : {4}\r\n" "Id           : {5}\r\n" "Message      : {6}\r\n\r\n"
+        ).format(
+            rng.randint(1, 31),
+            rng.randint(0, 23),
+            rng.randint(0, 59),
+            rng.randint(0, 59),
+            rng.choice(PROVIDERS),
+            rng.randint(1, 9999),
+            rng.choice(MESSAGES).format(rng.choice(WORDS), rng.choice(WORDS), rng.randint(10**9, 10**10), rng.randint(10, 99)),
+        )
+        records.append(record)
+        length += len(record)
+    return "".join(records).encode()
+
+
+class EventLogHost(FakeHost):
+    def __init__(self, output: bytes) -> None:
+        super().__init__()
+        self.output = output
+        self.received = 0
+
+    def start(self, process: Process) -> None:
+        process.stdout += gzip.compress(self.output) if process.script.endswith(WRAPPER_SCRIPT) else self.output
+        process.exit_code = 0
+
+    def send_message(self, message: str | bytes) -> bytes:
+        response = super().send_message(message)
+        self.received += len(response)
+        return response
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=20, help="output size in MiB")
+    args = parser.parse_args()
+
+    output = event_log(args.size * 1024 * 1024)
+    received = {}
+    for compress_output in [False, True]:
+        session = Session("windows-host", auth=("user", "pass"))
+        host = session.protocol.transport = EventLogHost(output)
+        start = time.monotonic()
+        r = session.run_ps("Get-WinEvent -LogName System | Format-List", compress_output=compress_output)
+        elapsed = time.monotonic() - start
+        assert r.std_out == output
+        received[compress_output] = host.received
+        print("compress_output={0!s:<5}: {1:12d} bytes received {2:8.2f} s".format(compress_output, host.received, elapsed))
+    print("{0:>19}: {1:12.1f}x".format("reduction", received[False] / received[True]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Compares the MIME framing of encrypted messages with the previous one.
+
+Usage: python -m benchmarks.bench_encryption [--sizes 64 1024 8192]
+
+The auth contexts are fakes that do not encrypt, so the times are the cost of
+framing the parts alone. Time per MiB should not grow with the message size.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import timeit
+import typing as t
+
+from winrm.encryption import Encryption
+from winrm.exceptions import WinRMError
+
+HOST = "windows-host"
+SIGNATURE = b"\x01" * 16
+
+
+class FakeContext(object):
+    """Wraps by prepending a signature, stands in for every auth protocol"""
+
+    def __init__(self) -> None:
+        self.session_security = self
+        self.contexts = {HOST: self}
+        self.tls_connection = self
+
+    def get_cipher_name(self) -> str:
+        return "ECDHE-RSA-AES256-GCM-SHA384"
+
+    def wrap(self, message: bytes) -> t.Any:
+        return message
+
+    def unwrap(self, message: bytes, signature: bytes | None = None) -> bytes:
+        return message
+
+    def wrap_winrm(self, host: str, message: bytes) -> tuple[bytes, bytes]:
+        return message, SIGNATURE
+
+    def unwrap_winrm(self, host: str, message: bytes, signature: bytes) -> bytes:
+        return message
+
+
+class FakeSession(object):
+    def __init__(self) -> None:
+        self.auth = FakeContext()
+
+
+class NtlmContext(FakeContext):
+    def wrap(self, message: bytes) -> tuple[bytes, bytes]:
+        return message, SIGNATURE
+
+
+def legacy_encrypt(encryption: Encryption, message: bytes) -> bytes:
+    """The framing before the join based builder, kept as the baseline"""
+    if encryption.protocol == "credssp" and len(message) > encryption.SIXTEN_KB:
+        encrypted_message = b""
+        message_chunks = [message[i : i + encryption.SIXTEN_KB] for i in range(0, len(message), encryption.SIXTEN_KB)]
+        for message_chunk in message_chunks:
+            encrypted_chunk = legacy_encrypt_message(encryption, message_chunk)
+            encrypted_message += encrypted_chunk
+    else:
+        encrypted_message = legacy_encrypt_message(encryption, message)
+    encrypted_message += encryption.MIME_BOUNDARY + b"--\r\n"
+    return encrypted_message
+
+
+def legacy_encrypt_message(encryption: Encryption, message: bytes) -> bytes:
+    message_length = str(len(message)).encode()
+    encrypted_stream = encryption._build_message(message, HOST)
+    return (
+        encryption.MIME_BOUNDARY + b"\r\n"
+        b"\tContent-Type: " + encryption.protocol_string + b"\r\n"
+        b"\tOriginalContent: type=application/soap+xml;charset=UTF-8;Length=" + message_length + b"\r\n" + encryption.MIME_BOUNDARY + b"\r\n"
+        b"\tContent-Type: application/octet-stream\r\n" + encrypted_stream
+    )
+
+
+def legacy_decrypt(encryption: Encryption, content: bytes) -> bytes:
+    parts = content.split(encryption.MIME_BOUNDARY + b"\r\n")
+    parts = list(filter(None, parts))
+    message = b""
+
+    for i in range(0, len(parts)):
+        if i % 2 == 1:
+            continue
+
+        header = parts[i].strip()
+        payload = parts[i + 1]
+
+        expected_length = int(header.split(b"Length=")[1])
+
+        if payload.endswith(encryption.MIME_BOUNDARY + b"--\r\n"):
+            payload = payload[: len(payload) - 24]
+
+        encrypted_data = payload.replace(b"\tContent-Type: application/octet-stream\r\n", b"")
+        decrypted_message = encryption._decrypt_message(memoryview(encrypted_data), HOST)
+        if len(decrypted_message) != expected_length:
+            raise WinRMError("Encrypted length from server does not match the expected size")
+        message += decrypted_message
+
+    return message
+
+
+def build_encryption(protocol: str) -> Encryption:
+    session = FakeSession()
+    if protocol == "ntlm":
+        session.auth = NtlmContext()
+    return Encryption(session, protocol)  # type: ignore[arg-type]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 1024, 8192], help="message sizes in KiB")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements, the best one is reported")
+    args = parser.parse_args()
+
+    print("{0:>10} {1:>8} {2:>28} {3:>28}".format("protocol", "KiB", "encrypt legacy / new ms/MiB", "decrypt legacy / new ms/MiB"))
+    for protocol in ["ntlm", "kerberos", "credssp"]:
+        encryption = build_encryption(protocol)
+        for size in args.sizes:
+            message = os.urandom(size * 1024)
+            body, _ = encryption.encrypt(message, HOST)
+            assert body == legacy_encrypt(encryption, message)
+            assert encryption._decrypt_response(body, HOST) == legacy_decrypt(encryption, body) == message
+
+            # fewer runs for the big messages, the framing is measured per MiB
+            number = max(1, 4096 // size)
+            runs = {
+                "encrypt legacy": lambda: legacy_encrypt(encryption, message),
+                "encrypt": lambda: encryption.encrypt(message, HOST),
+                "decrypt legacy": lambda: legacy_decrypt(encryption, body),
+                "decrypt": lambda: encryption._decrypt_response(body, HOST),
+            }
+            best = {name: min(timeit.repeat(run, number=number, repeat=args.repeat)) / number / size * 1024 * 1000 for name, run in runs.items()}
+            print(
+                "{0:>10} {1:>8} {2:>13.2f} / {3:<12.2f} {4:>13.2f} / {5:<12.2f}".format(
+                    protocol, size, best["encrypt legacy"], best["encrypt"], best["decrypt legacy"], best["decrypt"]
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Compares the handling of Receive timeout faults with the full fault parse.
+
+Usage: python -m benchmarks.bench_fault [--polls 10000] [--repeat 5]
+
+Every Receive of a command without output ends with the OperationTimeout
+fault, a client with thousands of long running commands handles one for each
+of them every operation_timeout_sec. Other faults still take the full parse,
+the fast path only adds a failed search to them.
+"""
+
+from __future__ import annotations
+
+import argparse
+import timeit
+
+from winrm import xml_backend
+from winrm.exceptions import WinRMTransportError
+from winrm.protocol import Protocol
+
+TIMEOUT_FAULT = """<s:Envelope xml:lang="en-US" xmlns:s="http://www.w3.org/2003/05/soap-envelope" \
+xmlns:a="http://schemas.xmlsoap.org/ws/2004/08/addressing" xmlns:x="http://schemas.xmlsoap.org/ws/2004/09/transfer" \
+xmlns:e="http://schemas.xmlsoap.org/ws/2004/08/eventing" xmlns:n="http://schemas.xmlsoap.org/ws/2004/09/enumeration" \
+xmlns:w="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" xmlns:p="http://schemas.microsoft.com/wbem/wsman/1/wsman.xsd">\
+<s:Header><a:Action>http://schemas.dmtf.org/wbem/wsman/1/wsman/fault</a:Action>\
+<a:MessageID>uuid:A3F1E6B2-6E55-4C2B-8D7C-0F5C7D2B9A41</a:MessageID><a:To>http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous</a:To>\
+<a:RelatesTo>uuid:6C1B1A0E-3D2B-4F6A-9C55-2E0D5A7B8C93</a:RelatesTo></s:Header>\
+<s:Body><s:Fault><s:Code><s:Value>s:Receiver</s:Value><s:Subcode><s:Value>w:TimedOut</s:Value></s:Subcode></s:Code>\
+<s:Reason><s:Text xml:lang="en-US">The WS-Management service cannot complete the operation within the time specified in OperationTimeout.  </s:Text></s:Reason>\
+<s:Detail><f:WSManFault xmlns:f="http://schemas.microsoft.com/wbem/wsman/1/wsmanfault" Code="2150858793" Machine="windows-host">\
+<f:Message>The WS-Management service cannot complete the operation within the time specified in OperationTimeout.  </f:Message>\
+</f:WSManFault></s:Detail></s:Fault></s:Body></s:Envelope>"""
+
+SHELL_FAULT = TIMEOUT_FAULT.replace('Code="2150858793"', 'Code="2150858843"').replace("w:TimedOut", "w:InvalidSelectors")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--polls", type=int, default=10000, help="faults handled per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements, the best one is reported")
+    args = parser.parse_args()
+
+    protocol = Protocol("http://windows-host:5985/wsman", username="user", password="pass")
+    timeout_error = WinRMTransportError("http", 500, TIMEOUT_FAULT)
+    shell_error = WinRMTransportError("http", 500, SHELL_FAULT)
+    cases = {
+        "timeout fault": timeout_error,
+        "other fault": shell_error,
+    }
+
+    print("{0} faults, {1} backend".format(args.polls, xml_backend.get_backend().name))
+    print("{0:>16}{1:>12}{2:>12}".format("", "full parse", "fast path"))
+    for name, error in cases.items():
+        legacy = fast = float("inf")
+        # alternate between the two so that noise affects both alike
+        for _ in range(args.repeat):
+            legacy = min(legacy, timeit.timeit(lambda: protocol._parse_fault_xml(error), number=args.polls))
+            fast = min(fast, timeit.timeit(lambda: protocol._parse_fault(error), number=args.polls))
+        print("{0:>16}{1:>9.1f} ms{2:>9.1f} ms".format(name, legacy * 1000, fast * 1000))
+
+
+if __name__ == "__main__":
+    main()
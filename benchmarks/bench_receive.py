@@ -0,0 +1,79 @@
+"""Compares the Receive response parser with the previous multi-pass one.
+
+Usage: python -m benchmarks.bench_receive [--chunks 200] [--chunk-size 8192]
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import os
+import timeit
+import xml.etree.ElementTree as ET
+
+from winrm.protocol import Protocol
+
+
+def legacy_parse_receive(res: bytes) -> tuple[bytes, bytes, int, bool]:
+    """The parser before the single pass decoder, kept as the baseline"""
+    root = ET.fromstring(res)
+    stream_nodes = [node for node in root.findall(".//*") if node.tag.endswith("Stream")]
+    stdout = []
+    stderr = []
+    return_code = -1
+    for stream_node in stream_nodes:
+        if not stream_node.text:
+            continue
+        if stream_node.attrib["Name"] == "stdout":
+            stdout.append(base64.b64decode(stream_node.text.encode("ascii")))
+        elif stream_node.attrib["Name"] == "stderr":
+            stderr.append(base64.b64decode(stream_node.text.encode("ascii")))
+
+    command_done = len([node for node in root.findall(".//*") if node.get("State", "").endswith("CommandState/Done")]) == 1
+    if command_done:
+        return_code = int(next(node for node in root.findall(".//*") if node.tag.endswith("ExitCode")).text or -1)
+
+    return b"".join(stdout), b"".join(stderr), return_code, command_done
+
+
+def build_response(chunks: int, chunk_size: int) -> bytes:
+    streams = []
+    for i in range(chunks):
+        name = "stderr" if i % 10 == 9 else "stdout"
+        data = base64.b64encode(os.urandom(chunk_size)).decode()
+        streams.append('<rsp:Stream Name="{0}" CommandId="1">{1}</rsp:Stream>'.format(name, data))
+    return (
+        '<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:rsp="http://schemas.microsoft.com/wbem/wsman/1/windows/shell">'
+        "<s:Body><rsp:ReceiveResponse>{0}"
+        '<rsp:CommandState CommandId="1" State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Done">'
+        "<rsp:ExitCode>0</rsp:ExitCode></rsp:CommandState>"
+        "</rsp:ReceiveResponse></s:Body></s:Envelope>".format("".join(streams))
+    ).encode()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=200, help="stream elements in the response")
+    parser.add_argument("--chunk-size", type=int, default=8192, help="decoded bytes per stream element")
+    parser.add_argument("--number", type=int, default=10, help="parses per measurement")
+    parser.add_argument("--repeat", type=int, default=15, help="measurements, the best one is reported")
+    args = parser.parse_args()
+
+    protocol = Protocol("http://windows-host:5985/wsman", username="user", password="pass")
+    res = build_response(args.chunks, args.chunk_size)
+    assert protocol._parse_receive(res) == legacy_parse_receive(res)
+
+    print("response: {0} chunks, {1:.1f} MiB".format(args.chunks, len(res) / 1024 / 1024))
+    parsers = {"legacy": legacy_parse_receive, "single pass": protocol._parse_receive}
+    best = dict.fromkeys(parsers, float("inf"))
+    # alternate between the parsers so that noise affects both alike
+    for _ in range(args.repeat):
+        for name, parse in parsers.items():
+            best[name] = min(best[name], timeit.timeit(lambda: parse(res), number=args.number) / args.number)
+
+    for name, seconds in best.items():
+        print("{0:>12}: {1:8.2f} ms".format(name, seconds * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Compares Session.sync_dir with copying every file of a tree with put_file.
+
+Usage: python -m benchmarks.bench_sync [--size 200] [--changed 1]
+
+The tree is copied once, then the given percentage of its files get one
+changed block before both ways copy it again. Both run against the local
+test double of a Windows host used by the tests.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import time
+
+from winrm import Session
+from winrm.tests.fake_host import FakeHost
+
+REMOTE_DIR = "C:\\deploy"
+FILE_SIZE = 4 * 1024 * 1024
+
+
+def copy_tree(session: Session, local_dir: str, remote_dir: str) -> None:
+    for name in sorted(os.listdir(local_dir)):
+        session.put_file(os.path.join(local_dir, name), remote_dir + "\\" + name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=200, help="tree size in MiB, in files of 4 MiB")
+    parser.add_argument("--changed", type=float, default=1, help="percentage of files changed")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        count = max(1, args.size * 1024 * 1024 // FILE_SIZE)
+        for i in range(count):
+            with open(os.path.join(tmp, "file%04d.bin" % i), "wb") as file:
+                file.write(os.urandom(FILE_SIZE))
+
+        session = Session("windows-host", auth=("user", "pass"), shell_pool=True)
+        host = session.protocol.transport = FakeHost()
+        session.sync_dir(tmp, REMOTE_DIR)
+
+        changed = max(1, int(count * args.changed / 100))
+        for i in range(0, count, count // changed)[:changed]:
+            with open(os.path.join(tmp, "file%04d.bin" % i), "r+b") as file:
+                file.seek(FILE_SIZE // 2)
+                file.write(os.urandom(16))
+
+        # sync_dir first, put_file sends every file whatever the remote has
+        messages = host.messages
+        result = session.sync_dir(tmp, REMOTE_DIR)
+        print("{0:>9}: {1:8.2f} s {2:8d} messages {3:12d} bytes sent".format("sync_dir", result.elapsed, host.messages - messages, result.bytes_sent))
+
+        messages = host.messages
+        start = time.monotonic()
+        copy_tree(session, tmp, REMOTE_DIR)
+        elapsed = time.monotonic() - start
+        print("{0:>9}: {1:8.2f} s {2:8d} messages {3:12d} bytes sent".format("put_file", elapsed, host.messages - messages, count * FILE_SIZE))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Compares Session.put_file with copying a file through PowerShell command lines.
+
+Usage: python -m benchmarks.bench_transfer [--size 100]
+
+Both run against a local test double of a Windows host so the times are the
+cost of the WinRM messages alone, without network latency which would favour
+put_file even more as it sends far fewer messages.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import re
+import tempfile
+import time
+import typing as t
+from base64 import b64decode, b64encode
+
+from winrm import Session
+from winrm.tests.fake_host import FakeHost, Process
+
+REMOTE_PATH = "C:\\temp\\payload.bin"
+MAX_COMMAND_LINE = 8191
+CHUNK_SCRIPT = "$b = [Convert]::FromBase64String('{0}')\n$f = [IO.File]::Open('{1}', 'Append')\n$f.Write($b, 0, $b.Length)\n$f.Dispose()"
+
+
+class CommandLineHost(FakeHost):
+    """Also runs the chunk scripts of the command line copy"""
+
+    def start(self, process: Process) -> None:
+        match = re.match(r"\$b = \[Convert\]::FromBase64String\('([^']*)'\)\n\$f = \[IO.File\]::Open\('((?:[^']|'')*)', 'Append'\)", process.script)
+        if match:
+            self.files.setdefault(match.group(2).replace("''", "'"), bytearray()).extend(b64decode(match.group(1)))
+            process.exit_code = 0
+
+
+def command_line_chunk_size() -> int:
+    # the script is encoded as UTF-16 and then base64 for -encodedcommand
+    prefix = len("powershell -encodedcommand ")
+    script_chars = (MAX_COMMAND_LINE - prefix) // 4 * 3 // 2
+    data_chars = script_chars - len(CHUNK_SCRIPT.format("", REMOTE_PATH))
+    return data_chars // 4 * 3
+
+
+def put_file_command_line(session: Session, local_path: str, remote_path: str) -> None:
+    """The usual way to copy a file without put_file, one command per chunk"""
+    chunk_size = command_line_chunk_size()
+    with open(local_path, "rb") as file:
+        while True:
+            data = file.read(chunk_size)
+            if not data:
+                break
+            session.run_ps(CHUNK_SCRIPT.format(b64encode(data).decode(), remote_path.replace("'", "''")))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=100, help="file size in MiB")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        local_path = os.path.join(tmp, "payload.bin")
+        with open(local_path, "wb") as file:
+            for _ in range(args.size):
+                file.write(os.urandom(1024 * 1024))
+        with open(local_path, "rb") as file:
+            digest = hashlib.sha256(file.read()).hexdigest()
+
+        results = {}
+        copies: list[tuple[str, t.Callable[[Session, str, str], object]]] = [("put_file", Session.put_file), ("command lines", put_file_command_line)]
+        for name, copy in copies:
+            # the command line copy at least reuses its shell
+            session = Session("windows-host", auth=("user", "pass"), shell_pool=True)
+            host = session.protocol.transport = CommandLineHost()
+            start = time.monotonic()
+            copy(session, local_path, REMOTE_PATH)
+            elapsed = time.monotonic() - start
+            assert hashlib.sha256(host.files[REMOTE_PATH]).hexdigest() == digest
+            results[name] = elapsed
+            print("{0:>14}: {1:8.2f} s {2:8.1f} MiB/s {3:8d} messages".format(name, elapsed, args.size / elapsed, host.messages))
+
+        print("{0:>14}: {1:8.1f}x".format("speedup", results["command lines"] / results["put_file"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Compares the XML backends on the responses pywinrm parses.
+
+Usage: python -m benchmarks.bench_xml [--number 20] [--repeat 10]
+
+The Receive responses are sized like the envelopes a server returns with the
+default MaxEnvelopeSize of 150KiB and with it raised to 500KiB and 4MiB.
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import timeit
+import typing as t
+
+from benchmarks.bench_receive import build_response
+from winrm import Session, xml_backend
+from winrm.exceptions import WinRMTransportError
+from winrm.protocol import Protocol
+
+FAULT = """<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope">
+<s:Body><s:Fault>
+<s:Code><s:Value>s:Receiver</s:Value></s:Code>
+<s:Reason><s:Text xml:lang="en-US">The WS-Management service cannot complete the operation within the time specified in OperationTimeout.</s:Text></s:Reason>
+<s:Detail><f:WSManFault xmlns:f="http://schemas.microsoft.com/wbem/wsman/1/wsmanfault" Code="2150858793"/></s:Detail>
+</s:Fault></s:Body></s:Envelope>"""
+
+CLIXML = (
+    b'#< CLIXML\r\n<Objs Version="1.1.0.1" xmlns="http://schemas.microsoft.com/powershell/2004/04">'
+    + b"<S S=\"Error\">fake : The term 'fake' is not recognized as the name of a cmdlet._x000D__x000A_</S>" * 50
+    + b"</Objs>"
+)
+
+
+def receive_stream(res: bytes) -> None:
+    parser = xml_backend.pull_parser()
+    for i in range(0, len(res), 65536):
+        parser.feed(res[i : i + 65536])
+        for _, node in parser.read_events():
+            if node.tag.endswith("Stream"):
+                node.clear()
+    parser.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20, help="parses per measurement")
+    parser.add_argument("--repeat", type=int, default=10, help="measurements, the best one is reported")
+    args = parser.parse_args()
+
+    protocol = Protocol("http://windows-host:5985/wsman", username="user", password="pass")
+    # the base64 text of a chunk is a third bigger than its data
+    receives = {
+        "receive 150KiB": build_response(14, 8192),
+        "receive 500KiB": build_response(46, 8192),
+        "receive 4MiB": build_response(380, 8192),
+    }
+    cases: dict[str, t.Callable[[], object]] = {}
+    for name, res in receives.items():
+        cases[name] = functools.partial(protocol._parse_receive, res)
+    cases["stream 4MiB"] = functools.partial(receive_stream, receives["receive 4MiB"])
+    cases["fault"] = lambda: protocol._parse_fault(WinRMTransportError("http", 500, FAULT))
+    cases["clixml"] = lambda: Session._clean_error_msg(CLIXML)
+
+    backends = ["stdlib"] + (["lxml"] if xml_backend.HAVE_LXML else [])
+    best = {(case, backend): float("inf") for case in cases for backend in backends}
+    # alternate between the backends so that noise affects both alike
+    for _ in range(args.repeat):
+        for backend in backends:
+            xml_backend.set_backend(backend)
+            for case, run in cases.items():
+                seconds = timeit.timeit(run, number=args.number) / args.number
+                best[case, backend] = min(best[case, backend], seconds)
+    xml_backend.set_backend()
+
+    print("{0:>16}".format("") + "".join("{0:>12}".format(backend) for backend in backends))
+    for case in cases:
+        print("{0:>16}".format(case) + "".join("{0:>9.3f} ms".format(best[case, backend] * 1000) for backend in backends))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,25 @@
 from __future__ import annotations
 
+import codecs
 import collections.abc
+import concurrent.futures
+import contextlib
+import functools
+import logging
 import re
+import threading
 import typing as t
 import warnings
-import xml.etree.ElementTree as ET
 from base64 import b64encode
 
+from winrm import clixml
+from winrm.compression import DecompressSink, wrap_command, wrap_script
+from winrm.exceptions import WinRMCommandTimeoutError, WinRMError
 from winrm.protocol import Protocol
+from winrm.pshost import PowerShellHost
+from winrm.shellpool import ShellKey, ShellPool, get_shared_pool
+from winrm.sinks import OutputSink, as_sink
+from winrm.transfer import SyncResult, TransferResult, get_file, put_file, sync_dir
 
 __version__ = "0.5.0"
 
@@ -20,67 +32,517 @@ FEATURE_READ_TIMEOUT = True
 FEATURE_OPERATION_TIMEOUT = True
 FEATURE_PROXY_SUPPORT = True
 
+log = logging.getLogger(__name__)
+
+# what the output of a Response can be backed by
+ResponseOutput = t.Union[bytes, bytearray, memoryview, t.List[bytes], OutputSink]
+
+# the size of the pieces iter_lines decodes a contiguous output in
+LINE_CHUNK_SIZE = 64 * 1024
+
+# run_cmd options that a PowerShellHost cannot honour
+_RUN_CMD_OPTIONS = ("stdout", "stderr", "max_output_bytes", "timeout_sec", "cancel")
+
+
+def codepage_encoding(codepage: int) -> str:
+    """Returns the Python codec of a Windows code page, e.g. cp437 or utf-8"""
+    return "utf-8" if codepage == 65001 else "cp%d" % codepage
+
 
 class Response(object):
-    """Response from a remote command execution"""
+    """Response from a remote command execution
+
+    The stdout and stderr values can be given as bytes, a memoryview, a list
+    of chunks or the OutputSink the output was written to, e.g. a SpillSink
+    holding it in a temporary file. A sink is only read when the value is
+    accessed, a list of chunks is joined the first time.
+    When clixml_stderr is set std_err is the text of the CLIXML on stderr,
+    converted when it is first read, and stderr_records the decoded records.
+
+    stdout_text and stderr_text decode the output with the code page the
+    shell ran with and are cached, iter_lines decodes it piece by piece.
+    truncated is set when the command was terminated at max_output_bytes.
+    """
+
+    __slots__ = (
+        "_std_out",
+        "_std_err",
+        "status_code",
+        "codepage",
+        "clixml_stderr",
+        "truncated",
+        "_std_err_text",
+        "_stderr_records",
+        "_stdout_text",
+        "_stderr_text",
+    )
+
+    def __init__(self, args: tuple[ResponseOutput, ResponseOutput, int], clixml_stderr: bool = False, codepage: int = 437, truncated: bool = False) -> None:
+        self._std_out: ResponseOutput
+        self._std_err: ResponseOutput
+        self._std_err_text: bytes | None = None
+        self._stderr_records: list[clixml.Record] | None = None
+        self._stdout_text: str | None = None
+        self._stderr_text: str | None = None
+        self.std_out, self.std_err, self.status_code = args  # type: ignore[assignment]
+        self.clixml_stderr = clixml_stderr
+        self.codepage = codepage
+        self.truncated = truncated
+
+    @property
+    def std_out(self) -> bytes:
+        self._std_out = value = self._join(self._std_out)
+        return value if isinstance(value, bytes) else value.getvalue()
+
+    @std_out.setter
+    def std_out(self, value: ResponseOutput) -> None:
+        self._std_out = value
+        self._stdout_text = None
+
+    @property
+    def std_err(self) -> bytes:
+        self._std_err = joined = self._join(self._std_err)
+        value = joined if isinstance(joined, bytes) else joined.getvalue()
+        if not self.clixml_stderr:
+            return value
+        if self._std_err_text is None:
+            self._std_err_text = Session._clean_error_msg(value)
+        return self._std_err_text
+
+    @std_err.setter
+    def std_err(self, value: ResponseOutput) -> None:
+        self._std_err = value
+        self._std_err_text = None
+        self._stderr_records = None
+        self._stderr_text = None
+
+    @property
+    def stdout_text(self) -> str:
+        """stdout decoded with the code page of the shell"""
+        if self._stdout_text is None:
+            self._stdout_text = self.std_out.decode(codepage_encoding(self.codepage), errors="replace")
+        return self._stdout_text
+
+    @property
+    def stderr_text(self) -> str:
+        """stderr decoded with the code page of the shell, the text converted
+        from CLIXML is always UTF-8
+        """
+        if self._stderr_text is None:
+            encoding = "utf-8" if self.clixml_stderr else codepage_encoding(self.codepage)
+            self._stderr_text = self.std_err.decode(encoding, errors="replace")
+        return self._stderr_text
+
+    @property
+    def stderr_records(self) -> list[clixml.Record]:
+        """The records of the CLIXML on stderr, e.g. errors, warnings and
+        progress, decoded when first read. Empty when stderr is not CLIXML.
+        """
+        if self._stderr_records is None:
+            self._std_err = joined = self._join(self._std_err)
+            value = joined if isinstance(joined, bytes) else joined.getvalue()
+            self._stderr_records = clixml.decode_stream(value) if self.clixml_stderr and value.startswith(clixml.CLIXML_HEADER) else []
+        return self._stderr_records
 
-    def __init__(self, args: tuple[bytes, bytes, int]) -> None:
-        self.std_out, self.std_err, self.status_code = args
+    def iter_lines(self, stream: str = "stdout") -> collections.abc.Iterator[str]:
+        """
+        Yields the lines of the output without their line ending, decoding it
+        a chunk at a time instead of decoding the whole output at once.
+        @param string stream: stdout or stderr.
+        @rtype iterator of string
+        """
+        if stream == "stderr" and self.clixml_stderr:
+            chunks: collections.abc.Iterable[bytes | memoryview] = self._iter_chunks(self.std_err)
+            encoding = "utf-8"
+        else:
+            chunks = self._iter_chunks(self._std_out if stream == "stdout" else self._std_err)
+            encoding = codepage_encoding(self.codepage)
+
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        pending = ""
+        for chunk in chunks:
+            lines = (pending + decoder.decode(chunk)).split("\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line[:-1] if line.endswith("\r") else line
+        pending += decoder.decode(b"", final=True)
+        if pending:
+            yield pending[:-1] if pending.endswith("\r") else pending
+
+    @staticmethod
+    def _join(value: ResponseOutput) -> bytes | OutputSink:
+        # the chunks are joined once, the result replaces them
+        if isinstance(value, list):
+            return b"".join(value)
+        if isinstance(value, (bytearray, memoryview)):
+            return bytes(value)
+        return value
+
+    @staticmethod
+    def _iter_chunks(value: ResponseOutput) -> collections.abc.Iterator[bytes | memoryview]:
+        if isinstance(value, list):
+            return iter(value)
+        if isinstance(value, OutputSink):
+            return value.iter_chunks(LINE_CHUNK_SIZE)
+        view = memoryview(value)
+        return (view[i : i + LINE_CHUNK_SIZE] for i in range(0, len(view), LINE_CHUNK_SIZE))
 
     def __repr__(self) -> str:
         # TODO put tree dots at the end if out/err was truncated
-        return '<Response code {0}, out "{1!r}", err "{2!r}">'.format(self.status_code, self.std_out[:20], self.std_err[:20])
+        return '<Response code {0}{1}, out "{2!r}", err "{3!r}">'.format(
+            self.status_code, " truncated" if self.truncated else "", self._head(self._std_out), self._head(self._std_err)
+        )
+
+    @staticmethod
+    def _head(value: ResponseOutput) -> bytes:
+        if isinstance(value, OutputSink):
+            return value.head(20)
+        if isinstance(value, list):
+            return b"".join(value[:20])[:20]
+        return bytes(value[:20])
+
+
+def _log_teardown_error(shell_id: str, future: concurrent.futures.Future[None]) -> None:
+    # nobody waits for a background Delete, a failure would go unnoticed
+    error = None if future.cancelled() else future.exception()
+    if error is not None:
+        log.warning("Failed to delete shell %s in the background: %s", shell_id, error)
 
 
 class Session(object):
-    # TODO implement context manager methods
-    def __init__(self, target: str, auth: tuple[str, str], **kwargs: t.Any) -> None:
+    """
+    A connection to a Windows host for running commands and scripts.
+
+    By default every command opens and closes its own shell. Set shell_pool to
+    keep shells open between commands: True creates a ShellPool for this
+    session, 'shared' uses the process wide pool for the host and user, or a
+    ShellPool instance can be passed in. Any other keyword arguments are
+    passed to Protocol.
+
+    Set ps_host to run the scripts of run_ps in a PowerShellHost, a
+    powershell.exe kept running per set of shell options, instead of starting
+    powershell.exe for every script. A dict is passed to PowerShellHost as
+    keyword arguments, e.g. startup_script or script_timeout_sec. The hosts
+    open their own shells, they do not take shells from shell_pool.
+
+    teardown sets the requests sent after a command that runs in its own
+    shell. 'full' signals the command to terminate and deletes the shell,
+    'minimal' only deletes the shell as that ends the command too and
+    'background' sends the Delete from a background thread so the command
+    returns as soon as its output is received. The pending Deletes are
+    waited for by close. Pooled shells always get the Signal.
+    """
+
+    TEARDOWN_MODES = ("full", "minimal", "background")
+
+    def __init__(
+        self,
+        target: str,
+        auth: tuple[str, str],
+        shell_pool: bool | t.Literal["shared"] | ShellPool = False,
+        ps_host: bool | dict[str, t.Any] = False,
+        teardown: t.Literal["full", "minimal", "background"] = "full",
+        **kwargs: t.Any,
+    ) -> None:
+        if teardown not in self.TEARDOWN_MODES:
+            raise WinRMError("teardown must be one of {0}".format(", ".join(self.TEARDOWN_MODES)))
+        self.teardown = teardown
+        self._teardown_executor: concurrent.futures.ThreadPoolExecutor | None = None
+        self._teardown_lock = threading.Lock()
         username, password = auth
         self.url = self._build_url(target, kwargs.get("transport", "plaintext"))
         self.protocol = Protocol(self.url, username=username, password=password, **kwargs)
 
-    def run_cmd(self, command: str, args: collections.abc.Iterable[str | bytes] = ()) -> Response:
-        # TODO optimize perf. Do not call open/close shell every time
-        shell_id = self.protocol.open_shell()
-        command_id = self.protocol.run_command(shell_id, command, args)
-        rs = Response(self.protocol.get_command_output(shell_id, command_id))
-        self.protocol.cleanup_command(shell_id, command_id)
-        self.protocol.close_shell(shell_id)
-        return rs
+        self._owns_pool = shell_pool is True
+        self.shell_pool: ShellPool | None = None
+        if isinstance(shell_pool, ShellPool):
+            self.shell_pool = shell_pool
+        elif shell_pool == "shared":
+            self.shell_pool = get_shared_pool(self.protocol)
+        elif shell_pool is True:
+            self.shell_pool = ShellPool(self.protocol)
 
-    def run_ps(self, script: str) -> Response:
-        """base64 encodes a Powershell script and executes the powershell
-        encoded script command
+        self.ps_host_options: dict[str, t.Any] | None = None
+        if ps_host:
+            self.ps_host_options = dict(ps_host) if isinstance(ps_host, dict) else {}
+        self._ps_hosts: dict[ShellKey, PowerShellHost] = {}
+        self._ps_hosts_lock = threading.Lock()
+
+    def __enter__(self) -> Session:
+        return self
+
+    def __exit__(self, *args: t.Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stops the PowerShell hosts and closes the shells kept open by the
+        session's own shell pool
+        """
+        with self._ps_hosts_lock:
+            hosts = list(self._ps_hosts.values())
+            self._ps_hosts.clear()
+        for host in hosts:
+            host.close()
+        if self.shell_pool and self._owns_pool:
+            self.shell_pool.close()
+        with self._teardown_lock:
+            executor, self._teardown_executor = self._teardown_executor, None
+        if executor:
+            executor.shutdown(wait=True)
+            # the background Deletes left the connections open
+            self.protocol.transport.close_session()
+
+    def run_cmd(
+        self,
+        command: str,
+        args: collections.abc.Iterable[str | bytes] = (),
+        working_directory: str | None = None,
+        env_vars: dict[str, str] | None = None,
+        noprofile: bool = False,
+        codepage: int = 437,
+        stdout: OutputSink | t.BinaryIO | None = None,
+        stderr: OutputSink | t.BinaryIO | None = None,
+        compress_output: bool = False,
+        max_output_bytes: int | None = None,
+        timeout_sec: float | None = None,
+        cancel: threading.Event | None = None,
+    ) -> Response:
+        """
+        Runs a command and waits for it to finish. The output is kept in
+        memory unless stdout or stderr is set to an OutputSink from
+        winrm.sinks or a binary file object to write the output to.
+
+        compress_output runs the command from a PowerShell process that
+        compresses its stdout with gzip, see winrm.compression. This saves
+        bandwidth for large text output at the cost of CPU time on both
+        ends.
+
+        max_output_bytes stops a runaway command: once more than that many
+        bytes of stdout and stderr were received, the output is cut off at
+        the limit, the command is terminated and the Response is marked
+        truncated. With compress_output the compressed bytes are counted.
+
+        timeout_sec and cancel stop waiting for a hung command, see
+        Protocol.iter_command_output. The command is terminated and
+        WinRMCommandTimeoutError, or WinRMCommandCancelledError when cancel
+        was set, is raised with the output received so far. The shell stays
+        in the shell pool.
+        """
+        if compress_output:
+            command, args = wrap_command(command, args), ()
+        return self._run_cmd(
+            command,
+            args,
+            compress_output,
+            working_directory,
+            env_vars,
+            noprofile,
+            codepage,
+            stdout,
+            stderr,
+            max_output_bytes,
+            timeout_sec,
+            cancel,
+        )
+
+    def _run_cmd(
+        self,
+        command: str,
+        args: collections.abc.Iterable[str | bytes],
+        compressed: bool,
+        working_directory: str | None = None,
+        env_vars: dict[str, str] | None = None,
+        noprofile: bool = False,
+        codepage: int = 437,
+        stdout: OutputSink | t.BinaryIO | None = None,
+        stderr: OutputSink | t.BinaryIO | None = None,
+        max_output_bytes: int | None = None,
+        timeout_sec: float | None = None,
+        cancel: threading.Event | None = None,
+    ) -> Response:
+        shell_options: dict[str, t.Any] = dict(working_directory=working_directory, env_vars=env_vars, noprofile=noprofile, codepage=codepage)
+        out_sink = as_sink(stdout)
+        err_sink = as_sink(stderr)
+        decompress_sink = DecompressSink(out_sink) if compressed else None
+        return_code = -1
+        remaining = max_output_bytes
+        truncated = False
+        stopped: WinRMCommandTimeoutError | None = None
+        with self._command(command, args, shell_options) as (shell_id, command_id):
+            output = self.protocol.iter_command_output(shell_id, command_id, timeout_sec, cancel)
+            try:
+                for stream, data in output:
+                    if isinstance(data, int):
+                        return_code = data
+                        continue
+                    if remaining is not None:
+                        truncated = len(data) > remaining
+                        data = data[:remaining]
+                        remaining -= len(data)
+                    if stream == "stdout":
+                        (decompress_sink or out_sink).write(data)
+                    else:
+                        err_sink.write(data)
+                    if truncated:
+                        output.close()
+                        break
+            except WinRMCommandTimeoutError as err:
+                # raised once the shell is released so it can be reused
+                stopped = err
+            # terminates the command when the output was truncated
+            self._cleanup_command(shell_id, command_id)
+
+        if stopped is not None:
+            partial = Response((out_sink, err_sink, return_code), codepage=codepage)
+            stopped.stdout, stopped.stderr = partial.std_out, partial.std_err
+            raise stopped
+        if decompress_sink and not truncated:
+            decompress_sink.finish()
+        return Response((out_sink, err_sink, return_code), codepage=codepage, truncated=truncated)
+
+    def stream_cmd(
+        self,
+        command: str,
+        args: collections.abc.Iterable[str | bytes] = (),
+        working_directory: str | None = None,
+        env_vars: dict[str, str] | None = None,
+        noprofile: bool = False,
+        codepage: int = 437,
+    ) -> collections.abc.Iterator[tuple[str, bytes | int]]:
+        """
+        Runs a command like run_cmd but yields the output as it arrives
+        instead of buffering it, see Protocol.iter_command_output. Stopping
+        the iteration early closes the shell the command runs in.
+        """
+        shell_options: dict[str, t.Any] = dict(working_directory=working_directory, env_vars=env_vars, noprofile=noprofile, codepage=codepage)
+        with self._command(command, args, shell_options) as (shell_id, command_id):
+            yield from self.protocol.iter_command_output(shell_id, command_id)
+            self._cleanup_command(shell_id, command_id)
+
+    def stream_ps(self, script: str, **kwargs: t.Any) -> collections.abc.Iterator[tuple[str, bytes | int]]:
+        """Runs a Powershell script like run_ps but yields the output as it
+        arrives, see stream_cmd. The stderr chunks are not converted from
+        CLIXML.
         """
-        # must use utf16 little endian on windows
         encoded_ps = b64encode(script.encode("utf_16_le")).decode("ascii")
-        rs = self.run_cmd("powershell -encodedcommand {0}".format(encoded_ps))
-        if len(rs.std_err):
-            # if there was an error message, clean it it up and make it human
-            # readable
-            rs.std_err = self._clean_error_msg(rs.std_err)
+        return self.stream_cmd("powershell -encodedcommand {0}".format(encoded_ps), **kwargs)
+
+    def put_file(self, local_path: str, remote_path: str, offset: int = 0, resume: bool = False) -> TransferResult:
+        """Copies a local file to the host through the stdin of a PowerShell
+        process and verifies its SHA256 hash, see winrm.transfer.put_file.
+        """
+        return put_file(self, local_path, remote_path, offset, resume)
+
+    def get_file(self, remote_path: str, local_path: str, offset: int = 0, resume: bool = False) -> TransferResult:
+        """Copies a file from the host through the stdout of a PowerShell
+        process and verifies its SHA256 hash, see winrm.transfer.get_file.
+        """
+        return get_file(self, remote_path, local_path, offset, resume)
+
+    def sync_dir(self, local_dir: str, remote_dir: str, delete: bool = False, **kwargs: t.Any) -> SyncResult:
+        """Copies the files of a local directory that are missing or differ
+        on the host, only the changed blocks of a file are sent, see
+        winrm.transfer.sync_dir.
+        """
+        return sync_dir(self, local_dir, remote_dir, delete=delete, **kwargs)
+
+    @contextlib.contextmanager
+    def _command(
+        self,
+        command: str,
+        args: collections.abc.Iterable[str | bytes],
+        shell_options: dict[str, t.Any],
+        console_mode_stdin: bool = True,
+        skip_cmd_shell: bool = False,
+    ) -> collections.abc.Iterator[tuple[str, str]]:
+        if self.shell_pool:
+            with self.shell_pool.command(command, args, console_mode_stdin, skip_cmd_shell, **shell_options) as ids:
+                yield ids
+            return
+
+        shell_id = self.protocol.open_shell(**shell_options)
+        try:
+            command_id = self.protocol.run_command(shell_id, command, args, console_mode_stdin, skip_cmd_shell)
+            yield shell_id, command_id
+        except BaseException:
+            # don't leave the shell running, e.g. when a stream is abandoned
+            try:
+                self.protocol.close_shell(shell_id)
+            except Exception:
+                pass
+            raise
+        if self.teardown == "background":
+            self._close_shell_later(shell_id)
+        else:
+            self.protocol.close_shell(shell_id)
+
+    def _cleanup_command(self, shell_id: str, command_id: str) -> None:
+        if self.shell_pool or self.teardown == "full":
+            self.protocol.cleanup_command(shell_id, command_id)
+        else:
+            # the shell is deleted next, which ends the command as well
+            self.protocol._forget_command(command_id)
+
+    def _close_shell_later(self, shell_id: str) -> None:
+        with self._teardown_lock:
+            if self._teardown_executor is None:
+                self._teardown_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="winrm-teardown")
+            # the connections stay open for the next command, close closes them.
+            # An encrypted transport serializes the Delete with the messages of
+            # the caller, so it cannot disturb their sequence numbers.
+            future = self._teardown_executor.submit(self.protocol.close_shell, shell_id, close_session=False)
+            future.add_done_callback(functools.partial(_log_teardown_error, shell_id))
+
+    def run_ps(self, script: str, compress_output: bool = False, **kwargs: t.Any) -> Response:
+        """base64 encodes a Powershell script and executes the powershell
+        encoded script command, keyword arguments are passed to run_cmd.
+        The CLIXML on stderr is only converted when stderr is kept in memory.
+
+        With ps_host set the script runs in the PowerShellHost for the shell
+        options instead, unless stdout, stderr, compress_output,
+        max_output_bytes, timeout_sec or cancel are given.
+        """
+        if self.ps_host_options is not None and not compress_output and all(kwargs.get(name) is None for name in _RUN_CMD_OPTIONS):
+            shell_options = dict((name, value) for name, value in kwargs.items() if name not in _RUN_CMD_OPTIONS)
+            return Response(self._ps_host(**shell_options).run(script), codepage=shell_options.get("codepage", 437))
+
+        if compress_output:
+            command = wrap_script(script)
+        else:
+            # must use utf16 little endian on windows
+            encoded_ps = b64encode(script.encode("utf_16_le")).decode("ascii")
+            command = "powershell -encodedcommand {0}".format(encoded_ps)
+        rs = self._run_cmd(command, (), compress_output, **kwargs)
+        # the CLIXML error message is made human readable when std_err is read
+        rs.clixml_stderr = kwargs.get("stderr") is None
         return rs
 
-    def _clean_error_msg(self, msg: bytes) -> bytes:
+    def _ps_host(
+        self,
+        working_directory: str | None = None,
+        env_vars: dict[str, str] | None = None,
+        noprofile: bool = False,
+        codepage: int = 437,
+    ) -> PowerShellHost:
+        shell_options: dict[str, t.Any] = dict(working_directory=working_directory, env_vars=env_vars, noprofile=noprofile, codepage=codepage)
+        key = ShellPool._build_key(shell_options)
+        with self._ps_hosts_lock:
+            host = self._ps_hosts.get(key)
+            if host is None:
+                # the host keeps its shell until the session closes, taking it from
+                # shell_pool would leave one slot less for run_cmd for good
+                host = self._ps_hosts[key] = PowerShellHost(self.protocol, **dict(self.ps_host_options or {}, **shell_options))
+            return host
+
+    @staticmethod
+    def _clean_error_msg(msg: bytes) -> bytes:
         """converts a Powershell CLIXML message to a more human readable string"""
-        # TODO prepare unit test, beautify code
         # if the msg does not start with this, return it as is
-        if msg.startswith(b"#< CLIXML\r\n"):
-            # for proper xml, we need to remove the CLIXML part
-            # (the first line)
-            msg_xml = msg[11:]
+        if msg.startswith(clixml.CLIXML_HEADER + b"\r\n"):
             try:
-                # remove the namespaces from the xml for easier processing
-                msg_xml = self._strip_namespace(msg_xml)
-                root = ET.fromstring(msg_xml)
-                # the S node is the error message, find all S nodes
-                nodes = root.findall("./S")
-                new_msg = ""
-                for s in nodes:
-                    # append error msg string to result, also
-                    # the hex chars represent CRLF so we replace with newline
-                    if s.text:
-                        new_msg += s.text.replace("_x000D__x000A_", "\n")
+                # the text of the error, warning, verbose and debug records,
+                # progress records are skipped without being converted
+                new_msg = clixml.stream_text(msg)
             except Exception as e:
                 # if any of the above fails, the msg was not true xml
                 # print a warning and return the original string
@@ -96,14 +558,6 @@ class Session(object):
         # just return the original message
         return msg
 
-    def _strip_namespace(self, xml: bytes) -> bytes:
-        """strips any namespaces from an xml string"""
-        p = re.compile(b'xmlns=*[""][^""]*[""]')
-        allmatches = p.finditer(xml)
-        for match in allmatches:
-            xml = xml.replace(match.group(), b"")
-        return xml
-
     @staticmethod
     def _build_url(target: str, transport: str) -> str:
         match = re.match(r"(?i)^((?P<scheme>http[s]?)://)?(?P<host>[0-9a-z-_.]+)(:(?P<port>\d+))?(?P<path>(/)?(wsman)?)?", target)  # NOQA
@@ -122,3 +576,8 @@ class Session(object):
         if not path:
             path = "wsman"
         return "{0}://{1}:{2}/{3}".format(scheme, host, port, path.lstrip("/"))
+
+
+# imported last as it builds on Session
+from winrm.fleet import Fleet as Fleet  # noqa: E402
+from winrm.fleet import FleetResult as FleetResult  # noqa: E402
@@ -0,0 +1,610 @@
+"""asyncio versions of Protocol and Session.
+
+A command run through the blocking API keeps a thread busy for its whole
+lifetime, most of it parked in a Receive long poll. AsyncProtocol and
+AsyncSession run the same WSMan operations as coroutines over httpx so a
+single event loop can drive commands on thousands of hosts.
+
+The module needs the aio extra, pip install pywinrm[aio].
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import collections.abc
+import os
+import ssl
+import typing as t
+import uuid
+from urllib.parse import urlsplit
+
+import requests.utils
+
+from winrm import Response, Session
+from winrm.encryption import Encryption
+from winrm.exceptions import (
+    InvalidCredentialsError,
+    WinRMError,
+    WinRMOperationTimeoutError,
+    WinRMTransportError,
+)
+from winrm.protocol import BaseProtocol
+from winrm.sinks import OutputSink, as_sink
+
+HAVE_HTTPX = False
+try:
+    import httpx
+
+    HAVE_HTTPX = True
+except ImportError:
+    pass
+
+HAVE_SPNEGO = False
+try:
+    import spnego
+    import spnego.channel_bindings
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes
+
+    HAVE_SPNEGO = True
+except ImportError:
+    pass
+
+__all__ = ["AsyncTransport", "AsyncProtocol", "AsyncSession"]
+
+SOAP_CONTENT_TYPE = "application/soap+xml;charset=UTF-8"
+
+
+class _SpnegoAuth(object):
+    """Exposes a spnego context through the interface Encryption expects from
+    the requests auth handlers.
+    """
+
+    def __init__(self, context: spnego.ContextProxy) -> None:
+        self.context = context
+        self.session_security = self
+
+    def wrap(self, message: bytes) -> tuple[bytes, bytes]:
+        result = self.context.wrap_winrm(message)
+        return result.data, result.header
+
+    def unwrap(self, message: bytes, signature: bytes) -> bytes:
+        return self.context.unwrap_winrm(signature, message)
+
+    def wrap_winrm(self, host: str | bytes | None, message: bytes) -> tuple[bytes, bytes]:
+        return self.wrap(message)
+
+    def unwrap_winrm(self, host: str | bytes | None, message: bytes, signature: bytes) -> bytes:
+        return self.unwrap(message, signature)
+
+
+class _Connection(object):
+    """A keep-alive connection, NTLM and Kerberos authenticate the connection
+    rather than the requests so each one has its own security context and its
+    own client limited to a single connection.
+    """
+
+    def __init__(self, client: httpx.AsyncClient) -> None:
+        self.client = client
+        self.auth: _SpnegoAuth | None = None
+        self.encryption: Encryption | None = None
+        # the network stream the security context is bound to
+        self.stream: object | None = None
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class AsyncTransport(object):
+    """Sends WSMan messages with httpx.
+
+    Up to max_connections requests are sent at the same time, further ones
+    wait for a connection to be released. Idle connections are kept open
+    and reused until close_session is called.
+
+    Supports the basic, plaintext, ssl, certificate, ntlm and kerberos auth
+    methods, NTLM and Kerberos use pyspnego. Message encryption works as
+    with Transport. CredSSP and proxies are not supported.
+    """
+
+    DEFAULT_MAX_CONNECTIONS = 4
+
+    def __init__(
+        self,
+        endpoint: str,
+        username: str | None = None,
+        password: str | None = None,
+        service: str | None = None,
+        ca_trust_path: t.Literal["legacy_requests"] | str | None = "legacy_requests",
+        cert_pem: str | None = None,
+        cert_key_pem: str | None = None,
+        read_timeout_sec: int | None = None,
+        server_cert_validation: t.Literal["validate", "ignore"] | None = "validate",
+        kerberos_delegation: bool = False,
+        kerberos_hostname_override: str | None = None,
+        auth_method: t.Literal["basic", "certificate", "ntlm", "kerberos", "plaintext", "ssl"] = "plaintext",
+        message_encryption: t.Literal["auto", "always", "never"] = "auto",
+        send_cbt: bool = True,
+        proxy: t.Literal["legacy_requests"] | None = None,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    ) -> None:
+        self.endpoint = endpoint
+        self.username = username
+        self.password = password
+        self.service = service
+        self.ca_trust_path = ca_trust_path
+        self.cert_pem = cert_pem
+        self.cert_key_pem = cert_key_pem
+        self.read_timeout_sec = read_timeout_sec
+        self.server_cert_validation = server_cert_validation
+        self.kerberos_delegation = kerberos_delegation
+        self.kerberos_hostname_override = kerberos_hostname_override
+        self.auth_method = auth_method
+        self.message_encryption = message_encryption
+        self.send_cbt = send_cbt
+        self.max_connections = max_connections
+
+        if not HAVE_HTTPX:
+            raise WinRMError("the asyncio transport requires httpx, install pywinrm[aio]")
+        if self.auth_method == "credssp":
+            raise WinRMError("auth method credssp is not supported by the asyncio transport")
+        if self.server_cert_validation not in [None, "validate", "ignore"]:
+            raise WinRMError("invalid server_cert_validation mode: %s" % self.server_cert_validation)
+        if self.message_encryption not in ["auto", "always", "never"]:
+            raise WinRMError("invalid message_encryption arg: %s. Should be 'auto', 'always', or 'never'" % self.message_encryption)
+        if proxy not in [None, "legacy_requests"]:
+            raise WinRMError("proxies are not supported by the asyncio transport")
+        if proxy == "legacy_requests" and requests.utils.get_environ_proxies(endpoint):
+            # Transport would send the messages through it, don't bypass it silently
+            raise WinRMError("proxies are not supported by the asyncio transport, the environment defines one for %s" % endpoint)
+        if max_connections < 1:
+            raise WinRMError("max_connections must be at least 1")
+
+        url = urlsplit(endpoint)
+        self.host = url.hostname or ""
+
+        # validate credential requirements for various auth types
+        self._authorization: str | None = None
+        if self.auth_method in ["certificate", "ssl"] and (self.cert_pem or self.cert_key_pem or self.auth_method == "certificate"):
+            if not self.cert_pem or not self.cert_key_pem:
+                raise InvalidCredentialsError("both cert_pem and cert_key_pem must be specified for cert auth")
+            if not os.path.exists(self.cert_pem):
+                raise InvalidCredentialsError("cert_pem file not found (%s)" % self.cert_pem)
+            if not os.path.exists(self.cert_key_pem):
+                raise InvalidCredentialsError("cert_key_pem file not found (%s)" % self.cert_key_pem)
+            self._authorization = "http://schemas.dmtf.org/wbem/wsman/1/wsman/secprofile/https/mutual"
+        elif self.auth_method in ["basic", "plaintext", "ssl", "ntlm"]:
+            if not self.username:
+                raise InvalidCredentialsError("auth method %s requires a username" % self.auth_method)
+            if self.password is None:
+                raise InvalidCredentialsError("auth method %s requires a password" % self.auth_method)
+            if self.auth_method != "ntlm":
+                credentials = "{0}:{1}".format(self.username, self.password).encode("latin-1")
+                self._authorization = "Basic " + base64.b64encode(credentials).decode("ascii")
+        elif self.auth_method != "kerberos":
+            raise WinRMError("unsupported auth method: %s" % self.auth_method)
+
+        encryption_available = self.auth_method in ["ntlm", "kerberos"]
+        if encryption_available and not HAVE_SPNEGO:
+            raise WinRMError("requested auth method is %s, but pyspnego is not installed, install pywinrm[aio]" % self.auth_method)
+        if self.message_encryption == "always" and not encryption_available:
+            raise WinRMError("message encryption is set to 'always' but the selected auth method %s does not support it" % self.auth_method)
+        self.encrypt = encryption_available and (self.message_encryption == "always" or (self.message_encryption == "auto" and url.scheme.lower() != "https"))
+
+        self._ssl_context = self._build_ssl_context() if url.scheme.lower() == "https" else None
+        self._idle: list[_Connection] = []
+        self._slots: asyncio.Semaphore | None = None
+
+    async def send_message(self, message: str | bytes) -> bytes:
+        """
+        Sends a message and returns the decrypted response body.
+        @raises InvalidCredentialsError: The server rejected the credentials.
+        @raises WinRMTransportError: The server returned an HTTP error.
+        @raises httpx.TransportError: The connection to the server failed.
+        @raises asyncio.TimeoutError: No response within read_timeout_sec.
+        """
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_connections)
+
+        async with self._slots:
+            while True:
+                reused = bool(self._idle)
+                conn = self._idle.pop() if reused else self._new_connection()
+                try:
+                    response = await self._with_timeout(self._send(conn, message))
+                except httpx.TransportError:
+                    await conn.close()
+                    if reused:
+                        # the server closed the idle connection, try again on a new one
+                        continue
+                    raise
+                except BaseException:
+                    await conn.close()
+                    raise
+                break
+
+            self._idle.append(conn)
+
+        if response.status_code == 401:
+            raise InvalidCredentialsError("the specified credentials were rejected by the server")
+
+        if conn.encryption:
+            body = conn.encryption.decrypt(response.content, response.headers.get("content-type", ""), self.host)
+        else:
+            body = response.content
+
+        if response.status_code >= 400:
+            raise WinRMTransportError("http", response.status_code, body.decode())
+
+        return body
+
+    async def close_session(self) -> None:
+        """Closes the idle connections"""
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.close()
+
+    async def _with_timeout(self, awaitable: t.Awaitable[t.Any]) -> t.Any:
+        if self.read_timeout_sec is None:
+            return await awaitable
+        return await asyncio.wait_for(awaitable, self.read_timeout_sec)
+
+    def _new_connection(self) -> _Connection:
+        client = httpx.AsyncClient(
+            headers={"User-Agent": "Python WinRM client"},
+            # plain http has no certificate to validate
+            verify=self._ssl_context if self._ssl_context else False,
+            # a new connection would lose the NTLM or Kerberos security context
+            limits=httpx.Limits(max_connections=1, max_keepalive_connections=1, keepalive_expiry=None),
+            # send_message applies read_timeout_sec to the whole exchange
+            timeout=None,
+            # proxies are not supported, don't pick them up from the environment
+            trust_env=False,
+        )
+        return _Connection(client)
+
+    async def _send(self, conn: _Connection, message: bytes) -> httpx.Response:
+        if self.auth_method in ["ntlm", "kerberos"] and not conn.auth:
+            await self._authenticate(conn)
+
+        if conn.encryption:
+            body, content_type = conn.encryption.encrypt(message, self.host)
+        else:
+            body, content_type = message, SOAP_CONTENT_TYPE
+        response = await self._request(conn, body, content_type, self._authorization)
+
+        if conn.stream is not None and response.extensions.get("network_stream") is not conn.stream:
+            # httpx reconnected, the server doesn't know the security context on the new connection
+            raise httpx.RemoteProtocolError("the server closed the authenticated connection")
+        return response
+
+    async def _authenticate(self, conn: _Connection) -> None:
+        channel_bindings = None
+        if self.send_cbt and self._ssl_context:
+            # the certificate is only known once the connection is open, like
+            # requests_ntlm send a first request without credentials to open it
+            response = await self._request(conn, b"", SOAP_CONTENT_TYPE, None)
+            ssl_object = response.extensions["network_stream"].get_extra_info("ssl_object")
+            certificate = ssl_object.getpeercert(binary_form=True) if ssl_object else None
+            certificate_hash = _get_certificate_hash(certificate) if certificate else None
+            if certificate_hash:
+                channel_bindings = spnego.channel_bindings.GssChannelBindings(application_data=b"tls-server-end-point:" + certificate_hash)
+
+        context_req = spnego.ContextReq.default
+        if self.kerberos_delegation:
+            context_req |= spnego.ContextReq.delegate
+
+        context = spnego.client(
+            self.username,
+            self.password,
+            hostname=self.kerberos_hostname_override or self.host,
+            service=self.service or "HTTP",
+            channel_bindings=channel_bindings,
+            context_req=context_req,
+            protocol=self.auth_method,
+        )
+
+        # Security context doesn't exist, sending blank messages to initialise it
+        out_token = context.step()
+        while True:
+            authorization = "Negotiate " + base64.b64encode(out_token or b"").decode("ascii")
+            response = await self._request(conn, b"", SOAP_CONTENT_TYPE, authorization)
+            in_token = self._get_negotiate_token(response)
+            if response.status_code != 401 or not in_token or context.complete:
+                break
+            out_token = context.step(in_token)
+
+        if response.status_code == 401:
+            raise InvalidCredentialsError("the specified credentials were rejected by the server")
+        if response.status_code >= 400:
+            raise WinRMTransportError("http", response.status_code, response.content.decode(errors="replace"))
+
+        # Kerberos returns the mutual authentication token with the final response
+        if in_token and not context.complete:
+            context.step(in_token)
+
+        conn.auth = _SpnegoAuth(context)
+        conn.stream = response.extensions.get("network_stream")
+        if self.encrypt:
+            conn.encryption = Encryption(conn, self.auth_method)
+
+    async def _request(self, conn: _Connection, body: bytes, content_type: str, authorization: str | None) -> httpx.Response:
+        headers = {"Content-Type": content_type}
+        if authorization:
+            headers["Authorization"] = authorization
+        return await conn.client.post(self.endpoint, content=body, headers=headers)
+
+    @staticmethod
+    def _get_negotiate_token(response: httpx.Response) -> bytes | None:
+        for value in response.headers.get_list("www-authenticate"):
+            scheme, _, token = value.partition(" ")
+            if scheme.lower() == "negotiate" and token.strip():
+                return base64.b64decode(token.strip())
+        return None
+
+    def _build_ssl_context(self) -> ssl.SSLContext:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        if self.server_cert_validation == "ignore":
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        else:
+            # like Transport, 'legacy_requests' reads the CA bundle from the
+            # environment and falls back to the bundle shipped with requests
+            ca_trust_path = self.ca_trust_path
+            if ca_trust_path == "legacy_requests":
+                ca_trust_path = os.environ.get("REQUESTS_CA_BUNDLE") or os.environ.get("CURL_CA_BUNDLE")
+            if not ca_trust_path:
+                ca_trust_path = requests.utils.DEFAULT_CA_BUNDLE_PATH
+
+            if os.path.isdir(ca_trust_path):
+                context.load_verify_locations(capath=ca_trust_path)
+            else:
+                context.load_verify_locations(cafile=ca_trust_path)
+
+        if self._authorization and not self._authorization.startswith("Basic "):
+            context.load_cert_chain(t.cast(str, self.cert_pem), t.cast(str, self.cert_key_pem))
+
+        return context
+
+
+def _get_certificate_hash(certificate_der: bytes) -> bytes | None:
+    # RFC 5929 tls-server-end-point, the certificate is hashed with the hash
+    # algorithm of its signature with MD5 and SHA-1 upgraded to SHA-256
+    try:
+        certificate = x509.load_der_x509_certificate(certificate_der)
+        hash_algorithm = certificate.signature_hash_algorithm
+    except Exception:
+        return None
+
+    if hash_algorithm is None or hash_algorithm.name in ["md5", "sha1"]:
+        hash_algorithm = hashes.SHA256()
+
+    digest = hashes.Hash(hash_algorithm)
+    digest.update(certificate_der)
+    return digest.finalize()
+
+
+class AsyncProtocol(BaseProtocol):
+    """The asyncio counterpart of Protocol, every WSMan operation is a
+    coroutine. The arguments are the same as Protocol except that the
+    credssp transport and proxies are not supported, max_connections limits
+    the number of concurrent requests to the host.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        transport: t.Literal["basic", "certificate", "ntlm", "kerberos", "plaintext", "ssl"] = "plaintext",
+        username: str | None = None,
+        password: str | None = None,
+        service: str = "HTTP",
+        ca_trust_path: t.Literal["legacy_requests"] | str | None = "legacy_requests",
+        cert_pem: str | None = None,
+        cert_key_pem: str | None = None,
+        server_cert_validation: t.Literal["validate", "ignore"] | None = "validate",
+        kerberos_delegation: bool = False,
+        read_timeout_sec: str | int = BaseProtocol.DEFAULT_READ_TIMEOUT_SEC,
+        operation_timeout_sec: str | int = BaseProtocol.DEFAULT_OPERATION_TIMEOUT_SEC,
+        kerberos_hostname_override: str | None = None,
+        message_encryption: t.Literal["auto", "always", "never"] = "auto",
+        send_cbt: bool = True,
+        proxy: t.Literal["legacy_requests"] | None = None,
+        max_connections: int = AsyncTransport.DEFAULT_MAX_CONNECTIONS,
+    ) -> None:
+        super().__init__(read_timeout_sec, operation_timeout_sec)
+
+        self.transport = AsyncTransport(
+            endpoint=endpoint,
+            username=username,
+            password=password,
+            service=service,
+            ca_trust_path=ca_trust_path,
+            cert_pem=cert_pem,
+            cert_key_pem=cert_key_pem,
+            read_timeout_sec=self.read_timeout_sec,
+            server_cert_validation=server_cert_validation,
+            kerberos_delegation=kerberos_delegation,
+            kerberos_hostname_override=kerberos_hostname_override,
+            auth_method=transport,
+            message_encryption=message_encryption,
+            send_cbt=send_cbt,
+            proxy=proxy,
+            max_connections=max_connections,
+        )
+
+        self.username = username
+        self.password = password
+        self.service = service
+
+    async def open_shell(
+        self,
+        i_stream: str = "stdin",
+        o_stream: str = "stdout stderr",
+        working_directory: str | None = None,
+        env_vars: dict[str, str] | None = None,
+        noprofile: bool = False,
+        codepage: int = 437,
+        lifetime: None = None,
+        idle_timeout: str | int | None = None,
+    ) -> str:
+        """Create a Shell on the destination host, see Protocol.open_shell"""
+        res = await self.send_message(self._build_open_shell(i_stream, o_stream, working_directory, env_vars, noprofile, codepage, idle_timeout))
+        return self._parse_open_shell(res)
+
+    async def send_message(self, message: str) -> bytes:
+        try:
+            return await self.transport.send_message(message)
+        except WinRMTransportError as ex:
+            raise self._parse_fault(ex)
+
+    async def close_shell(self, shell_id: str, close_session: bool = True) -> None:
+        """Close the shell, see Protocol.close_shell. close_session closes the
+        idle connections of the transport.
+        """
+        try:
+            message_id = uuid.uuid4()
+            res = await self.send_message(self._build_close_shell(shell_id, message_id))
+        finally:
+            self._forget_shell(shell_id)
+            if close_session:
+                await self.transport.close_session()
+
+        self._check_relates_to(res, message_id)
+
+    async def run_command(
+        self,
+        shell_id: str,
+        command: str,
+        arguments: collections.abc.Iterable[str | bytes] = (),
+        console_mode_stdin: bool = True,
+        skip_cmd_shell: bool = False,
+    ) -> str:
+        """Run a command on a machine with an open shell, see Protocol.run_command"""
+        res = await self.send_message(self._build_run_command(shell_id, command, arguments, console_mode_stdin, skip_cmd_shell))
+        return self._parse_run_command(res)
+
+    async def cleanup_command(self, shell_id: str, command_id: str) -> None:
+        """Clean-up after a command, see Protocol.cleanup_command"""
+        message_id = uuid.uuid4()
+        res = await self.send_message(self._build_cleanup_command(shell_id, command_id, message_id))
+        self._check_relates_to(res, message_id)
+
+    async def send_command_input(self, shell_id: str, command_id: str, stdin_input: str | bytes, end: bool = False) -> None:
+        """Send input to the given shell and command, see Protocol.send_command_input"""
+        await self.send_message(self._build_send_command_input(shell_id, command_id, stdin_input, end))
+
+    async def get_command_output(self, shell_id: str, command_id: str) -> tuple[bytes, bytes, int]:
+        """Get the output of the given shell and command once it has
+        finished, see Protocol.get_command_output
+        """
+        stdout_buffer, stderr_buffer = [], []
+        return_code = -1
+        async for stream, data in self.iter_command_output(shell_id, command_id):
+            if isinstance(data, int):
+                return_code = data
+            elif stream == "stdout":
+                stdout_buffer.append(data)
+            else:
+                stderr_buffer.append(data)
+        return b"".join(stdout_buffer), b"".join(stderr_buffer), return_code
+
+    async def iter_command_output(self, shell_id: str, command_id: str) -> collections.abc.AsyncIterator[tuple[str, bytes | int]]:
+        """Get the output of the given shell and command as it is received,
+        see Protocol.iter_command_output
+        """
+        command_done = False
+        while not command_done:
+            try:
+                stdout, stderr, return_code, command_done = await self.get_command_output_raw(shell_id, command_id)
+            except WinRMOperationTimeoutError:
+                # this is an expected error when waiting for a long-running process, just silently retry
+                continue
+
+            if stdout:
+                yield "stdout", stdout
+            if stderr:
+                yield "stderr", stderr
+
+        yield "exit_code", return_code
+
+    async def get_command_output_raw(self, shell_id: str, command_id: str) -> tuple[bytes, bytes, int, bool]:
+        """Get the next available output of the given shell and command, see
+        Protocol.get_command_output_raw
+        """
+        res = await self.send_message(self._build_receive(shell_id, command_id))
+        return self._parse_receive(res)
+
+
+class AsyncSession(object):
+    """
+    The asyncio counterpart of Session. The connections to the host are kept
+    open between commands so the session should be closed, or used with
+    async with, once it is no longer needed. Keyword arguments are passed to
+    AsyncProtocol.
+    """
+
+    def __init__(self, target: str, auth: tuple[str, str], **kwargs: t.Any) -> None:
+        username, password = auth
+        self.url = Session._build_url(target, kwargs.get("transport", "plaintext"))
+        self.protocol = AsyncProtocol(self.url, username=username, password=password, **kwargs)
+
+    async def __aenter__(self) -> AsyncSession:
+        return self
+
+    async def __aexit__(self, *args: t.Any) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        """Closes the connections to the host"""
+        await self.protocol.transport.close_session()
+
+    async def run_cmd(
+        self,
+        command: str,
+        args: collections.abc.Iterable[str | bytes] = (),
+        working_directory: str | None = None,
+        env_vars: dict[str, str] | None = None,
+        noprofile: bool = False,
+        codepage: int = 437,
+        stdout: OutputSink | t.BinaryIO | None = None,
+        stderr: OutputSink | t.BinaryIO | None = None,
+    ) -> Response:
+        """Runs a command and waits for it to finish, see Session.run_cmd"""
+        out_sink = as_sink(stdout)
+        err_sink = as_sink(stderr)
+        return_code = -1
+        shell_id = await self.protocol.open_shell(working_directory=working_directory, env_vars=env_vars, noprofile=noprofile, codepage=codepage)
+        try:
+            command_id = await self.protocol.run_command(shell_id, command, args)
+            async for stream, data in self.protocol.iter_command_output(shell_id, command_id):
+                if isinstance(data, int):
+                    return_code = data
+                elif stream == "stdout":
+                    out_sink.write(data)
+                else:
+                    err_sink.write(data)
+            await self.protocol.cleanup_command(shell_id, command_id)
+        except BaseException:
+            # don't leave the shell running, e.g. when the task is cancelled
+            try:
+                await self.protocol.close_shell(shell_id, close_session=False)
+            except Exception:
+                pass
+            raise
+        # other commands may be using the connections, keep them open
+        await self.protocol.close_shell(shell_id, close_session=False)
+
+        return Response((out_sink, err_sink, return_code), codepage=codepage)
+
+    async def run_ps(self, script: str, **kwargs: t.Any) -> Response:
+        """Runs a Powershell script and waits for it to finish, see Session.run_ps"""
+        # must use utf16 little endian on windows
+        encoded_ps = base64.b64encode(script.encode("utf_16_le")).decode("ascii")
+        rs = await self.run_cmd("powershell -encodedcommand {0}".format(encoded_ps), **kwargs)
+        # the CLIXML error message is made human readable when std_err is read
+        rs.clixml_stderr = kwargs.get("stderr") is None
+        return rs
@@ -0,0 +1,508 @@
+"""Converts between Python values and the CLIXML that PowerShell serializes
+objects to, see MS-PSRP section 2.2.5.
+
+Primitive values map to the Python type of the same kind, lists and
+dictionaries to list and dict and any other object to a PSObject with the
+properties that were serialized. An object wrapping a primitive value, e.g.
+an enum or a string with note properties, is returned as the value itself.
+
+StreamDecoder reads the <Objs> stream powershell.exe writes to stderr in a
+single pass as it is received, without building the whole document.
+"""
+
+from __future__ import annotations
+
+import base64
+import collections.abc
+import datetime
+import decimal
+import re
+import typing as t
+import uuid
+from xml.sax.saxutils import escape, quoteattr, unescape
+
+from winrm import xml_backend
+from winrm.exceptions import WinRMError
+
+__all__ = ["PSObject", "Record", "StreamDecoder", "Serializer", "loads", "loads_stream", "decode_stream", "dumps", "stream_text"]
+
+_ESCAPED = re.compile(r"_x([0-9A-Fa-f]{4})_")
+_TO_ESCAPE = re.compile("[\x00-\x1f\ud800-\udfff\ufffe\uffff]|_(?=x[0-9A-Fa-f]{4}_)")
+_DURATION = re.compile(r"(-)?P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d+)?)S)?)?$")
+_DATETIME = re.compile(r"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)?$")
+
+_INTEGERS = {"By", "SB", "I16", "U16", "I32", "U32", "I64", "U64"}
+_STRINGS = {"S", "XD", "SBK", "URI", "Version", "SS"}
+_LISTS = {"LST", "IE", "STK", "QUE"}
+# the elements of a ProgressRecord, the current operation has no element of its own
+_PROGRESS = {
+    "AV": "Activity",
+    "AI": "ActivityId",
+    "PI": "ParentActivityId",
+    "PC": "PercentComplete",
+    "T": "RecordType",
+    "SR": "SecondsRemaining",
+    "SD": "StatusDescription",
+}
+
+# the parts of a stream StreamDecoder looks for without parsing it
+_DOCUMENT_START = re.compile(rb"<Objs\b[^>]*?(/?)>")
+_DOCUMENT_END = re.compile(rb"</Objs\s*>")
+_RECORD_START = re.compile(rb'<\w+\s+S="([^"]*)"')
+_TYPE_NAMES = re.compile(rb'<TN RefId="([^"]*)">(.*?)</TN>', re.S)
+_TYPE_NAME = re.compile(rb"<T>(.*?)</T>", re.S)
+_ENTITIES = {"&quot;": '"', "&apos;": "'"}
+
+# the first line of a CLIXML stream written by powershell.exe
+CLIXML_HEADER = b"#< CLIXML"
+# the streams written as text by powershell.exe
+TEXT_STREAMS = ("error", "warning", "verbose", "debug")
+
+
+class PSObject(object):
+    """A deserialized object that is not a primitive value, list or dict
+
+    @param list type_names: The .NET types of the object, most derived
+        first. Deserialized objects have the prefix "Deserialized.".
+    @param dict properties: The adapted and extended properties by name.
+    @param string to_string: The ToString() of the object.
+    @param value: A primitive value wrapped by the object, e.g. the number of
+        an enum, when serializing.
+    """
+
+    def __init__(
+        self,
+        type_names: list[str] | None = None,
+        properties: dict[str, t.Any] | None = None,
+        to_string: str | None = None,
+        value: t.Any = None,
+    ) -> None:
+        self.type_names = type_names or []
+        self.properties = properties if properties is not None else {}
+        self.to_string = to_string
+        self.value = value
+
+    def __getattr__(self, name: str) -> t.Any:
+        # only called for names that are not attributes of the instance
+        try:
+            return self.__dict__["properties"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, name: str) -> t.Any:
+        return self.properties[name]
+
+    def __str__(self) -> str:
+        return self.to_string if self.to_string is not None else repr(self)
+
+    def __repr__(self) -> str:
+        type_name = self.type_names[0] if self.type_names else "PSObject"
+        return "<{0} {1}>".format(type_name, ", ".join("{0}={1!r}".format(k, v) for k, v in self.properties.items()))
+
+
+def decode_string(value: str) -> str:
+    """Decodes the _xHHHH_ escapes of a serialized string"""
+    if "_x" not in value:
+        return value
+    # the escapes are UTF-16 code units, a surrogate pair is two escapes
+    decoded = _ESCAPED.sub(lambda m: chr(int(m.group(1), 16)), value)
+    return decoded.encode("utf-16-le", "surrogatepass").decode("utf-16-le", "replace")
+
+
+def encode_string(value: str) -> str:
+    """Escapes the characters that XML cannot contain and _ before xHHHH_"""
+
+    def escape_char(match: t.Match[str]) -> str:
+        char = match.group(0)
+        return "".join("_x%04X_" % unit for unit in _utf16_units(char))
+
+    if any(ord(c) > 0xFFFF for c in value):
+        # characters outside of the BMP are written as a surrogate pair
+        value = "".join(c if ord(c) <= 0xFFFF else "".join(map(chr, _utf16_units(c))) for c in value)
+    return escape(_TO_ESCAPE.sub(escape_char, value))
+
+
+def _utf16_units(char: str) -> list[int]:
+    data = char.encode("utf-16-le", "surrogatepass")
+    return [int.from_bytes(data[i : i + 2], "little") for i in range(0, len(data), 2)]
+
+
+def loads(data: str | bytes) -> t.Any:
+    """
+    Deserializes a CLIXML element, e.g. the data of a PSRP message.
+    @param data: The XML of a single element such as <Obj> or <S>.
+    @returns The Python value.
+    @raises WinRMError: The element is not valid CLIXML.
+    """
+    return _Deserializer().load(xml_backend.fromstring(data))
+
+
+def loads_stream(data: str | bytes) -> list[t.Any]:
+    """
+    Deserializes the objects of an <Objs> document, e.g. the stderr of
+    powershell.exe with or without the #< CLIXML line.
+    @param data: The <Objs> document.
+    @returns The Python values in document order.
+    """
+    return [record.value for record in decode_stream(data.encode("utf-8") if isinstance(data, str) else data)]
+
+
+def decode_stream(data: bytes, streams: collections.abc.Iterable[str] | None = None) -> list[Record]:
+    """
+    Decodes a whole CLIXML stream, see StreamDecoder.
+    @param bytes data: The stream, e.g. the stderr of powershell.exe.
+    @param iterable streams: Only return the records of these streams.
+    @rtype list[Record]
+    """
+    decoder = StreamDecoder(streams)
+    return decoder.feed(data) + decoder.close()
+
+
+def stream_text(data: bytes, streams: collections.abc.Iterable[str] = TEXT_STREAMS) -> str:
+    """
+    Returns the messages of a CLIXML stream as text with LF line endings,
+    the records of other streams are skipped without being deserialized.
+    @param bytes data: The stream, e.g. the stderr of powershell.exe.
+    @param iterable streams: The streams to return the messages of.
+    @rtype string
+    """
+    return "".join(str(record.value) for record in decode_stream(data, streams)).replace("\r\n", "\n")
+
+
+def dumps(value: t.Any, name: str | None = None) -> str:
+    """
+    Serializes a Python value to a CLIXML element.
+    @param value: A primitive value, list, tuple, dict or PSObject.
+    @param string name: The N attribute of the element, the name of the
+        property the value is for.
+    @returns The XML of the element.
+    """
+    return Serializer().dumps(value, name)
+
+
+def _local(tag: t.Any) -> str:
+    # ElementTree and lxml comments have a non string tag
+    if not isinstance(tag, str):
+        return "#comment"
+    return tag.rsplit("}", 1)[-1]
+
+
+def _children(node: t.Any) -> list[t.Any]:
+    return [child for child in node if _local(child.tag) != "#comment"]
+
+
+class _Deserializer(object):
+    def __init__(self) -> None:
+        self.objects: dict[str, t.Any] = {}
+        self.type_names: dict[str, list[str]] = {}
+
+    def load(self, node: t.Any) -> t.Any:
+        tag = _local(node.tag)
+        text = node.text or ""
+        try:
+            if tag in _STRINGS:
+                return decode_string(text)
+            if tag in _INTEGERS:
+                return int(text)
+            if tag == "B":
+                return text.strip().lower() == "true"
+            if tag in ("Db", "Sg"):
+                return float(text)
+            if tag == "D":
+                return decimal.Decimal(text)
+            if tag == "C":
+                return chr(int(text))
+            if tag == "G":
+                return uuid.UUID(text)
+            if tag == "BA":
+                return base64.b64decode(text)
+            if tag == "DT":
+                return _parse_datetime(text)
+            if tag == "TS":
+                return _parse_duration(text)
+            if tag == "Nil":
+                return None
+            if tag == "Ref":
+                return self.objects[node.get("RefId")]
+            if tag == "Obj":
+                return self._load_object(node)
+            if tag == "PR":
+                return self._load_progress(node)
+        except (ValueError, KeyError, decimal.InvalidOperation) as err:
+            raise WinRMError("invalid CLIXML %s element: %s" % (tag, err))
+        raise WinRMError("unknown CLIXML element %s" % tag)
+
+    def _load_object(self, node: t.Any) -> t.Any:
+        ref_id = node.get("RefId")
+        children = _children(node)
+        tags = [_local(child.tag) for child in children]
+
+        # containers are registered before their items are read so an item
+        # can refer back to them
+        result: t.Any
+        if any(tag in _LISTS for tag in tags):
+            result = []
+        elif "DCT" in tags:
+            result = {}
+        else:
+            result = PSObject()
+        if ref_id is not None:
+            self.objects[ref_id] = result
+
+        value: t.Any = None
+        has_value = False
+        for child, tag in zip(children, tags):
+            if tag == "TN":
+                type_names = [decode_string(n.text or "") for n in _children(child)]
+                self.type_names[child.get("RefId")] = type_names
+                if isinstance(result, PSObject):
+                    result.type_names = type_names
+            elif tag == "TNRef":
+                if isinstance(result, PSObject):
+                    result.type_names = self.type_names[child.get("RefId")]
+            elif tag == "ToString":
+                if isinstance(result, PSObject):
+                    result.to_string = decode_string(child.text or "")
+            elif tag in _LISTS:
+                result.extend(self.load(item) for item in _children(child))
+            elif tag == "DCT":
+                for entry in _children(child):
+                    items = dict((item.get("N"), self.load(item)) for item in _children(entry))
+                    result[items.get("Key")] = items.get("Value")
+            elif tag in ("Props", "MS"):
+                if isinstance(result, PSObject):
+                    for item in _children(child):
+                        result.properties[decode_string(item.get("N") or "")] = self.load(item)
+            else:
+                value = self.load(child)
+                has_value = True
+
+        if has_value and isinstance(result, PSObject):
+            if ref_id is not None:
+                self.objects[ref_id] = value
+            return value
+        return result
+
+    def _load_progress(self, node: t.Any) -> PSObject:
+        result = PSObject(["System.Management.Automation.ProgressRecord"])
+        for child in _children(node):
+            tag = _local(child.tag)
+            name = _PROGRESS.get(tag, "CurrentOperation")
+            value = self.load(child) if tag in ("S", "Nil") else decode_string(child.text or "")
+            result.properties[name] = int(value) if tag in ("AI", "PI", "PC", "SR") else value
+        return result
+
+
+class Record(t.NamedTuple):
+    """A top level object of a CLIXML stream. stream is error, warning,
+    verbose, debug, information or progress as set by PowerShell, or output
+    for an object without a stream.
+    """
+
+    stream: str
+    value: t.Any
+
+
+class StreamDecoder(object):
+    """
+    Decodes a CLIXML stream incrementally, feed returns the records completed
+    by the data. PowerShell sets the S attribute on the top level elements
+    only, the stream is split at those start tags and each record is parsed
+    on its own once the next one starts, so the memory used is bounded by the
+    largest record. A document without S attributes is parsed as one piece.
+
+    @param iterable streams: Only deserialize the records of these streams,
+        the others are skipped without being parsed, e.g. the many progress
+        records PowerShell writes while loading modules. None deserializes
+        all records.
+    """
+
+    def __init__(self, streams: collections.abc.Iterable[str] | None = None) -> None:
+        self.streams = frozenset(streams) if streams is not None else None
+        self._deserializer = _Deserializer()
+        self._buffer = bytearray()
+        self._scanned = 0
+        # the stream of the record at the start of the buffer, None when it
+        # has no S attribute
+        self._stream: str | None = None
+        # header until the <Objs> start tag has been read, then body, done
+        # once </Objs> is read
+        self._state = "header"
+
+    def feed(self, data: bytes) -> list[Record]:
+        """
+        Adds data and returns the records it completes.
+        @param bytes data: The next part of the stream.
+        @rtype list[Record]
+        @raises WinRMError: A record is not valid CLIXML.
+        """
+        if self._state == "done":
+            return []
+        self._buffer += data
+        return self._read()
+
+    def close(self) -> list[Record]:
+        """Returns the last records, raises WinRMError if the document is incomplete"""
+        if self._state == "header" and not self._buffer.strip():
+            return []
+        if self._state != "done":
+            raise WinRMError("the CLIXML stream ended before </Objs>")
+        return []
+
+    def _read(self) -> list[Record]:
+        buffer = self._buffer
+        if self._state == "header":
+            # the #< CLIXML line is not part of the document
+            match = _DOCUMENT_START.search(buffer)
+            if match is None:
+                return []
+            if match.group(1):
+                self._state = "done"
+                return []
+            del buffer[: match.end()]
+            self._state = "body"
+
+        records: list[Record] = []
+        # the current record starts at offset, a start tag can be split
+        # between two reads so the end of the last read is scanned again
+        offset = 0
+        pos = max(0, self._scanned - 64)
+        while self._state == "body":
+            start = _RECORD_START.search(buffer, pos)
+            end = _DOCUMENT_END.search(buffer, pos, start.start() if start is not None else len(buffer))
+            if end is not None:
+                self._decode(offset, end.start(), records)
+                offset = len(buffer)
+                self._state = "done"
+            elif start is not None:
+                if start.start() > offset:
+                    self._decode(offset, start.start(), records)
+                offset = start.start()
+                pos = start.end()
+                self._stream = start.group(1).decode().lower()
+            else:
+                break
+        del buffer[:offset]
+        self._scanned = len(buffer)
+        return records
+
+    def _decode(self, start: int, end: int, records: list[Record]) -> None:
+        if self._stream is not None and self.streams is not None and self._stream not in self.streams:
+            # the types named in a skipped record can be referred to by later ones
+            for ref_id, names in _TYPE_NAMES.findall(self._buffer, start, end):
+                self._deserializer.type_names[ref_id.decode()] = [decode_string(unescape(n.decode("utf-8"), _ENTITIES)) for n in _TYPE_NAME.findall(names)]
+            return
+
+        segment = bytes(self._buffer[start:end])
+        if not segment.strip():
+            return
+        try:
+            root = xml_backend.fromstring(b"<Objs>" + segment + b"</Objs>")
+        except Exception as err:
+            raise WinRMError("invalid CLIXML record: %s" % err)
+        for node in _children(root):
+            stream = (node.get("S") or "output").lower()
+            if self.streams is None or stream in self.streams:
+                records.append(Record(stream, self._deserializer.load(node)))
+
+
+class Serializer(object):
+    """Serializes values to CLIXML elements with RefIds unique within the
+    serializer, use one instance per PSRP message.
+    """
+
+    def __init__(self) -> None:
+        self._next_ref = 0
+        self._type_names: dict[tuple[str, ...], int] = {}
+
+    def dumps(self, value: t.Any, name: str | None = None) -> str:
+        """
+        Serializes a value, see clixml.dumps.
+        @param value: A primitive value, list, tuple, dict or PSObject.
+        @param string name: The N attribute of the element.
+        @returns The XML of the element.
+        """
+        attr = " N=%s" % quoteattr(encode_string(name)) if name is not None else ""
+        if value is None:
+            return "<Nil%s />" % attr
+        if isinstance(value, bool):
+            return "<B%s>%s</B>" % (attr, "true" if value else "false")
+        if isinstance(value, int):
+            tag = "I32" if -(2**31) <= value < 2**31 else "I64"
+            return "<%s%s>%d</%s>" % (tag, attr, value, tag)
+        if isinstance(value, float):
+            return "<Db%s>%s</Db>" % (attr, repr(value).replace("inf", "INF").replace("nan", "NaN"))
+        if isinstance(value, decimal.Decimal):
+            return "<D%s>%s</D>" % (attr, value)
+        if isinstance(value, str):
+            return "<S%s>%s</S>" % (attr, encode_string(value))
+        if isinstance(value, (bytes, bytearray)):
+            return "<BA%s>%s</BA>" % (attr, base64.b64encode(value).decode())
+        if isinstance(value, uuid.UUID):
+            return "<G%s>%s</G>" % (attr, value)
+        if isinstance(value, datetime.datetime):
+            return "<DT%s>%s</DT>" % (attr, value.isoformat())
+        if isinstance(value, datetime.timedelta):
+            return "<TS%s>%s</TS>" % (attr, _format_duration(value))
+        if isinstance(value, (list, tuple)):
+            items = "".join(self.dumps(item) for item in value)
+            return '<Obj%s RefId="%d">%s<LST>%s</LST></Obj>' % (attr, self._ref(), self._type("System.Object[]", "System.Array", "System.Object"), items)
+        if isinstance(value, dict):
+            entries = "".join("<En>%s%s</En>" % (self.dumps(k, "Key"), self.dumps(v, "Value")) for k, v in value.items())
+            return '<Obj%s RefId="%d">%s<DCT>%s</DCT></Obj>' % (attr, self._ref(), self._type("System.Collections.Hashtable", "System.Object"), entries)
+        if isinstance(value, PSObject):
+            ref = self._ref()
+            parts = [self._type(*value.type_names) if value.type_names else ""]
+            if value.to_string is not None:
+                parts.append("<ToString>%s</ToString>" % encode_string(value.to_string))
+            if value.value is not None:
+                parts.append(self.dumps(value.value))
+            if value.properties:
+                parts.append("<MS>%s</MS>" % "".join(self.dumps(v, k) for k, v in value.properties.items()))
+            return '<Obj%s RefId="%d">%s</Obj>' % (attr, ref, "".join(parts))
+        raise WinRMError("cannot serialize %s to CLIXML" % type(value).__name__)
+
+    def _ref(self) -> int:
+        ref = self._next_ref
+        self._next_ref += 1
+        return ref
+
+    def _type(self, *names: str) -> str:
+        ref = self._type_names.get(names)
+        if ref is not None:
+            return '<TNRef RefId="%d" />' % ref
+        ref = self._type_names[names] = len(self._type_names)
+        return '<TN RefId="%d">%s</TN>' % (ref, "".join("<T>%s</T>" % encode_string(name) for name in names))
+
+
+def _parse_datetime(value: str) -> datetime.datetime:
+    match = _DATETIME.match(value.strip())
+    if not match:
+        raise ValueError("invalid date time %r" % value)
+    # .NET writes up to 7 digits of fractional seconds
+    result = datetime.datetime.strptime(match.group(1), "%Y-%m-%dT%H:%M:%S")
+    if match.group(2):
+        result = result.replace(microsecond=int(match.group(2)[:6].ljust(6, "0")))
+    zone = match.group(3)
+    if zone == "Z":
+        result = result.replace(tzinfo=datetime.timezone.utc)
+    elif zone:
+        offset = datetime.timedelta(hours=int(zone[1:3]), minutes=int(zone[4:6]))
+        result = result.replace(tzinfo=datetime.timezone(-offset if zone[0] == "-" else offset))
+    return result
+
+
+def _parse_duration(value: str) -> datetime.timedelta:
+    match = _DURATION.match(value.strip())
+    if not match:
+        raise ValueError("invalid duration %r" % value)
+    sign, days, hours, minutes, seconds = match.groups()
+    result = datetime.timedelta(days=int(days or 0), hours=int(hours or 0), minutes=int(minutes or 0), seconds=float(seconds or 0))
+    return -result if sign else result
+
+
+def _format_duration(value: datetime.timedelta) -> str:
+    sign = "-" if value < datetime.timedelta(0) else ""
+    value = abs(value)
+    seconds = value.seconds + value.microseconds / 1000000
+    return "%sP%dDT%dH%dM%sS" % (sign, value.days, seconds // 3600, seconds % 3600 // 60, repr(round(seconds % 60, 6)))
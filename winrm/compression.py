@@ -0,0 +1,123 @@
+"""Compresses the stdout of a command on the remote host.
+
+The command runs as a child of a PowerShell process that copies its stdout
+through a GZipStream, the client decompresses the stream as the chunks are
+received. stderr and the exit code are passed through unchanged.
+"""
+
+from __future__ import annotations
+
+import collections.abc
+import zlib
+
+from winrm.exceptions import WinRMError
+from winrm.powershell import MAX_COMMAND_LINE, build_command
+from winrm.sinks import OutputSink
+
+__all__ = ["wrap_command", "wrap_script", "DecompressSink"]
+
+# runs $file with $arguments, Stream.CopyTo and CompressionLevel are avoided
+# so it also works on .NET 2.0
+WRAPPER_SCRIPT = """
+$ErrorActionPreference = 'Stop'
+$info = New-Object Diagnostics.ProcessStartInfo
+$info.FileName = $file
+$info.Arguments = $arguments
+$info.UseShellExecute = $false
+$info.RedirectStandardOutput = $true
+$process = [Diagnostics.Process]::Start($info)
+$source = $process.StandardOutput.BaseStream
+$gzip = New-Object IO.Compression.GZipStream([Console]::OpenStandardOutput(), [IO.Compression.CompressionMode]::Compress)
+try {
+    $buffer = New-Object byte[] 65536
+    while (($read = $source.Read($buffer, 0, $buffer.Length)) -gt 0) {
+        $gzip.Write($buffer, 0, $read)
+    }
+}
+finally {
+    $gzip.Dispose()
+}
+$process.WaitForExit()
+exit $process.ExitCode
+"""
+
+
+def wrap_command(command: str, args: collections.abc.Iterable[str | bytes] = ()) -> str:
+    """
+    Returns a command line that runs command with cmd.exe like run_cmd does
+    and writes its stdout compressed with gzip. The wrapper takes about 1,900
+    of the MAX_COMMAND_LINE characters.
+    @param string command: The command to run.
+    @param iterable of string args: The arguments, joined with spaces like
+        the shell joins them.
+    @returns The command line to run instead.
+    @rtype string
+    """
+    line = " ".join([command] + [arg.decode("utf-8") if isinstance(arg, bytes) else arg for arg in args])
+    return _check_length(build_command(WRAPPER_SCRIPT, file="cmd.exe", arguments="/c " + line))
+
+
+def wrap_script(script: str) -> str:
+    """
+    Returns a command line that runs a PowerShell script like run_ps does and
+    writes its stdout compressed with gzip. The wrapper takes about 2,200 of
+    the MAX_COMMAND_LINE characters, which leaves room for a script of about
+    2,200 characters instead of the 3,000 of run_ps.
+    @param string script: The script to run.
+    @returns The command line to run instead.
+    @rtype string
+    """
+    return _check_length(
+        build_command(
+            "$arguments = '-EncodedCommand ' + [Convert]::ToBase64String([Text.Encoding]::Unicode.GetBytes($script))\n" + WRAPPER_SCRIPT,
+            file="powershell.exe",
+            script=script,
+        )
+    )
+
+
+def _check_length(command: str) -> str:
+    if len(command) > MAX_COMMAND_LINE:
+        raise WinRMError(
+            "the compressed command line is %d characters long, cmd.exe accepts at most %d, run the command without compress_output"
+            % (len(command), MAX_COMMAND_LINE)
+        )
+    return command
+
+
+class DecompressSink(OutputSink):
+    """Decompresses a gzip stream written in chunks into another sink
+
+    @param OutputSink sink: The sink to write the decompressed output to,
+        getvalue and head read it back from there.
+    """
+
+    def __init__(self, sink: OutputSink) -> None:
+        self.sink = sink
+        self.compressed_bytes = 0
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def write(self, data: bytes) -> None:
+        self.compressed_bytes += len(data)
+        try:
+            self.sink.write(self._decompressor.decompress(data))
+        except zlib.error as err:
+            raise WinRMError("the compressed command output could not be decompressed: %s" % err)
+
+    def finish(self) -> None:
+        """Writes the rest of the output, raises WinRMError when the stream
+        ended early. Nothing is checked when no output was received.
+        """
+        if self.compressed_bytes:
+            self.sink.write(self._decompressor.flush())
+            if not self._decompressor.eof:
+                raise WinRMError("the compressed command output ended after %d bytes" % self.compressed_bytes)
+
+    def getvalue(self) -> bytes:
+        return self.sink.getvalue()
+
+    def head(self, size: int) -> bytes:
+        return self.sink.head(size)
+
+    def close(self) -> None:
+        self.sink.close()
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import collections.abc
 import re
 import struct
+import typing as t
 from urllib.parse import urlsplit
 
 import requests
@@ -9,12 +11,24 @@ import requests
 from winrm.exceptions import WinRMError
 
 
+class AuthSession(t.Protocol):
+    """What Encryption needs from a session, the auth handler with the
+    security context of the connection, e.g. a requests.Session
+    """
+
+    @property
+    def auth(self) -> t.Any: ...
+
+
 class Encryption(object):
 
     SIXTEN_KB = 16384
     MIME_BOUNDARY = b"--Encrypted Boundary"
+    OCTET_STREAM_HEADER = b"\tContent-Type: application/octet-stream\r\n"
+    # the signature or TLS record overhead wrap adds to a message at most
+    MAX_WRAP_OVERHEAD = 128
 
-    def __init__(self, session: requests.Session, protocol: str) -> None:
+    def __init__(self, session: AuthSession, protocol: str) -> None:
         """
         [MS-WSMV] v30.0 2016-07-14
 
@@ -53,6 +67,33 @@ class Encryption(object):
         else:
             raise WinRMError("Encryption for protocol '%s' not supported in pywinrm" % protocol)
 
+        # the MIME framing around every encrypted part only depends on the
+        # protocol, the original length is the only value in the headers
+        self._part_header, self._payload_header = self._part_framing(self.protocol_string)
+        self._content_type_protocol = 'protocol="{0}"'.format(self.protocol_string.decode())
+
+    @classmethod
+    def _part_framing(cls, protocol_string: bytes) -> tuple[bytes, bytes]:
+        part_header = cls.MIME_BOUNDARY + b"\r\n\tContent-Type: " + protocol_string + b"\r\n\tOriginalContent: type=application/soap+xml;charset=UTF-8;Length="
+        payload_header = b"\r\n" + cls.MIME_BOUNDARY + b"\r\n" + cls.OCTET_STREAM_HEADER
+        return part_header, payload_header
+
+    @classmethod
+    def max_overhead(cls, message_length: int) -> int:
+        """
+        Returns an upper bound of the bytes encryption adds to a message with
+        any of the supported protocols, e.g. to keep an encrypted message
+        within the MaxEnvelopeSize of the server.
+
+        :param message_length: The length of the unencrypted message
+        :return: The maximum difference between the encrypted and the unencrypted length
+        """
+        # CredSSP has the longest protocol string and splits the message
+        part_header, payload_header = cls._part_framing(b"application/HTTP-CredSSP-session-encrypted")
+        parts = max(-(-message_length // cls.SIXTEN_KB), 1)
+        part_overhead = len(part_header) + len(str(message_length)) + len(payload_header) + 4 + cls.MAX_WRAP_OVERHEAD
+        return parts * part_overhead + len(cls.MIME_BOUNDARY + b"--\r\n")
+
     def prepare_encrypted_request(self, session: requests.Session, endpoint: str | bytes, message: bytes) -> requests.PreparedRequest:
         """
         Creates a prepared request to send to the server with an encrypted message
@@ -64,23 +105,12 @@ class Encryption(object):
         :return: A prepared request that has an encrypted message
         """
         host = urlsplit(endpoint).hostname
-
-        if self.protocol == "credssp" and len(message) > self.SIXTEN_KB:
-            content_type = "multipart/x-multi-encrypted"
-            encrypted_message = b""
-            message_chunks = [message[i : i + self.SIXTEN_KB] for i in range(0, len(message), self.SIXTEN_KB)]
-            for message_chunk in message_chunks:
-                encrypted_chunk = self._encrypt_message(message_chunk, host)
-                encrypted_message += encrypted_chunk
-        else:
-            content_type = "multipart/encrypted"
-            encrypted_message = self._encrypt_message(message, host)
-        encrypted_message += self.MIME_BOUNDARY + b"--\r\n"
+        encrypted_message, content_type = self.encrypt(message, host)
 
         request = requests.Request("POST", endpoint, data=encrypted_message)
         prepared_request = session.prepare_request(request)
         prepared_request.headers["Content-Length"] = str(len(prepared_request.body)) if prepared_request.body else "0"
-        prepared_request.headers["Content-Type"] = '{0};protocol="{1}";boundary="Encrypted Boundary"'.format(content_type, self.protocol_string.decode())
+        prepared_request.headers["Content-Type"] = content_type
 
         return prepared_request
 
@@ -91,92 +121,181 @@ class Encryption(object):
         :param response: The response that needs to be decrypted
         :return: The unencrypted message from the server
         """
-        content_type = response.headers["Content-Type"]
-
-        if 'protocol="{0}"'.format(self.protocol_string.decode()) in content_type:
-            host = urlsplit(response.request.url).hostname
-            msg = self._decrypt_response(response, host)
-        else:
-            msg = response.content
-
-        return msg
+        host = urlsplit(response.request.url).hostname
+        return self.decrypt(response.content, response.headers["Content-Type"], host)
 
-    def _encrypt_message(self, message: bytes, host: str | bytes | None) -> bytes:
-        message_length = str(len(message)).encode()
-        encrypted_stream = self._build_message(message, host)
-
-        message_payload = (
-            self.MIME_BOUNDARY + b"\r\n"
-            b"\tContent-Type: " + self.protocol_string + b"\r\n"
-            b"\tOriginalContent: type=application/soap+xml;charset=UTF-8;Length=" + message_length + b"\r\n" + self.MIME_BOUNDARY + b"\r\n"
-            b"\tContent-Type: application/octet-stream\r\n" + encrypted_stream
-        )
-
-        return message_payload
+    def encrypt(self, message: bytes, host: str | bytes | None) -> tuple[bytes, str]:
+        """
+        Encrypts a message independently of the HTTP library used to send it
 
-    def _decrypt_response(self, response: requests.Response, host: str | bytes | None) -> bytes:
-        parts = response.content.split(self.MIME_BOUNDARY + b"\r\n")
-        parts = list(filter(None, parts))  # filter out empty parts of the split
-        message = b""
+        :param message: The unencrypted message to send to the server
+        :param host: The hostname of the server
+        :return: The encrypted request body and the Content-Type header to send it with
+        """
+        parts: list[bytes] = []
+        if self.protocol == "credssp" and len(message) > self.SIXTEN_KB:
+            content_type = "multipart/x-multi-encrypted"
+            for i in range(0, len(message), self.SIXTEN_KB):
+                self._encrypt_part(parts, message[i : i + self.SIXTEN_KB], host)
+        else:
+            content_type = "multipart/encrypted"
+            self._encrypt_part(parts, message, host)
+        parts.append(self.MIME_BOUNDARY + b"--\r\n")
 
-        for i in range(0, len(parts)):
-            if i % 2 == 1:
-                continue
+        return b"".join(parts), '{0};{1};boundary="Encrypted Boundary"'.format(content_type, self._content_type_protocol)
 
-            header = parts[i].strip()
-            payload = parts[i + 1]
+    def decrypt(self, content: bytes, content_type: str, host: str | bytes | None) -> bytes:
+        """
+        Decrypts a response body independently of the HTTP library it was received with
 
-            expected_length = int(header.split(b"Length=")[1])
+        :param content: The response body
+        :param content_type: The Content-Type header of the response
+        :param host: The hostname of the server
+        :return: The unencrypted message from the server, content as is if it was not encrypted
+        """
+        if self._content_type_protocol in content_type:
+            return self._decrypt_response(content, host)
+        return content
 
-            # remove the end MIME block if it exists
-            if payload.endswith(self.MIME_BOUNDARY + b"--\r\n"):
-                payload = payload[: len(payload) - 24]
+    def decrypt_stream(self, chunks: collections.abc.Iterable[bytes], content_type: str, host: str | bytes | None) -> collections.abc.Iterator[bytes]:
+        """
+        Decrypts a response body while it is being received. Every part is
+        decrypted and yielded as soon as its payload is complete so only the
+        part being received is buffered.
+
+        :param chunks: The response body in pieces of any size
+        :param content_type: The Content-Type header of the response
+        :param host: The hostname of the server
+        :return: The unencrypted message from the server part by part, the chunks as is if it was not encrypted
+        """
+        if self._content_type_protocol not in content_type:
+            yield from chunks
+            return
+
+        boundary = self.MIME_BOUNDARY + b"\r\n"
+        buffer = bytearray()
+        expected_length: int | None = None
+        # where to continue looking for the end of the payload received so far
+        search_start = 0
+
+        for chunk in chunks:
+            buffer += chunk
+            while True:
+                if expected_length is None:
+                    header_start = buffer.find(boundary)
+                    header_end = -1 if header_start == -1 else buffer.find(boundary, header_start + len(boundary))
+                    if header_end == -1:
+                        break
+                    expected_length = int(bytes(buffer[header_start + len(boundary) : header_end]).split(b"Length=")[1])
+                    del buffer[: header_end + len(boundary)]
+                    search_start = 0
+
+                # the payload ends at the next part or at the end MIME block
+                payload_end = buffer.find(self.MIME_BOUNDARY, search_start)
+                if payload_end == -1:
+                    search_start = max(len(buffer) - len(self.MIME_BOUNDARY) + 1, 0)
+                    break
+                yield self._decrypt_part(buffer, payload_end, expected_length, host)
+                expected_length = None
+
+        if expected_length is not None:
+            yield self._decrypt_part(buffer, len(buffer), expected_length, host)
+
+    def _decrypt_part(self, buffer: bytearray, payload_end: int, expected_length: int, host: str | bytes | None) -> bytes:
+        # the payload is moved out so the buffer can keep growing while the
+        # auth context works on a view of it
+        payload = buffer[:payload_end]
+        del buffer[:payload_end]
+
+        payload_start = len(self.OCTET_STREAM_HEADER) if payload.startswith(self.OCTET_STREAM_HEADER) else 0
+        decrypted_message = self._decrypt_message(memoryview(payload)[payload_start:], host)
+        if len(decrypted_message) != expected_length:
+            raise WinRMError("Encrypted length from server does not match the " "expected size, message has been tampered with")
+        return decrypted_message
 
-            encrypted_data = payload.replace(b"\tContent-Type: application/octet-stream\r\n", b"")
-            decrypted_message = self._decrypt_message(encrypted_data, host)
+    def _encrypt_message(self, message: bytes, host: str | bytes | None) -> bytes:
+        parts: list[bytes] = []
+        self._encrypt_part(parts, message, host)
+        return b"".join(parts)
+
+    def _encrypt_part(self, parts: list[bytes], message: bytes, host: str | bytes | None) -> None:
+        # the pieces are joined once for the whole body instead of copying
+        # it for every part
+        parts.append(self._part_header)
+        parts.append(str(len(message)).encode())
+        parts.append(self._payload_header)
+        parts.append(self._build_message(message, host))
+
+    def _decrypt_response(self, content: bytes, host: str | bytes | None) -> bytes:
+        boundary = self.MIME_BOUNDARY + b"\r\n"
+        # the encrypted data is handed to the auth context as a view of the
+        # body, only the decrypted parts are copied
+        view = memoryview(content)
+        messages = []
+
+        header_start = content.find(boundary)
+        while header_start != -1:
+            header_start += len(boundary)
+            header_end = content.find(boundary, header_start)
+            if header_end == -1:
+                break
+            expected_length = int(content[header_start:header_end].split(b"Length=")[1])
+
+            payload_start = header_end + len(boundary)
+            if content.startswith(self.OCTET_STREAM_HEADER, payload_start):
+                payload_start += len(self.OCTET_STREAM_HEADER)
+
+            # the payload ends at the next part or at the end MIME block
+            payload_end = content.find(self.MIME_BOUNDARY, payload_start)
+            if payload_end == -1:
+                payload_end = len(content)
+
+            decrypted_message = self._decrypt_message(view[payload_start:payload_end], host)
             actual_length = len(decrypted_message)
 
             if actual_length != expected_length:
                 raise WinRMError("Encrypted length from server does not match the " "expected size, message has been tampered with")
-            message += decrypted_message
+            messages.append(decrypted_message)
 
-        return message
+            header_start = content.find(boundary, payload_end)
+
+        return b"".join(messages)
 
-    def _decrypt_ntlm_message(self, encrypted_data: bytes, host: str | bytes | None) -> bytes:
-        signature_length = struct.unpack("<i", encrypted_data[:4])[0]
-        signature = encrypted_data[4 : signature_length + 4]
-        encrypted_message = encrypted_data[signature_length + 4 :]
+    def _decrypt_ntlm_message(self, encrypted_data: memoryview, host: str | bytes | None) -> bytes:
+        signature_length = struct.unpack_from("<i", encrypted_data)[0]
+        signature = bytes(encrypted_data[4 : signature_length + 4])
+        encrypted_message = bytes(encrypted_data[signature_length + 4 :])
 
-        message = self.session.auth.session_security.unwrap(encrypted_message, signature)  # type: ignore[union-attr]
+        message = self.session.auth.session_security.unwrap(encrypted_message, signature)
 
         return message
 
-    def _decrypt_credssp_message(self, encrypted_data: bytes, host: str | bytes | None) -> bytes:
+    def _decrypt_credssp_message(self, encrypted_data: memoryview, host: str | bytes | None) -> bytes:
         # trailer_length = struct.unpack("<i", encrypted_data[:4])[0]
-        encrypted_message = encrypted_data[4:]
+        encrypted_message = bytes(encrypted_data[4:])
 
-        credssp_context = self.session.auth.contexts[host]  # type: ignore[union-attr]
+        credssp_context = self.session.auth.contexts[host]
         message = credssp_context.unwrap(encrypted_message)
 
         return message
 
-    def _decrypt_kerberos_message(self, encrypted_data: bytes, host: str | bytes | None) -> bytes:
-        signature_length = struct.unpack("<i", encrypted_data[:4])[0]
-        signature = encrypted_data[4 : signature_length + 4]
-        encrypted_message = encrypted_data[signature_length + 4 :]
+    def _decrypt_kerberos_message(self, encrypted_data: memoryview, host: str | bytes | None) -> bytes:
+        signature_length = struct.unpack_from("<i", encrypted_data)[0]
+        signature = bytes(encrypted_data[4 : signature_length + 4])
+        encrypted_message = bytes(encrypted_data[signature_length + 4 :])
 
-        message = self.session.auth.unwrap_winrm(host, encrypted_message, signature)  # type: ignore[union-attr]
+        message = self.session.auth.unwrap_winrm(host, encrypted_message, signature)
 
         return message
 
     def _build_ntlm_message(self, message: bytes, host: str | bytes | None) -> bytes:
-        sealed_message, signature = self.session.auth.session_security.wrap(message)  # type: ignore[union-attr]
+        sealed_message, signature = self.session.auth.session_security.wrap(message)
         signature_length = struct.pack("<i", len(signature))
 
         return signature_length + signature + sealed_message
 
     def _build_credssp_message(self, message: bytes, host: str | bytes | None) -> bytes:
-        credssp_context = self.session.auth.contexts[host]  # type: ignore[union-attr]
+        credssp_context = self.session.auth.contexts[host]
         sealed_message = credssp_context.wrap(message)
 
         cipher_negotiated = credssp_context.tls_connection.get_cipher_name()
@@ -185,7 +304,7 @@ class Encryption(object):
         return struct.pack("<i", trailer_length) + sealed_message
 
     def _build_kerberos_message(self, message: bytes, host: str | bytes | None) -> bytes:
-        sealed_message, signature = self.session.auth.wrap_winrm(host, message)  # type: ignore[union-attr]
+        sealed_message, signature = self.session.auth.wrap_winrm(host, message)
         signature_length = struct.pack("<i", len(signature))
 
         return signature_length + signature + sealed_message
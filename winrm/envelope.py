@@ -0,0 +1,81 @@
+"""Renders WSMan envelopes from templates serialized once by xmltodict"""
+
+from __future__ import annotations
+
+import re
+import typing as t
+from xml.sax.saxutils import escape, quoteattr
+
+import xmltodict
+
+__all__ = ["EnvelopeTemplate"]
+
+# an attribute marker is matched with its quotes as quoteattr picks the
+# quote character from the value
+_MARKER = re.compile(r'="\{\{(\w+)\}\}"|\{\{(\w+)\}\}')
+
+
+class EnvelopeTemplate(object):
+    """
+    An envelope serialized by xmltodict.unparse once, with a marker in place
+    of every value that changes between messages. Rendering splices the
+    escaped values between the static parts so the result is identical to
+    unparsing the envelope with the values in place of the markers.
+
+    @param list parts: The static XML around the fields.
+    @param list fields: The name of each field and whether it is an attribute.
+    """
+
+    def __init__(self, parts: list[str], fields: list[tuple[str, bool]]) -> None:
+        self.parts = parts
+        self.fields = fields
+
+    @staticmethod
+    def field(name: str) -> str:
+        """Returns the marker to put in an envelope for the field name"""
+        return "{{%s}}" % name
+
+    @classmethod
+    def compile(cls, envelope: dict[str, t.Any]) -> EnvelopeTemplate:
+        """
+        Serializes an envelope containing markers from EnvelopeTemplate.field.
+        A marker must be a whole attribute value or be part of an element text.
+        @param dict envelope: The envelope as passed to xmltodict.unparse.
+        @rtype EnvelopeTemplate
+        """
+        xml = xmltodict.unparse(envelope)
+        parts = []
+        fields = []
+        pos = 0
+        for match in _MARKER.finditer(xml):
+            if match.group(1):
+                parts.append(xml[pos : match.start()] + "=")
+                fields.append((match.group(1), True))
+            else:
+                parts.append(xml[pos : match.start()])
+                fields.append((match.group(2), False))
+            pos = match.end()
+        parts.append(xml[pos:])
+        return cls(parts, fields)
+
+    def render(self, **values: str) -> str:
+        """Returns the envelope with the fields set to values"""
+        out = [self.parts[0]]
+        for (name, is_attribute), part in zip(self.fields, self.parts[1:]):
+            out.append(quoteattr(values[name]) if is_attribute else escape(values[name]))
+            out.append(part)
+        return "".join(out)
+
+    def bind(self, **values: str) -> EnvelopeTemplate:
+        """Returns a template with the given fields rendered, e.g. the ShellId
+        of the envelopes sent to one shell.
+        """
+        parts = [self.parts[0]]
+        fields = []
+        for (name, is_attribute), part in zip(self.fields, self.parts[1:]):
+            if name in values:
+                parts[-1] += (quoteattr(values[name]) if is_attribute else escape(values[name])) + part
+            else:
+                fields.append((name, is_attribute))
+                parts.append(part)
+        return EnvelopeTemplate(parts, fields)
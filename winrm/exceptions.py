@@ -65,6 +65,28 @@ class WSManFaultError(WinRMError):
         super().__init__("{0} (extended fault data: {1})".format(reason, fault_data))
 
 
+class WinRMTransferError(WinRMError):
+    """Raised when a file transfer fails on the remote host or the file
+    received does not match the file sent.
+    """
+
+
+class WinRMCommandTimeoutError(WinRMError):
+    """Raised when a command did not finish before its deadline. The command
+    was signalled to terminate, stdout and stderr hold the output received
+    until then.
+    """
+
+    def __init__(self, message: str, stdout: bytes = b"", stderr: bytes = b"") -> None:
+        super().__init__(message)
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class WinRMCommandCancelledError(WinRMCommandTimeoutError):
+    """Raised when a command was cancelled through its cancel event"""
+
+
 class WinRMTransportError(Exception):
     """WinRM errors specific to transport-level problems (unexpected HTTP error codes, etc)"""
 
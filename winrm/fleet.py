@@ -0,0 +1,212 @@
+"""Runs the same command on many hosts from a thread pool"""
+
+from __future__ import annotations
+
+import collections
+import collections.abc
+import concurrent.futures
+import threading
+import time
+import typing as t
+
+from winrm import Response, Session
+from winrm.exceptions import WinRMCommandCancelledError, WinRMError
+
+__all__ = ["Fleet", "FleetResult"]
+
+
+class FleetResult(t.NamedTuple):
+    """The outcome of a command on one host of a Fleet"""
+
+    host: str
+    response: Response | None
+    error: Exception | None
+    elapsed: float
+
+    @property
+    def ok(self) -> bool:
+        """Whether the command ran, a non zero status code still counts as ok"""
+        return self.error is None
+
+
+class _HostCancel(threading.Event):
+    """Set by the Fleet when its host misses the deadline, it also reads as
+    set once the cancel event of the caller is set
+    """
+
+    def __init__(self, parent: threading.Event | None) -> None:
+        super().__init__()
+        self.parent = parent
+
+    def is_set(self) -> bool:
+        return super().is_set() or (self.parent is not None and self.parent.is_set())
+
+
+class Fleet(object):
+    """
+    Runs run_cmd or run_ps on a list of hosts concurrently and yields the
+    results as they complete rather than in the order of hosts.
+
+    Every host gets its own Session created with auth and session_kwargs.
+    A host listed more than once gets the command once per entry.
+
+    @param iterable of string hosts: The targets, see Session.
+    @param tuple auth: The username and password used for every host.
+    @param int max_workers: The number of commands running at the same time.
+    @param int per_host_limit: The number of commands running at the same
+        time on a single host.
+    @param int deadline_sec: The number of seconds a host has to finish the
+        command. A late host is reported with a TimeoutError and its command
+        is cancelled, see the cancel option of Session.run_cmd, the thread
+        is freed once the Receive it waits for returns.
+    @param session_kwargs: Keyword arguments for Session, e.g. transport.
+
+    run_cmd and run_ps also take a cancel event like Session.run_cmd, once it
+    is set the running commands are cancelled and the hosts that have not
+    started are reported with a WinRMCommandCancelledError. A PowerShellHost
+    cannot be cancelled, so with deadline_sec or cancel run_ps does not use
+    the ps_host option of session_kwargs.
+    """
+
+    DEFAULT_MAX_WORKERS = 32
+    DEFAULT_PER_HOST_LIMIT = 1
+    # how often the cancel event of the caller is checked
+    CANCEL_POLL_SEC = 0.1
+
+    def __init__(
+        self,
+        hosts: collections.abc.Iterable[str],
+        auth: tuple[str, str],
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        per_host_limit: int = DEFAULT_PER_HOST_LIMIT,
+        deadline_sec: float | None = None,
+        **session_kwargs: t.Any,
+    ) -> None:
+        if max_workers < 1:
+            raise WinRMError("max_workers must be at least 1")
+        if per_host_limit < 1:
+            raise WinRMError("per_host_limit must be at least 1")
+
+        self.hosts = list(hosts)
+        self.auth = auth
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.deadline_sec = deadline_sec
+        self.session_kwargs = session_kwargs
+
+    def run_cmd(self, command: str, args: collections.abc.Iterable[str | bytes] = (), **kwargs: t.Any) -> collections.abc.Iterator[FleetResult]:
+        """
+        Runs a command on every host, see Session.run_cmd.
+        @returns The result of every host in the order they complete.
+        @rtype iterator of FleetResult
+        """
+        args = list(args)
+        parent = kwargs.pop("cancel", None)
+        return self._run(lambda session, cancel: session.run_cmd(command, args, cancel=cancel, **kwargs), parent)
+
+    def run_ps(self, script: str, **kwargs: t.Any) -> collections.abc.Iterator[FleetResult]:
+        """
+        Runs a Powershell script on every host, see Session.run_ps.
+        @returns The result of every host in the order they complete.
+        @rtype iterator of FleetResult
+        """
+        parent = kwargs.pop("cancel", None)
+        return self._run(lambda session, cancel: session.run_ps(script, cancel=cancel, **kwargs), parent)
+
+    @staticmethod
+    def summarize(results: collections.abc.Iterable[FleetResult]) -> dict[str, list[str]]:
+        """
+        Groups the hosts that failed by the name of the exception they failed
+        with, e.g. InvalidCredentialsError, WinRMTransportError or
+        WSManFaultError.
+        @param iterable of FleetResult results: The results of a run.
+        @returns The failed hosts keyed by exception type name.
+        @rtype dict
+        """
+        failures: dict[str, list[str]] = {}
+        for result in results:
+            if result.error is not None:
+                failures.setdefault(type(result.error).__name__, []).append(result.host)
+        return failures
+
+    def _run(self, run: t.Callable[[Session, threading.Event | None], Response], parent: threading.Event | None) -> collections.abc.Iterator[FleetResult]:
+        pending = collections.deque(self.hosts)
+        hosts: dict[concurrent.futures.Future[FleetResult], str] = {}
+        started: dict[concurrent.futures.Future[FleetResult], float] = {}
+        # without a deadline or a cancel event of the caller nothing is
+        # cancelled and run_ps can still use a PowerShellHost
+        cancels: dict[concurrent.futures.Future[FleetResult], _HostCancel | None] = {}
+        # late commands still hold their worker and host slot until they return
+        abandoned: set[concurrent.futures.Future[FleetResult]] = set()
+        active: collections.Counter[str] = collections.Counter()
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="winrm-fleet")
+        try:
+            while pending or started:
+                if parent is not None and parent.is_set():
+                    while pending:
+                        yield FleetResult(pending.popleft(), None, WinRMCommandCancelledError("the command was cancelled"), 0)
+                    if not started:
+                        break
+
+                # start as many hosts as the limits allow, keeping the order
+                # of the hosts that have to wait
+                waiting: collections.deque[str] = collections.deque()
+                while pending and len(hosts) < self.max_workers:
+                    host = pending.popleft()
+                    if active[host] >= self.per_host_limit:
+                        waiting.append(host)
+                        continue
+
+                    cancel = _HostCancel(parent) if self.deadline_sec is not None or parent is not None else None
+                    future = executor.submit(self._run_host, host, run, cancel)
+                    cancels[future] = cancel
+                    active[host] += 1
+                    hosts[future] = host
+                    started[future] = time.monotonic()
+                pending.extendleft(reversed(waiting))
+
+                timeout = None
+                if self.deadline_sec is not None and started:
+                    timeout = max(min(started.values()) + self.deadline_sec - time.monotonic(), 0)
+                if parent is not None:
+                    # the event of the caller is polled, nothing signals it
+                    timeout = self.CANCEL_POLL_SEC if timeout is None else min(timeout, self.CANCEL_POLL_SEC)
+
+                done, _ = concurrent.futures.wait(hosts, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    host = hosts.pop(future)
+                    del cancels[future]
+                    active[host] -= 1
+                    if future in abandoned:
+                        abandoned.discard(future)
+                    else:
+                        del started[future]
+                        yield future.result()
+
+                if self.deadline_sec is not None:
+                    now = time.monotonic()
+                    for future, start in list(started.items()):
+                        if now - start >= self.deadline_sec:
+                            del started[future]
+                            abandoned.add(future)
+                            t.cast(_HostCancel, cancels[future]).set()
+                            error = TimeoutError("the command did not finish within {0} seconds".format(self.deadline_sec))
+                            yield FleetResult(hosts[future], None, error, now - start)
+        finally:
+            for future in hosts:
+                future.cancel()
+                cancel = cancels[future]
+                if cancel is not None:
+                    cancel.set()
+            executor.shutdown(wait=False)
+
+    def _run_host(self, host: str, run: t.Callable[[Session, threading.Event | None], Response], cancel: threading.Event | None) -> FleetResult:
+        start = time.monotonic()
+        try:
+            with Session(host, self.auth, **self.session_kwargs) as session:
+                response = run(session, cancel)
+        except Exception as err:
+            return FleetResult(host, None, err, time.monotonic() - start)
+
+        return FleetResult(host, response, None, time.monotonic() - start)
@@ -0,0 +1,35 @@
+"""Builds the powershell.exe command lines of the scripts run on the remote host"""
+
+from __future__ import annotations
+
+import re
+from base64 import b64encode
+
+__all__ = ["MAX_COMMAND_LINE", "build_command"]
+
+# the longest command line cmd.exe runs, run_cmd and run_ps start their
+# commands through it unless skip_cmd_shell is set
+MAX_COMMAND_LINE = 8191
+
+
+def build_command(script: str, /, **variables: str | int) -> str:
+    """
+    Returns a powershell.exe command line that sets the variables in the
+    order given and runs script. The script and the variables are encoded as
+    base64 of UTF-16, so the command line is about 2.7 times their length.
+    @param string script: The PowerShell script to run.
+    @param variables: The values of the variables set before the script
+        runs, integers or strings.
+    @returns The command line.
+    @rtype string
+    """
+    lines = []
+    for name, value in variables.items():
+        if isinstance(value, int):
+            lines.append("${0} = {1:d}\n".format(name, value))
+        else:
+            # quotes are escaped by doubling them, PowerShell also accepts
+            # the typographic single quotes as quotes
+            lines.append("${0} = '{1}'\n".format(name, re.sub("(['\u2018\u2019\u201a\u201b])", r"\1\1", value)))
+    encoded_ps = b64encode("".join(lines + [script]).encode("utf_16_le")).decode("ascii")
+    return "powershell.exe -NoProfile -NonInteractive -ExecutionPolicy Bypass -EncodedCommand {0}".format(encoded_ps)
@@ -3,14 +3,23 @@
 from __future__ import annotations
 
 import base64
+import binascii
 import collections.abc
+import math
+import re
+import threading
+import time
 import typing as t
 import uuid
-import xml.etree.ElementTree as ET
 
 import xmltodict
 
+from winrm import xml_backend
+from winrm.encryption import Encryption
+from winrm.envelope import EnvelopeTemplate
 from winrm.exceptions import (
+    WinRMCommandCancelledError,
+    WinRMCommandTimeoutError,
     WinRMError,
     WinRMOperationTimeoutError,
     WinRMTransportError,
@@ -18,6 +27,13 @@ from winrm.exceptions import (
 )
 from winrm.transport import Transport
 
+CommandInput = t.Union[str, bytes, bytearray, memoryview, t.IO[bytes], t.IO[str], collections.abc.Iterable[bytes]]
+
+# the WSManFault code of a Receive that had no output within its
+# OperationTimeout and the start tag of that fault's detail element
+_OPERATION_TIMEOUT_CODE = 2150858793
+_OPERATION_TIMEOUT_FAULT = re.compile(r"""<(?:[\w.-]+:)?WSManFault\s[^>]*\bCode=["']%d["']""" % _OPERATION_TIMEOUT_CODE)
+
 xmlns = {
     "soapenv": "http://www.w3.org/2003/05/soap-envelope",
     "soapaddr": "http://schemas.xmlsoap.org/ws/2004/08/addressing",
@@ -26,17 +42,680 @@ xmlns = {
 }
 
 
-class Protocol(object):
+class SendStats(t.NamedTuple):
+    """The input sent by Protocol.stream_command_input"""
+
+    bytes_sent: int
+    messages: int
+    elapsed: float
+
+    @property
+    def bytes_per_sec(self) -> float:
+        return self.bytes_sent / self.elapsed if self.elapsed else 0.0
+
+
+class ReceiveStats(object):
+    """
+    Counts the Receive requests sent by Protocol.iter_command_output. An
+    empty Receive returned no output before its OperationTimeout, a high
+    empty_rate means the commands are polled more often than they write
+    output.
+    """
+
+    def __init__(self) -> None:
+        self.receives = 0
+        self.empty_receives = 0
+        self._lock = threading.Lock()
+
+    @property
+    def empty_rate(self) -> float:
+        """The share of the Receive requests that were empty"""
+        return self.empty_receives / self.receives if self.receives else 0.0
+
+    def record(self, empty: bool) -> None:
+        with self._lock:
+            self.receives += 1
+            if empty:
+                self.empty_receives += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self.receives = self.empty_receives = 0
+
+
+class CommandOutput(t.Tuple[bytes, bytes, int]):
+    """The stdout, stderr and return code returned by
+    Protocol.get_command_output. truncated is set when the output went past
+    max_output_bytes and the command was terminated, the return code is -1
+    then.
+    """
+
+    truncated: bool
+
+    def __new__(cls, stdout: bytes, stderr: bytes, return_code: int, truncated: bool = False) -> CommandOutput:
+        self = super().__new__(cls, (stdout, stderr, return_code))
+        self.truncated = truncated
+        return self
+
+    @property
+    def stdout(self) -> bytes:
+        return self[0]
+
+    @property
+    def stderr(self) -> bytes:
+        return self[1]
+
+    @property
+    def return_code(self) -> int:
+        return self[2]
+
+
+class BaseProtocol(object):
+    """Builds the WSMan messages and parses their responses. This is shared
+    by Protocol and winrm.aio.AsyncProtocol, which only differ in how the
+    messages are sent.
+    """
+
+    DEFAULT_READ_TIMEOUT_SEC = 30
+    DEFAULT_OPERATION_TIMEOUT_SEC = 20
+    DEFAULT_MAX_ENV_SIZE = 153600
+    DEFAULT_LOCALE = "en-US"
+    MAX_SHELL_TEMPLATES = 64
+
+    def __init__(
+        self,
+        read_timeout_sec: str | int = DEFAULT_READ_TIMEOUT_SEC,
+        operation_timeout_sec: str | int = DEFAULT_OPERATION_TIMEOUT_SEC,
+        min_receive_timeout_sec: int | None = None,
+    ) -> None:
+        try:
+            read_timeout_sec = int(read_timeout_sec)
+        except ValueError as ve:
+            raise ValueError("failed to parse read_timeout_sec as int: %s" % str(ve))
+
+        try:
+            operation_timeout_sec = int(operation_timeout_sec)
+        except ValueError as ve:
+            raise ValueError("failed to parse operation_timeout_sec as int: %s" % str(ve))
+
+        if operation_timeout_sec >= read_timeout_sec or operation_timeout_sec < 1:
+            raise WinRMError("read_timeout_sec must exceed operation_timeout_sec, and both must be non-zero")
+
+        if min_receive_timeout_sec is not None and not 1 <= min_receive_timeout_sec <= operation_timeout_sec:
+            raise WinRMError("min_receive_timeout_sec must be between 1 and operation_timeout_sec")
+
+        self.read_timeout_sec = read_timeout_sec
+        self.operation_timeout_sec = operation_timeout_sec
+        self.min_receive_timeout_sec = min_receive_timeout_sec
+        self.receive_stats = ReceiveStats()
+        self.max_env_sz = BaseProtocol.DEFAULT_MAX_ENV_SIZE
+        self.locale = BaseProtocol.DEFAULT_LOCALE
+
+        # envelopes are rendered from templates compiled on first use, the
+        # ones sent to a shell have its ShellId filled in already
+        self._templates: dict[tuple[t.Any, ...], EnvelopeTemplate] = {}
+        self._shell_templates: dict[str, dict[tuple[t.Any, ...], EnvelopeTemplate]] = {}
+        self._shell_templates_lock = threading.Lock()
+        # commands terminated by get_command_output, cleanup_command has
+        # nothing left to do for them
+        self._terminated_commands: set[str] = set()
+
+    # Helper method for building SOAP Header
+    def build_wsman_header(
+        self,
+        action: str,
+        resource_uri: str,
+        shell_id: str | None = None,
+        message_id: str | uuid.UUID | None = None,
+        operation_timeout_sec: int | None = None,
+    ) -> dict[str, t.Any]:
+        """
+        Builds the standard header needed for WSMan operations. The return
+        value is a dictionary that can be used by xmltodict to generate the
+        WSMan envelope when sending custom requests.
+
+        @param string action: The WSMan action to perform.
+        @param string resource_uri: The WSMan resource URI the request is for.
+        @param string shell_id: The optional shell UUID the request is for.
+        @param string message_id: A unique message UUID, if unset a random UUID
+            is used.
+        @param int operation_timeout_sec: The OperationTimeout of this
+            request, defaults to operation_timeout_sec.
+        @returns The WSMan header as a dictionary.
+        @rtype dict[str, t.Any]
+        """
+        if not message_id:
+            message_id = uuid.uuid4()
+        header: dict[str, t.Any] = {
+            "@xmlns:xsd": "http://www.w3.org/2001/XMLSchema",
+            "@xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
+            "@xmlns:env": xmlns["soapenv"],
+            "@xmlns:a": xmlns["soapaddr"],
+            "@xmlns:b": "http://schemas.dmtf.org/wbem/wsman/1/cimbinding.xsd",
+            "@xmlns:n": "http://schemas.xmlsoap.org/ws/2004/09/enumeration",
+            "@xmlns:x": "http://schemas.xmlsoap.org/ws/2004/09/transfer",
+            "@xmlns:w": "http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd",
+            "@xmlns:p": "http://schemas.microsoft.com/wbem/wsman/1/wsman.xsd",
+            "@xmlns:rsp": "http://schemas.microsoft.com/wbem/wsman/1/windows/shell",  # NOQA
+            "@xmlns:cfg": "http://schemas.microsoft.com/wbem/wsman/1/config",
+            "env:Header": {
+                "a:To": "http://windows-host:5985/wsman",
+                "a:ReplyTo": {"a:Address": {"@mustUnderstand": "true", "#text": "http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous"}},  # NOQA
+                "w:MaxEnvelopeSize": {"@mustUnderstand": "true", "#text": "153600"},
+                "a:MessageID": "uuid:{0}".format(message_id),
+                "w:Locale": {"@mustUnderstand": "false", "@xml:lang": "en-US"},
+                "p:DataLocale": {"@mustUnderstand": "false", "@xml:lang": "en-US"},
+                # TODO: research this a bit http://msdn.microsoft.com/en-us/library/cc251561(v=PROT.13).aspx  # NOQA
+                # 'cfg:MaxTimeoutms': 600
+                # Operation timeout in ISO8601 format, see http://msdn.microsoft.com/en-us/library/ee916629(v=PROT.13).aspx  # NOQA
+                "w:OperationTimeout": "PT{0}S".format(int(operation_timeout_sec or self.operation_timeout_sec)),
+                "w:ResourceURI": {"@mustUnderstand": "true", "#text": resource_uri},
+                "a:Action": {"@mustUnderstand": "true", "#text": action},
+            },
+        }
+        if shell_id:
+            header["env:Header"]["w:SelectorSet"] = {"w:Selector": {"@Name": "ShellId", "#text": shell_id}}
+        return header
+
+    # For backwards compatibility with Ansible. This should not be removed
+    # until all supported releases of Ansible has been updated to use the new
+    # method.
+    _get_soap_header = build_wsman_header
+
+    def _template(self, key: tuple[t.Any, ...], build: t.Callable[[], dict[str, t.Any]]) -> EnvelopeTemplate:
+        # the header depends on the operation timeout which can be changed
+        key += (self.operation_timeout_sec,)
+        template = self._templates.get(key)
+        if template is None:
+            template = self._templates[key] = EnvelopeTemplate.compile(build())
+        return template
+
+    def _shell_template(self, key: tuple[t.Any, ...], shell_id: str, build: t.Callable[[], dict[str, t.Any]]) -> EnvelopeTemplate:
+        shell_templates = self._shell_templates.get(shell_id)
+        shell_key = key + (self.operation_timeout_sec,)
+        template = shell_templates.get(shell_key) if shell_templates else None
+        if template is None:
+            template = self._template(key, build).bind(shell_id=shell_id)
+            with self._shell_templates_lock:
+                if shell_id not in self._shell_templates and len(self._shell_templates) >= self.MAX_SHELL_TEMPLATES:
+                    # drop the oldest shell, it was likely closed without close_shell
+                    del self._shell_templates[next(iter(self._shell_templates))]
+                self._shell_templates.setdefault(shell_id, {})[shell_key] = template
+        return template
+
+    def _check_operation_timeout(self, operation_timeout_sec: int) -> None:
+        # the server can block for the whole OperationTimeout, the HTTP read
+        # has to wait longer than that
+        if not 1 <= operation_timeout_sec < self.read_timeout_sec:
+            raise WinRMError("read_timeout_sec must exceed operation_timeout_sec, and both must be non-zero")
+
+    def _open_shell_envelope(
+        self,
+        i_stream: str,
+        o_stream: str,
+        working_directory: str | None,
+        env_vars: collections.abc.Iterable[tuple[str, str]],
+        noprofile: str,
+        codepage: str,
+        idle_timeout: str | None,
+        message_id: str | None = None,
+    ) -> dict[str, t.Any]:
+        req = {
+            "env:Envelope": self.build_wsman_header(
+                resource_uri="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd",  # NOQA
+                action="http://schemas.xmlsoap.org/ws/2004/09/transfer/Create",
+                message_id=message_id,
+            )
+        }
+        header = req["env:Envelope"]["env:Header"]
+        header["w:OptionSet"] = {
+            "w:Option": [
+                {"@Name": "WINRS_NOPROFILE", "#text": noprofile},
+                {"@Name": "WINRS_CODEPAGE", "#text": codepage},
+            ]
+        }
+
+        shell = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:Shell", {})
+        shell["rsp:InputStreams"] = i_stream
+        shell["rsp:OutputStreams"] = o_stream
+
+        if working_directory:
+            # TODO ensure that rsp:WorkingDirectory should be nested within rsp:Shell  # NOQA
+            shell["rsp:WorkingDirectory"] = working_directory
+            # TODO check Lifetime param: http://msdn.microsoft.com/en-us/library/cc251546(v=PROT.13).aspx  # NOQA
+            # if lifetime:
+            #    shell['rsp:Lifetime'] = iso8601_duration.sec_to_dur(lifetime)
+        # TODO make it so the input is given in milliseconds and converted to xs:duration  # NOQA
+        if idle_timeout:
+            shell["rsp:IdleTimeOut"] = idle_timeout
+        env_vars = list(env_vars)
+        if env_vars:
+            # the rsp:Variable tag needs to be list of variables so that all
+            # environment variables in the env_vars dict are set on the shell
+            env = shell.setdefault("rsp:Environment", {}).setdefault("rsp:Variable", [])
+            for key, value in env_vars:
+                env.append({"@Name": key, "#text": value})
+
+        return req
+
+    def _build_open_shell(
+        self,
+        i_stream: str,
+        o_stream: str,
+        working_directory: str | None,
+        env_vars: dict[str, str] | None,
+        noprofile: bool,
+        codepage: int,
+        idle_timeout: str | int | None,
+    ) -> str:
+        env_vars = env_vars or {}
+        field = EnvelopeTemplate.field
+        template = self._template(
+            ("open_shell", bool(working_directory), bool(idle_timeout), len(env_vars)),
+            lambda: self._open_shell_envelope(
+                field("i_stream"),
+                field("o_stream"),
+                field("working_directory") if working_directory else None,
+                [(field("env_name%d" % i), field("env_value%d" % i)) for i in range(len(env_vars))],
+                field("noprofile"),
+                field("codepage"),
+                field("idle_timeout") if idle_timeout else None,
+                message_id=field("message_id"),
+            ),
+        )
+        values = dict(
+            message_id=str(uuid.uuid4()),
+            i_stream=i_stream,
+            o_stream=o_stream,
+            working_directory=working_directory or "",
+            noprofile=str(noprofile).upper(),  # TODO remove str call
+            codepage=str(codepage),  # TODO remove str call
+            idle_timeout=str(idle_timeout or ""),
+        )
+        for i, (key, value) in enumerate(env_vars.items()):
+            values["env_name%d" % i] = key
+            values["env_value%d" % i] = value
+        return template.render(**values)
+
+    def _close_shell_envelope(self, shell_id: str, message_id: str) -> dict[str, t.Any]:
+        req = {
+            "env:Envelope": self.build_wsman_header(
+                resource_uri="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd",  # NOQA
+                action="http://schemas.xmlsoap.org/ws/2004/09/transfer/Delete",
+                shell_id=shell_id,
+                message_id=message_id,
+            )
+        }
+
+        # SOAP message requires empty env:Body
+        req["env:Envelope"].setdefault("env:Body", {})
+
+        return req
+
+    def _build_close_shell(self, shell_id: str, message_id: uuid.UUID) -> str:
+        field = EnvelopeTemplate.field
+        template = self._shell_template(("close_shell",), shell_id, lambda: self._close_shell_envelope(field("shell_id"), field("message_id")))
+        return template.render(message_id=str(message_id))
+
+    def _get_shell_envelope(self, shell_id: str, message_id: str) -> dict[str, t.Any]:
+        req = {
+            "env:Envelope": self.build_wsman_header(
+                resource_uri="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd",  # NOQA
+                action="http://schemas.xmlsoap.org/ws/2004/09/transfer/Get",
+                shell_id=shell_id,
+                message_id=message_id,
+            )
+        }
+        req["env:Envelope"].setdefault("env:Body", {})
+        return req
+
+    def _build_get_shell(self, shell_id: str, message_id: uuid.UUID) -> str:
+        field = EnvelopeTemplate.field
+        template = self._shell_template(("get_shell",), shell_id, lambda: self._get_shell_envelope(field("shell_id"), field("message_id")))
+        return template.render(message_id=str(message_id))
+
+    def _run_command_envelope(
+        self,
+        shell_id: str,
+        command: str,
+        arguments: str | None,
+        console_mode_stdin: str,
+        skip_cmd_shell: str,
+        message_id: str | None = None,
+    ) -> dict[str, t.Any]:
+        req = {
+            "env:Envelope": self.build_wsman_header(
+                resource_uri="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd",  # NOQA
+                action="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Command",  # NOQA
+                shell_id=shell_id,
+                message_id=message_id,
+            )
+        }
+        header = req["env:Envelope"]["env:Header"]
+        header["w:OptionSet"] = {
+            "w:Option": [
+                {"@Name": "WINRS_CONSOLEMODE_STDIN", "#text": console_mode_stdin},
+                {"@Name": "WINRS_SKIP_CMD_SHELL", "#text": skip_cmd_shell},
+            ]
+        }
+        cmd_line = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:CommandLine", {})
+        cmd_line["rsp:Command"] = {"#text": command}
+        if arguments:
+            cmd_line["rsp:Arguments"] = arguments
+
+        return req
+
+    def _build_run_command(
+        self,
+        shell_id: str,
+        command: str,
+        arguments: collections.abc.Iterable[str | bytes],
+        console_mode_stdin: bool,
+        skip_cmd_shell: bool,
+    ) -> str:
+        unicode_args = [a if isinstance(a, str) else a.decode("utf-8") for a in arguments] if arguments else []
+        field = EnvelopeTemplate.field
+        template = self._shell_template(
+            ("run_command", bool(unicode_args)),
+            shell_id,
+            lambda: self._run_command_envelope(
+                field("shell_id"),
+                field("command"),
+                field("arguments") if unicode_args else None,
+                field("console_mode_stdin"),
+                field("skip_cmd_shell"),
+                message_id=field("message_id"),
+            ),
+        )
+        return template.render(
+            message_id=str(uuid.uuid4()),
+            command=command,
+            arguments=" ".join(unicode_args),
+            console_mode_stdin=str(console_mode_stdin).upper(),
+            skip_cmd_shell=str(skip_cmd_shell).upper(),
+        )
+
+    def _cleanup_command_envelope(self, shell_id: str, command_id: str, message_id: str) -> dict[str, t.Any]:
+        req = {
+            "env:Envelope": self.build_wsman_header(
+                resource_uri="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd",  # NOQA
+                action="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Signal",  # NOQA
+                shell_id=shell_id,
+                message_id=message_id,
+            )
+        }
+
+        # Signal the Command references to terminate (close stdout/stderr)
+        signal = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:Signal", {})
+        signal["@CommandId"] = command_id
+        signal["rsp:Code"] = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/signal/terminate"  # NOQA
+
+        return req
+
+    def _build_cleanup_command(self, shell_id: str, command_id: str, message_id: uuid.UUID) -> str:
+        field = EnvelopeTemplate.field
+        template = self._shell_template(
+            ("cleanup_command",), shell_id, lambda: self._cleanup_command_envelope(field("shell_id"), field("command_id"), field("message_id"))
+        )
+        return template.render(message_id=str(message_id), command_id=command_id)
+
+    def _send_command_input_envelope(self, shell_id: str, command_id: str, stdin_input: str, end: str, message_id: str | None = None) -> dict[str, t.Any]:
+        req = {
+            "env:Envelope": self.build_wsman_header(
+                resource_uri="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd",  # NOQA
+                action="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Send",  # NOQA
+                shell_id=shell_id,
+                message_id=message_id,
+            )
+        }
+        stdin_envelope = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:Send", {}).setdefault("rsp:Stream", {})
+        stdin_envelope["@CommandId"] = command_id
+        stdin_envelope["@Name"] = "stdin"
+        stdin_envelope["@End"] = end
+        stdin_envelope["@xmlns:rsp"] = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell"
+        stdin_envelope["#text"] = stdin_input
+        return req
+
+    def _build_send_command_input(self, shell_id: str, command_id: str, stdin_input: str | bytes | bytearray | memoryview, end: bool) -> str:
+        if isinstance(stdin_input, str):
+            stdin_input = stdin_input.encode("437")
+        field = EnvelopeTemplate.field
+        template = self._shell_template(
+            ("send_command_input",),
+            shell_id,
+            lambda: self._send_command_input_envelope(field("shell_id"), field("command_id"), field("stdin"), field("end"), message_id=field("message_id")),
+        )
+        return template.render(
+            message_id=str(uuid.uuid4()),
+            command_id=command_id,
+            stdin=base64.b64encode(stdin_input).decode("ascii"),
+            end="true" if end else "false",
+        )
+
+    def _send_input_chunk_size(self, shell_id: str, command_id: str, encrypted: bool) -> int:
+        """The most input a Send can carry while the message, with the input
+        base64 encoded and encrypted if need be, stays within max_env_sz.
+        """
+        # End="false" is the longer of the two
+        room = self.max_env_sz - len(self._build_send_command_input(shell_id, command_id, b"", False).encode("utf-8"))
+        if encrypted:
+            room -= Encryption.max_overhead(self.max_env_sz)
+        chunk_size = room // 4 * 3
+        if chunk_size < 1:
+            raise WinRMError("max_env_sz of %d bytes leaves no room for input in a Send message" % self.max_env_sz)
+        return chunk_size
+
+    @staticmethod
+    def _iter_input_chunks(stdin: CommandInput, chunk_size: int) -> collections.abc.Iterator[bytes | memoryview]:
+        """Slices the input into chunks of chunk_size bytes, only the last one
+        may be shorter. A file object may return less than asked for before
+        the end.
+        """
+        if isinstance(stdin, str):
+            stdin = stdin.encode("437")
+
+        if isinstance(stdin, (bytes, bytearray, memoryview)):
+            view = memoryview(stdin).cast("B")
+            for i in range(0, len(view), chunk_size):
+                yield view[i : i + chunk_size]
+
+        elif hasattr(stdin, "read"):
+            reader = t.cast(t.IO[t.Any], stdin)
+            while True:
+                data = reader.read(chunk_size)
+                if not data:
+                    break
+                yield data.encode("437") if isinstance(data, str) else data
+
+        else:
+            buffer = bytearray()
+            for data in stdin:
+                buffer += data
+                while len(buffer) >= chunk_size:
+                    yield bytes(buffer[:chunk_size])
+                    del buffer[:chunk_size]
+            if buffer:
+                yield bytes(buffer)
+
+    def _receive_envelope(self, shell_id: str, command_id: str, message_id: str | None = None, operation_timeout_sec: int | None = None) -> dict[str, t.Any]:
+        req = {
+            "env:Envelope": self.build_wsman_header(
+                resource_uri="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd",  # NOQA
+                action="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Receive",  # NOQA
+                shell_id=shell_id,
+                message_id=message_id,
+                operation_timeout_sec=operation_timeout_sec,
+            )
+        }
+
+        stream = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:Receive", {}).setdefault("rsp:DesiredStream", {})
+        stream["@CommandId"] = command_id
+        stream["#text"] = "stdout stderr"
+
+        return req
+
+    def _build_receive(self, shell_id: str, command_id: str, operation_timeout_sec: int | None = None) -> str:
+        if operation_timeout_sec == self.operation_timeout_sec:
+            operation_timeout_sec = None
+        field = EnvelopeTemplate.field
+        template = self._shell_template(
+            ("receive", operation_timeout_sec),
+            shell_id,
+            lambda: self._receive_envelope(field("shell_id"), field("command_id"), message_id=field("message_id"), operation_timeout_sec=operation_timeout_sec),
+        )
+        return template.render(message_id=str(uuid.uuid4()), command_id=command_id)
+
+    def _forget_shell(self, shell_id: str) -> None:
+        with self._shell_templates_lock:
+            self._shell_templates.pop(shell_id, None)
+
+    def _forget_command(self, command_id: str) -> None:
+        # the command ended without cleanup_command, e.g. with its shell
+        self._terminated_commands.discard(command_id)
+
+    def _parse_open_shell(self, res: bytes) -> str:
+        # res = xmltodict.parse(res)
+        # return res['s:Envelope']['s:Body']['x:ResourceCreated']['a:ReferenceParameters']['w:SelectorSet']['w:Selector']['#text']
+        root = xml_backend.fromstring(res)
+        return t.cast(str, next(node for node in root.findall(".//*") if node.get("Name") == "ShellId").text)
+
+    def _parse_run_command(self, res: bytes) -> str:
+        root = xml_backend.fromstring(res)
+        command_id = next(node for node in root.findall(".//*") if node.tag.endswith("CommandId")).text
+        return t.cast(str, command_id)
+
+    def _parse_receive(self, res: bytes) -> tuple[bytes, bytes, int, bool]:
+        # We may need to get additional output if the stream has not finished.
+        # The CommandState will change from Running to Done like so:
+        # @example
+        #   from...
+        #   <rsp:CommandState CommandId="..." State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Running"/>
+        #   to...
+        #   <rsp:CommandState CommandId="..." State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Done">
+        #     <rsp:ExitCode>0</rsp:ExitCode>
+        #   </rsp:CommandState>
+        # The streams, the command state and the exit code are collected in
+        # a single walk over the document.
+        nodes = xml_backend.iter_elements(xml_backend.fromstring(res))
+        next(nodes)  # skip the Envelope itself
+        stdout: list[str] = []
+        stderr: list[str] = []
+        done_states = 0
+        exit_code: str | None = None
+        for node in nodes:
+            tag = node.tag
+            if tag.endswith("Stream"):
+                if node.text:
+                    name = node.attrib["Name"]
+                    if name == "stdout":
+                        stdout.append(node.text)
+                    elif name == "stderr":
+                        stderr.append(node.text)
+            elif tag.endswith("ExitCode"):
+                if exit_code is None:
+                    exit_code = node.text or ""
+            if node.get("State", "").endswith("CommandState/Done"):
+                done_states += 1
+
+        command_done = done_states == 1
+        return_code = int(exit_code or -1) if command_done else -1
+
+        return self._decode_stream(stdout), self._decode_stream(stderr), return_code, command_done
+
+    @staticmethod
+    def _decode_stream(chunks: list[str]) -> bytes:
+        """Decodes the base64 text of a stream's chunks. Each chunk is padded on
+        its own, consecutive chunks are decoded together up to the next
+        padded one.
+        """
+        if len(chunks) == 1:
+            return binascii.a2b_base64(chunks[0])
+
+        decoded = []
+        start = 0
+        for end, chunk in enumerate(chunks, 1):
+            if chunk.endswith("=") or len(chunk) % 4 or end == len(chunks):
+                decoded.append(binascii.a2b_base64("".join(chunks[start:end])))
+                start = end
+        return b"".join(decoded)
+
+    def _check_relates_to(self, res: bytes, message_id: uuid.UUID) -> None:
+        root = xml_backend.fromstring(res)
+        relates_to = t.cast(str, next(node for node in root.findall(".//*") if node.tag.endswith("RelatesTo")).text)
+        # TODO change assert into user-friendly exception
+        assert uuid.UUID(relates_to.replace("uuid:", "")) == message_id
+
+    def _parse_fault(self, ex: WinRMTransportError) -> Exception:
+        """Converts a transport error for a WSMan fault response to the
+        matching WinRM exception, any other error is returned as is.
+        """
+        # a long poll ends with the timeout fault whenever a command has no
+        # output, recognise it without parsing the document
+        text = ex.response_text
+        if str(_OPERATION_TIMEOUT_CODE) in text and _OPERATION_TIMEOUT_FAULT.search(text):
+            return WinRMOperationTimeoutError()
+        return self._parse_fault_xml(ex)
+
+    def _parse_fault_xml(self, ex: WinRMTransportError) -> Exception:
+        try:
+            # if response is XML-parseable, it's probably a SOAP fault; extract the details
+            root = xml_backend.fromstring(ex.response_text)
+        except Exception:
+            # assume some other transport error; raise the original exception
+            return ex
+
+        fault = root.find("soapenv:Body/soapenv:Fault", xmlns)
+        if fault is None:
+            return ex
+
+        wsmanfault_code_raw = fault.find("soapenv:Detail/wsmanfault:WSManFault[@Code]", xmlns)
+        wsmanfault_code: int | None = None
+        if wsmanfault_code_raw is not None:
+            wsmanfault_code = int(wsmanfault_code_raw.attrib["Code"])
+
+            # convert receive timeout code to WinRMOperationTimeoutError
+            if wsmanfault_code == _OPERATION_TIMEOUT_CODE:
+                # TODO: this fault code is specific to the Receive operation; convert all op timeouts?
+                return WinRMOperationTimeoutError()
+
+        fault_code_raw = fault.find("soapenv:Code/soapenv:Value", xmlns)
+        fault_code: str | None = None
+        if fault_code_raw is not None and fault_code_raw.text:
+            fault_code = fault_code_raw.text
+
+        fault_subcode_raw = fault.find("soapenv:Code/soapenv:Subcode/soapenv:Value", xmlns)
+        fault_subcode: str | None = None
+        if fault_subcode_raw is not None and fault_subcode_raw.text:
+            fault_subcode = fault_subcode_raw.text
+
+        error_message_node = fault.find("soapenv:Reason/soapenv:Text", xmlns)
+        reason: str | None = None
+        if error_message_node is not None:
+            reason = error_message_node.text
+
+        wmi_error_code_raw = fault.find("soapenv:Detail/wmierror:MSFT_WmiError/wmierror:error_Code", xmlns)
+        wmi_error_code: int | None = None
+        if wmi_error_code_raw is not None and wmi_error_code_raw.text:
+            wmi_error_code = int(wmi_error_code_raw.text)
+
+        return WSManFaultError(
+            code=ex.code,
+            message=ex.message,
+            response=ex.response_text,
+            reason=reason or "(no error message in fault)",
+            fault_code=fault_code,
+            fault_subcode=fault_subcode,
+            wsman_fault_code=wsmanfault_code,
+            wmierror_code=wmi_error_code,
+        )
+
+
+class Protocol(BaseProtocol):
     """This is the main class that does the SOAP request/response logic. There
     are a few helper classes, but pretty much everything comes through here
     first.
     """
 
-    DEFAULT_READ_TIMEOUT_SEC = 30
-    DEFAULT_OPERATION_TIMEOUT_SEC = 20
-    DEFAULT_MAX_ENV_SIZE = 153600
-    DEFAULT_LOCALE = "en-US"
-
     def __init__(
         self,
         endpoint: str,
@@ -51,13 +730,18 @@ class Protocol(object):
         cert_key_pem: str | None = None,
         server_cert_validation: t.Literal["validate", "ignore"] | None = "validate",
         kerberos_delegation: bool = False,
-        read_timeout_sec: str | int = DEFAULT_READ_TIMEOUT_SEC,
-        operation_timeout_sec: str | int = DEFAULT_OPERATION_TIMEOUT_SEC,
+        read_timeout_sec: str | int = BaseProtocol.DEFAULT_READ_TIMEOUT_SEC,
+        operation_timeout_sec: str | int = BaseProtocol.DEFAULT_OPERATION_TIMEOUT_SEC,
         kerberos_hostname_override: str | None = None,
         message_encryption: t.Literal["auto", "always", "never"] = "auto",
         credssp_disable_tlsv1_2: bool = False,
         send_cbt: bool = True,
         proxy: t.Literal["legacy_requests"] | str | None = "legacy_requests",
+        stream_receive: bool = False,
+        min_receive_timeout_sec: int | None = None,
+        pool_maxsize: int = Transport.DEFAULT_POOL_MAXSIZE,
+        pool_idle_timeout_sec: float | None = None,
+        share_connections: bool = False,
     ):
         """
         @param string endpoint: the WinRM webservice endpoint
@@ -80,25 +764,15 @@ class Protocol(object):
         @param string kerberos_hostname_override: the hostname to use for the kerberos exchange (defaults to the hostname in the endpoint URL)
         @param bool message_encryption_enabled: Will encrypt the WinRM messages if set to True and the transport auth supports message encryption (Default True).
         @param string proxy: Specify a proxy for the WinRM connection to use. 'legacy_requests'(default) to use environment variables, None to disable proxies completely or the proxy URL itself.
+        @param bool stream_receive: Parse Receive responses incrementally as they are read from the connection so the output is decoded one stream element at a time instead of holding the whole envelope in memory (Default False). Encrypted responses are decrypted one part at a time as they are read and parsed once the whole response has been read, so the single encrypted connection is free again before any output is returned.
+        @param int min_receive_timeout_sec: The OperationTimeout of the first Receive for the output of a command, it doubles with every Receive that returns no output up to operation_timeout_sec (Default None, every Receive uses operation_timeout_sec). Short commands are polled often enough to notice a deadline or cancellation quickly and quiet long running ones with few empty round trips.
+        @param int pool_maxsize: The number of connections to the endpoint kept open for reuse (Default 10). Message encryption always uses a single connection.
+        @param float pool_idle_timeout_sec: Close the kept connections when no message was sent for this many seconds, e.g. below the keep-alive timeout of the server (Default None, keep them).
+        @param bool share_connections: Share the connections with the other protocols to the same endpoint with the same credentials and settings (Default False). Only basic and certificate auth can share, NTLM, Kerberos and CredSSP authenticate each connection.
         """
 
-        try:
-            read_timeout_sec = int(read_timeout_sec)
-        except ValueError as ve:
-            raise ValueError("failed to parse read_timeout_sec as int: %s" % str(ve))
-
-        try:
-            operation_timeout_sec = int(operation_timeout_sec)
-        except ValueError as ve:
-            raise ValueError("failed to parse operation_timeout_sec as int: %s" % str(ve))
-
-        if operation_timeout_sec >= read_timeout_sec or operation_timeout_sec < 1:
-            raise WinRMError("read_timeout_sec must exceed operation_timeout_sec, and both must be non-zero")
-
-        self.read_timeout_sec = read_timeout_sec
-        self.operation_timeout_sec = operation_timeout_sec
-        self.max_env_sz = Protocol.DEFAULT_MAX_ENV_SIZE
-        self.locale = Protocol.DEFAULT_LOCALE
+        super().__init__(read_timeout_sec, operation_timeout_sec, min_receive_timeout_sec)
+        self.stream_receive = stream_receive
 
         self.transport = Transport(
             endpoint=endpoint,
@@ -119,6 +793,9 @@ class Protocol(object):
             credssp_disable_tlsv1_2=credssp_disable_tlsv1_2,
             send_cbt=send_cbt,
             proxy=proxy,
+            pool_maxsize=pool_maxsize,
+            pool_idle_timeout_sec=pool_idle_timeout_sec,
+            share_connections=share_connections,
         )
 
         self.username = username
@@ -156,105 +833,8 @@ class Protocol(object):
          instance on the remote machine.
         @rtype string
         """
-        req = {
-            "env:Envelope": self.build_wsman_header(
-                resource_uri="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd",  # NOQA
-                action="http://schemas.xmlsoap.org/ws/2004/09/transfer/Create",
-            )
-        }
-        header = req["env:Envelope"]["env:Header"]
-        header["w:OptionSet"] = {
-            "w:Option": [
-                {"@Name": "WINRS_NOPROFILE", "#text": str(noprofile).upper()},  # TODO remove str call
-                {"@Name": "WINRS_CODEPAGE", "#text": str(codepage)},  # TODO remove str call
-            ]
-        }
-
-        shell = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:Shell", {})
-        shell["rsp:InputStreams"] = i_stream
-        shell["rsp:OutputStreams"] = o_stream
-
-        if working_directory:
-            # TODO ensure that rsp:WorkingDirectory should be nested within rsp:Shell  # NOQA
-            shell["rsp:WorkingDirectory"] = working_directory
-            # TODO check Lifetime param: http://msdn.microsoft.com/en-us/library/cc251546(v=PROT.13).aspx  # NOQA
-            # if lifetime:
-            #    shell['rsp:Lifetime'] = iso8601_duration.sec_to_dur(lifetime)
-        # TODO make it so the input is given in milliseconds and converted to xs:duration  # NOQA
-        if idle_timeout:
-            shell["rsp:IdleTimeOut"] = idle_timeout
-        if env_vars:
-            # the rsp:Variable tag needs to be list of variables so that all
-            # environment variables in the env_vars dict are set on the shell
-            env = shell.setdefault("rsp:Environment", {}).setdefault("rsp:Variable", [])
-            for key, value in env_vars.items():
-                env.append({"@Name": key, "#text": value})
-
-        res = self.send_message(xmltodict.unparse(req))
-
-        # res = xmltodict.parse(res)
-        # return res['s:Envelope']['s:Body']['x:ResourceCreated']['a:ReferenceParameters']['w:SelectorSet']['w:Selector']['#text']
-        root = ET.fromstring(res)
-        return t.cast(str, next(node for node in root.findall(".//*") if node.get("Name") == "ShellId").text)
-
-    # Helper method for building SOAP Header
-    def build_wsman_header(
-        self,
-        action: str,
-        resource_uri: str,
-        shell_id: str | None = None,
-        message_id: str | uuid.UUID | None = None,
-    ) -> dict[str, t.Any]:
-        """
-        Builds the standard header needed for WSMan operations. The return
-        value is a dictionary that can be used by xmltodict to generate the
-        WSMan envelope when sending custom requests.
-
-        @param string action: The WSMan action to perform.
-        @param string resource_uri: The WSMan resource URI the request is for.
-        @param string shell_id: The optional shell UUID the request is for.
-        @param string message_id: A unique message UUID, if unset a random UUID
-            is used.
-        @returns The WSMan header as a dictionary.
-        @rtype dict[str, t.Any]
-        """
-        if not message_id:
-            message_id = uuid.uuid4()
-        header: dict[str, t.Any] = {
-            "@xmlns:xsd": "http://www.w3.org/2001/XMLSchema",
-            "@xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
-            "@xmlns:env": xmlns["soapenv"],
-            "@xmlns:a": xmlns["soapaddr"],
-            "@xmlns:b": "http://schemas.dmtf.org/wbem/wsman/1/cimbinding.xsd",
-            "@xmlns:n": "http://schemas.xmlsoap.org/ws/2004/09/enumeration",
-            "@xmlns:x": "http://schemas.xmlsoap.org/ws/2004/09/transfer",
-            "@xmlns:w": "http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd",
-            "@xmlns:p": "http://schemas.microsoft.com/wbem/wsman/1/wsman.xsd",
-            "@xmlns:rsp": "http://schemas.microsoft.com/wbem/wsman/1/windows/shell",  # NOQA
-            "@xmlns:cfg": "http://schemas.microsoft.com/wbem/wsman/1/config",
-            "env:Header": {
-                "a:To": "http://windows-host:5985/wsman",
-                "a:ReplyTo": {"a:Address": {"@mustUnderstand": "true", "#text": "http://schemas.xmlsoap.org/ws/2004/08/addressing/role/anonymous"}},  # NOQA
-                "w:MaxEnvelopeSize": {"@mustUnderstand": "true", "#text": "153600"},
-                "a:MessageID": "uuid:{0}".format(message_id),
-                "w:Locale": {"@mustUnderstand": "false", "@xml:lang": "en-US"},
-                "p:DataLocale": {"@mustUnderstand": "false", "@xml:lang": "en-US"},
-                # TODO: research this a bit http://msdn.microsoft.com/en-us/library/cc251561(v=PROT.13).aspx  # NOQA
-                # 'cfg:MaxTimeoutms': 600
-                # Operation timeout in ISO8601 format, see http://msdn.microsoft.com/en-us/library/ee916629(v=PROT.13).aspx  # NOQA
-                "w:OperationTimeout": "PT{0}S".format(int(self.operation_timeout_sec)),
-                "w:ResourceURI": {"@mustUnderstand": "true", "#text": resource_uri},
-                "a:Action": {"@mustUnderstand": "true", "#text": action},
-            },
-        }
-        if shell_id:
-            header["env:Header"]["w:SelectorSet"] = {"w:Selector": {"@Name": "ShellId", "#text": shell_id}}
-        return header
-
-    # For backwards compatibility with Ansible. This should not be removed
-    # until all supported releases of Ansible has been updated to use the new
-    # method.
-    _get_soap_header = build_wsman_header
+        res = self.send_message(self._build_open_shell(i_stream, o_stream, working_directory, env_vars, noprofile, codepage, idle_timeout))
+        return self._parse_open_shell(res)
 
     def send_message(self, message: str) -> bytes:
         # TODO add message_id vs relates_to checking
@@ -263,57 +843,7 @@ class Protocol(object):
             resp = self.transport.send_message(message)
             return resp
         except WinRMTransportError as ex:
-            try:
-                # if response is XML-parseable, it's probably a SOAP fault; extract the details
-                root = ET.fromstring(ex.response_text)
-            except Exception:
-                # assume some other transport error; raise the original exception
-                raise ex
-
-            fault = root.find("soapenv:Body/soapenv:Fault", xmlns)
-            if fault is None:
-                raise
-
-            wsmanfault_code_raw = fault.find("soapenv:Detail/wsmanfault:WSManFault[@Code]", xmlns)
-            wsmanfault_code: int | None = None
-            if wsmanfault_code_raw is not None:
-                wsmanfault_code = int(wsmanfault_code_raw.attrib["Code"])
-
-                # convert receive timeout code to WinRMOperationTimeoutError
-                if wsmanfault_code == 2150858793:
-                    # TODO: this fault code is specific to the Receive operation; convert all op timeouts?
-                    raise WinRMOperationTimeoutError()
-
-            fault_code_raw = fault.find("soapenv:Code/soapenv:Value", xmlns)
-            fault_code: str | None = None
-            if fault_code_raw is not None and fault_code_raw.text:
-                fault_code = fault_code_raw.text
-
-            fault_subcode_raw = fault.find("soapenv:Code/soapenv:Subcode/soapenv:Value", xmlns)
-            fault_subcode: str | None = None
-            if fault_subcode_raw is not None and fault_subcode_raw.text:
-                fault_subcode = fault_subcode_raw.text
-
-            error_message_node = fault.find("soapenv:Reason/soapenv:Text", xmlns)
-            reason: str | None = None
-            if error_message_node is not None:
-                reason = error_message_node.text
-
-            wmi_error_code_raw = fault.find("soapenv:Detail/wmierror:MSFT_WmiError/wmierror:error_Code", xmlns)
-            wmi_error_code: int | None = None
-            if wmi_error_code_raw is not None and wmi_error_code_raw.text:
-                wmi_error_code = int(wmi_error_code_raw.text)
-
-            raise WSManFaultError(
-                code=ex.code,
-                message=ex.message,
-                response=ex.response_text,
-                reason=reason or "(no error message in fault)",
-                fault_code=fault_code,
-                fault_subcode=fault_subcode,
-                wsman_fault_code=wsmanfault_code,
-                wmierror_code=wmi_error_code,
-            )
+            raise self._parse_fault(ex)
 
     def close_shell(self, shell_id: str, close_session: bool = True) -> None:
         """
@@ -328,29 +858,35 @@ class Protocol(object):
         """
         try:
             message_id = uuid.uuid4()
-            req = {
-                "env:Envelope": self.build_wsman_header(
-                    resource_uri="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd",  # NOQA
-                    action="http://schemas.xmlsoap.org/ws/2004/09/transfer/Delete",
-                    shell_id=shell_id,
-                    message_id=message_id,
-                )
-            }
-
-            # SOAP message requires empty env:Body
-            req["env:Envelope"].setdefault("env:Body", {})
-
-            res = self.send_message(xmltodict.unparse(req))
-            root = ET.fromstring(res)
-            relates_to = t.cast(str, next(node for node in root.findall(".//*") if node.tag.endswith("RelatesTo")).text)
+            res = self.send_message(self._build_close_shell(shell_id, message_id))
         finally:
+            self._forget_shell(shell_id)
             # Close the transport if we are done with the shell.
             # This will ensure no lingering TCP connections are thrown back into a requests' connection pool.
             if close_session:
                 self.transport.close_session()
 
-        # TODO change assert into user-friendly exception
-        assert uuid.UUID(relates_to.replace("uuid:", "")) == message_id
+        self._check_relates_to(res, message_id)
+
+    def shell_alive(self, shell_id: str) -> bool:
+        """
+        Check that a shell still exists on the remote host with a Get of the
+        shell resource, e.g. before reusing a shell that has been idle.
+        @param string shell_id: The shell id on the remote machine.
+         See #open_shell
+        @returns False when the server answered with a fault, e.g. because
+         it removed the shell after its IdleTimeOut.
+        @rtype bool
+        """
+        message_id = uuid.uuid4()
+        try:
+            res = self.send_message(self._build_get_shell(shell_id, message_id))
+        except WSManFaultError:
+            self._forget_shell(shell_id)
+            return False
+
+        self._check_relates_to(res, message_id)
+        return True
 
     def run_command(
         self,
@@ -373,30 +909,8 @@ class Protocol(object):
          This is the ID we need to query in order to get output.
         @rtype string
         """
-        req = {
-            "env:Envelope": self.build_wsman_header(
-                resource_uri="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd",  # NOQA
-                action="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Command",  # NOQA
-                shell_id=shell_id,
-            )
-        }
-        header = req["env:Envelope"]["env:Header"]
-        header["w:OptionSet"] = {
-            "w:Option": [
-                {"@Name": "WINRS_CONSOLEMODE_STDIN", "#text": str(console_mode_stdin).upper()},
-                {"@Name": "WINRS_SKIP_CMD_SHELL", "#text": str(skip_cmd_shell).upper()},
-            ]
-        }
-        cmd_line = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:CommandLine", {})
-        cmd_line["rsp:Command"] = {"#text": command}
-        if arguments:
-            unicode_args = [a if isinstance(a, str) else a.decode("utf-8") for a in arguments]
-            cmd_line["rsp:Arguments"] = " ".join(unicode_args)
-
-        res = self.send_message(xmltodict.unparse(req))
-        root = ET.fromstring(res)
-        command_id = next(node for node in root.findall(".//*") if node.tag.endswith("CommandId")).text
-        return t.cast(str, command_id)
+        res = self.send_message(self._build_run_command(shell_id, command, arguments, console_mode_stdin, skip_cmd_shell))
+        return self._parse_run_command(res)
 
     def cleanup_command(self, shell_id: str, command_id: str) -> None:
         """
@@ -409,26 +923,12 @@ class Protocol(object):
          for now.
         @rtype bool
         """
+        if command_id in self._terminated_commands:
+            self._terminated_commands.discard(command_id)
+            return
         message_id = uuid.uuid4()
-        req = {
-            "env:Envelope": self.build_wsman_header(
-                resource_uri="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd",  # NOQA
-                action="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Signal",  # NOQA
-                shell_id=shell_id,
-                message_id=message_id,
-            )
-        }
-
-        # Signal the Command references to terminate (close stdout/stderr)
-        signal = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:Signal", {})
-        signal["@CommandId"] = command_id
-        signal["rsp:Code"] = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell/signal/terminate"  # NOQA
-
-        res = self.send_message(xmltodict.unparse(req))
-        root = ET.fromstring(res)
-        relates_to = t.cast(str, next(node for node in root.findall(".//*") if node.tag.endswith("RelatesTo")).text)
-        # TODO change assert into user-friendly exception
-        assert uuid.UUID(relates_to.replace("uuid:", "")) == message_id
+        res = self.send_message(self._build_cleanup_command(shell_id, command_id, message_id))
+        self._check_relates_to(res, message_id)
 
     def send_command_input(self, shell_id: str, command_id: str, stdin_input: str | bytes, end: bool = False) -> None:
         """
@@ -445,27 +945,53 @@ class Protocol(object):
         more input will be able to be sent to the process and attempting to do so should result in an error.
         @return: None
         """
-        if isinstance(stdin_input, str):
-            stdin_input = stdin_input.encode("437")
-        req = {
-            "env:Envelope": self.build_wsman_header(
-                resource_uri="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd",  # NOQA
-                action="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Send",  # NOQA
-                shell_id=shell_id,
-            )
-        }
-        stdin_envelope = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:Send", {}).setdefault("rsp:Stream", {})
-        stdin_envelope["@CommandId"] = command_id
-        stdin_envelope["@Name"] = "stdin"
-        if end:
-            stdin_envelope["@End"] = "true"
-        else:
-            stdin_envelope["@End"] = "false"
-        stdin_envelope["@xmlns:rsp"] = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell"
-        stdin_envelope["#text"] = base64.b64encode(stdin_input)
-        self.send_message(xmltodict.unparse(req))
+        self.send_message(self._build_send_command_input(shell_id, command_id, stdin_input, end))
+
+    def stream_command_input(self, shell_id: str, command_id: str, stdin: CommandInput, end: bool = True) -> SendStats:
+        """
+        Send input to the given shell and command without holding all of it
+        in memory. The input is sliced into the largest chunks that fit in a
+        Send message of max_env_sz bytes once base64 encoded and encrypted.
+        @param string shell_id: The shell id on the remote machine.
+         See #open_shell
+        @param string command_id: The command id on the remote machine.
+         See #run_command
+        @param stdin: The input as a string, a bytes-like object, a file
+         object opened in binary mode or an iterable of byte strings.
+        @param bool end: Whether to close the stdin stream with the last
+         message, see #send_command_input (default: True).
+        @return SendStats: The number of bytes and messages sent and how long
+         it took.
+        """
+        encrypted = self.transport.encryption is not None
+        chunks = self._iter_input_chunks(stdin, self._send_input_chunk_size(shell_id, command_id, encrypted))
+        bytes_sent = 0
+        messages = 0
+        start = time.monotonic()
+
+        chunk = next(chunks, None)
+        if chunk is None and end:
+            # stdin is still closed when there is no input
+            chunk = b""
+
+        # the next chunk is read ahead to know which one is the last
+        while chunk is not None:
+            next_chunk = next(chunks, None)
+            self.send_message(self._build_send_command_input(shell_id, command_id, chunk, end and next_chunk is None))
+            bytes_sent += len(chunk)
+            messages += 1
+            chunk = next_chunk
+
+        return SendStats(bytes_sent, messages, time.monotonic() - start)
 
-    def get_command_output(self, shell_id: str, command_id: str) -> tuple[bytes, bytes, int]:
+    def get_command_output(
+        self,
+        shell_id: str,
+        command_id: str,
+        max_output_bytes: int | None = None,
+        timeout_sec: float | None = None,
+        cancel: threading.Event | None = None,
+    ) -> CommandOutput:
         """
         Get the Output of the given shell and command. This will wait until the
         command is finished before returning the output.
@@ -474,23 +1000,149 @@ class Protocol(object):
          See #open_shell
         @param string command_id: The command id on the remote machine.
          See #run_command
-        @return tuple[bytes, bytes, int]: Returns a tuple with the stdout,
+        @param int max_output_bytes: Stop receiving once this many bytes of
+         stdout and stderr together have been received and terminate the
+         command, the output is cut off at the limit. The shell can run
+         other commands afterwards.
+        @param float timeout_sec: The number of seconds the command has to
+         finish, see #iter_command_output
+        @param threading.Event cancel: Stops waiting for the command once it
+         is set, see #iter_command_output
+        @return CommandOutput: Returns a tuple with the stdout,
             stderr, and the return code of the command. The stdout and stderr
-            value is a byte string and not a normal string.
+            value is a byte string and not a normal string. Its truncated
+            attribute tells whether max_output_bytes was reached.
+        @raises WinRMCommandTimeoutError: The command was terminated at the
+            deadline or when cancelled, the exception has the partial output.
         """
         stdout_buffer, stderr_buffer = [], []
+        return_code = -1
+        remaining = max_output_bytes
+        output = self.iter_command_output(shell_id, command_id, timeout_sec, cancel)
+        try:
+            for stream, data in output:
+                if isinstance(data, int):
+                    return_code = data
+                    continue
+                truncated = remaining is not None and len(data) > remaining
+                if remaining is not None:
+                    data = data[:remaining]
+                    remaining -= len(data)
+                if stream == "stdout":
+                    stdout_buffer.append(data)
+                else:
+                    stderr_buffer.append(data)
+                if truncated:
+                    # the rest of a streamed Receive response is not read
+                    output.close()
+                    self.terminate_command(shell_id, command_id)
+                    return CommandOutput(b"".join(stdout_buffer), b"".join(stderr_buffer), -1, truncated=True)
+        except WinRMCommandTimeoutError as err:
+            err.stdout = b"".join(stdout_buffer)
+            err.stderr = b"".join(stderr_buffer)
+            raise
+        return CommandOutput(b"".join(stdout_buffer), b"".join(stderr_buffer), return_code)
+
+    def terminate_command(self, shell_id: str, command_id: str) -> None:
+        """
+        Signals a running command to terminate, e.g. when its output is no
+        longer wanted. A later cleanup_command for it does nothing.
+        @param string shell_id: The shell id on the remote machine.
+        @param string command_id: The command id on the remote machine.
+        """
+        self.cleanup_command(shell_id, command_id)
+        self._terminated_commands.add(command_id)
+
+    def iter_command_output(
+        self,
+        shell_id: str,
+        command_id: str,
+        timeout_sec: float | None = None,
+        cancel: threading.Event | None = None,
+    ) -> collections.abc.Generator[tuple[str, bytes | int], None, None]:
+        """
+        Get the Output of the given shell and command as it is received. Each
+        stdout or stderr chunk is yielded as a ('stdout', bytes) or
+        ('stderr', bytes) tuple as soon as the Receive it was part of returns.
+        The last item is ('exit_code', int) once the command is finished.
+
+        The next Receive is only sent when the caller asks for more output so
+        a slow consumer will not have output buffered in memory.
+
+        The deadline and the cancel event are checked before every Receive,
+        a Receive waits for up to operation_timeout_sec for output so that is
+        how late they can be noticed. The command is then signalled to
+        terminate and the shell can run other commands. A Receive never
+        waits past the deadline.
+
+        With min_receive_timeout_sec set the first Receive waits that long,
+        every empty Receive doubles the wait up to operation_timeout_sec and
+        output brings it back down. The Receive requests are counted in
+        receive_stats.
+
+        @param string shell_id: The shell id on the remote machine.
+         See #open_shell
+        @param string command_id: The command id on the remote machine.
+         See #run_command
+        @param float timeout_sec: The number of seconds from the first Receive
+         the command has to finish.
+        @param threading.Event cancel: An event set by another thread to stop
+         the command.
+        @return iterator of tuple[str, bytes | int]: The output chunks
+            followed by the return code of the command.
+        @raises WinRMCommandTimeoutError: The command did not finish in
+            timeout_sec.
+        @raises WinRMCommandCancelledError: cancel was set.
+        """
+        deadline = time.monotonic() + timeout_sec if timeout_sec is not None else None
+        receive_timeout = self.min_receive_timeout_sec or self.operation_timeout_sec
         command_done = False
         while not command_done:
+            if cancel is not None and cancel.is_set():
+                self._stop_command(shell_id, command_id, WinRMCommandCancelledError("the command was cancelled"))
+            operation_timeout = receive_timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stop_command(shell_id, command_id, WinRMCommandTimeoutError("the command did not finish within {0} seconds".format(timeout_sec)))
+                operation_timeout = max(min(operation_timeout, math.ceil(remaining)), 1)
+
+            stdout = stderr = b""
+            got_output = False
             try:
-                stdout, stderr, return_code, command_done = self.get_command_output_raw(shell_id, command_id)
-                stdout_buffer.append(stdout)
-                stderr_buffer.append(stderr)
+                if self.stream_receive:
+                    return_code, command_done, got_output = yield from self._receive_stream(shell_id, command_id, operation_timeout)
+                elif operation_timeout == self.operation_timeout_sec:
+                    # subclasses may override get_command_output_raw without
+                    # the operation_timeout_sec argument
+                    stdout, stderr, return_code, command_done = self.get_command_output_raw(shell_id, command_id)
+                else:
+                    stdout, stderr, return_code, command_done = self.get_command_output_raw(shell_id, command_id, operation_timeout)
+                got_output = got_output or bool(stdout or stderr)
             except WinRMOperationTimeoutError:
                 # this is an expected error when waiting for a long-running process, just silently retry
                 pass
-        return b"".join(stdout_buffer), b"".join(stderr_buffer), return_code
 
-    def get_command_output_raw(self, shell_id: str, command_id: str) -> tuple[bytes, bytes, int, bool]:
+            self.receive_stats.record(empty=not got_output and not command_done)
+            if self.min_receive_timeout_sec is not None:
+                receive_timeout = self.min_receive_timeout_sec if got_output else min(receive_timeout * 2, self.operation_timeout_sec)
+
+            if stdout:
+                yield "stdout", stdout
+            if stderr:
+                yield "stderr", stderr
+
+        yield "exit_code", return_code
+
+    def _stop_command(self, shell_id: str, command_id: str, error: WinRMCommandTimeoutError) -> t.NoReturn:
+        try:
+            self.terminate_command(shell_id, command_id)
+        except Exception as err:
+            # the command may still be running, cleanup_command tries again
+            raise error from err
+        raise error
+
+    def get_command_output_raw(self, shell_id: str, command_id: str, operation_timeout_sec: int | None = None) -> tuple[bytes, bytes, int, bool]:
         """
         Get the next available output of the given shell and command. This
         will wait until the issued WSMan Receive action returns data or times
@@ -500,6 +1152,9 @@ class Protocol(object):
          See #open_shell
         @param string command_id: The command id on the remote machine.
          See #run_command
+        @param int operation_timeout_sec: How long the server waits for output
+         in this Receive, defaults to operation_timeout_sec. It must be less
+         than read_timeout_sec.
         @return tuple[bytes, bytes, int, bool]: Returns a tuple with the stdout,
             stderr, the return code of the command, and whether it has finished
             or not. The stdout and stderr value is a byte string and not a
@@ -507,46 +1162,50 @@ class Protocol(object):
         @raises WinRMOperationTimeoutError: Raised when there has been no
             output from the command
         """
-        req = {
-            "env:Envelope": self.build_wsman_header(
-                resource_uri="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/cmd",  # NOQA
-                action="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/Receive",  # NOQA
-                shell_id=shell_id,
-            )
-        }
-
-        stream = req["env:Envelope"].setdefault("env:Body", {}).setdefault("rsp:Receive", {}).setdefault("rsp:DesiredStream", {})
-        stream["@CommandId"] = command_id
-        stream["#text"] = "stdout stderr"
+        if operation_timeout_sec is not None:
+            self._check_operation_timeout(operation_timeout_sec)
+        res = self.send_message(self._build_receive(shell_id, command_id, operation_timeout_sec))
+        return self._parse_receive(res)
 
-        res = self.send_message(xmltodict.unparse(req))
-        root = ET.fromstring(res)
-        stream_nodes = [node for node in root.findall(".//*") if node.tag.endswith("Stream")]
-        stdout = []
-        stderr = []
-        return_code = -1
-        for stream_node in stream_nodes:
-            if not stream_node.text:
-                continue
-            if stream_node.attrib["Name"] == "stdout":
-                stdout.append(base64.b64decode(stream_node.text.encode("ascii")))
-            elif stream_node.attrib["Name"] == "stderr":
-                stderr.append(base64.b64decode(stream_node.text.encode("ascii")))
+    def _receive_stream(
+        self, shell_id: str, command_id: str, operation_timeout_sec: int | None = None
+    ) -> collections.abc.Generator[tuple[str, bytes], None, tuple[int, bool, bool]]:
+        """Sends a Receive and yields the decoded stdout and stderr chunks as
+        their Stream elements are read from the response. Returns the return
+        code and whether the command is done, like _parse_receive, and
+        whether there was any output.
+        """
+        parser = xml_backend.pull_parser()
+        done_states = 0
+        exit_code: str | None = None
+        got_output = False
 
-        # We may need to get additional output if the stream has not finished.
-        # The CommandState will change from Running to Done like so:
-        # @example
-        #   from...
-        #   <rsp:CommandState CommandId="..." State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Running"/>
-        #   to...
-        #   <rsp:CommandState CommandId="..." State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/Done">
-        #     <rsp:ExitCode>0</rsp:ExitCode>
-        #   </rsp:CommandState>
-        command_done = len([node for node in root.findall(".//*") if node.get("State", "").endswith("CommandState/Done")]) == 1
-        if command_done:
-            return_code = int(next(node for node in root.findall(".//*") if node.tag.endswith("ExitCode")).text or -1)
+        try:
+            for data in self.transport.send_message_stream(self._build_receive(shell_id, command_id, operation_timeout_sec)):
+                parser.feed(data)
+                for _, node in parser.read_events():
+                    tag = node.tag
+                    if tag.endswith("Stream"):
+                        if node.text:
+                            name = node.attrib["Name"]
+                            if name == "stdout" or name == "stderr":
+                                got_output = True
+                                yield name, binascii.a2b_base64(node.text)
+                        # the chunk has been handed out, only keep the empty
+                        # element in the tree
+                        node.clear()
+                    elif tag.endswith("ExitCode"):
+                        if exit_code is None:
+                            exit_code = node.text or ""
+                    if node.get("State", "").endswith("CommandState/Done"):
+                        done_states += 1
+        except WinRMTransportError as ex:
+            raise self._parse_fault(ex)
+        parser.close()
 
-        return b"".join(stdout), b"".join(stderr), return_code, command_done
+        command_done = done_states == 1
+        return_code = int(exit_code or -1) if command_done else -1
+        return return_code, command_done, got_output
 
     # While it was meant to be private it has been treated as a public API.
     # This might be removed in a future version but for now keep it as an
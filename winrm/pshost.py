@@ -0,0 +1,231 @@
+"""Runs PowerShell scripts in a long lived powershell.exe on the remote host.
+
+Starting powershell.exe and loading its modules takes 0.5 to 2 seconds, a
+PowerShellHost pays that once. It starts a loop that reads one script per
+line from its stdin and runs it in the global scope, so variables, functions
+and imported modules are kept between scripts. After each script the loop
+writes a sentinel with a random token to stdout and stderr which marks the
+end of the output of that script.
+"""
+
+from __future__ import annotations
+
+import base64
+import re
+import threading
+import time
+import typing as t
+import uuid
+
+from winrm.exceptions import WinRMError, WinRMOperationTimeoutError
+from winrm.powershell import build_command
+from winrm.protocol import Protocol
+from winrm.shellpool import PooledShell, ShellPool
+
+__all__ = ["PowerShellHost"]
+
+# runs the scripts sent by PowerShellHost._send, a line of the script id and
+# the base64 encoded UTF-8 script each
+BOOTSTRAP_SCRIPT = """
+$ProgressPreference = 'SilentlyContinue'
+while ($null -ne ($__line = [Console]::In.ReadLine())) {
+    $__id, $__encoded = $__line -split ' ', 2
+    $__failed = $false
+    $global:LASTEXITCODE = 0
+    try {
+        . ([ScriptBlock]::Create([Text.Encoding]::UTF8.GetString([Convert]::FromBase64String($__encoded)))) 2>&1 | ForEach-Object {
+            if ($_ -is [Management.Automation.ErrorRecord]) {
+                $__failed = $true
+                [Console]::Error.Write(($_ | Out-String))
+            }
+            else {
+                $_
+            }
+        } | Out-String -Stream | ForEach-Object { [Console]::Out.WriteLine($_) }
+    }
+    catch {
+        $__failed = $true
+        [Console]::Error.Write(($_ | Out-String))
+    }
+    $__code = if ($LASTEXITCODE) { $LASTEXITCODE } elseif ($__failed) { 1 } else { 0 }
+    [Console]::Out.WriteLine("$token $__id $__code")
+    [Console]::Error.WriteLine("$token $__id")
+}
+"""
+
+
+class PowerShellHost(object):
+    """A powershell.exe kept running in its own shell to run scripts in.
+
+    The host is started by the first run and restarted by the next run when
+    the process exited, e.g. because a script called exit. A script that
+    does not finish within script_timeout_sec is considered wedged, the
+    process and its shell are closed. Scripts run one at a time, run blocks
+    while another thread is running a script on the same host.
+
+    @param Protocol protocol: The protocol used to reach the host.
+    @param ShellPool shell_pool: Take the shell from this pool and give it
+        back when the host is closed, otherwise a shell is opened for the
+        host. The shell counts against max_size of the pool for as long as
+        the host is running.
+    @param string startup_script: A script run whenever the process starts,
+        e.g. to import modules.
+    @param int startup_timeout_sec: The number of seconds powershell.exe and
+        startup_script have to start.
+    @param int script_timeout_sec: The number of seconds a script can run
+        before the host is recycled, None waits forever. It is checked
+        between Receive calls, so at least every operation_timeout_sec.
+    @param shell_options: Keyword arguments for Protocol.open_shell
+    """
+
+    DEFAULT_STARTUP_TIMEOUT_SEC = 60
+
+    def __init__(
+        self,
+        protocol: Protocol,
+        shell_pool: ShellPool | None = None,
+        startup_script: str | None = None,
+        startup_timeout_sec: int | float = DEFAULT_STARTUP_TIMEOUT_SEC,
+        script_timeout_sec: int | float | None = None,
+        **shell_options: t.Any,
+    ) -> None:
+        self.protocol = protocol
+        self.shell_pool = shell_pool
+        self.startup_script = startup_script
+        self.startup_timeout_sec = startup_timeout_sec
+        self.script_timeout_sec = script_timeout_sec
+        self.shell_options = shell_options
+        self.starts = 0
+        self.scripts_run = 0
+
+        self._lock = threading.Lock()
+        self._shell: PooledShell | None = None
+        self._shell_id: str | None = None
+        self._command_id: str | None = None
+        self._token = b""
+        self._next_id = 0
+
+    @property
+    def alive(self) -> bool:
+        """Whether the process is running, as far as the client knows"""
+        return self._command_id is not None
+
+    def run(self, script: str) -> tuple[bytes, bytes, int]:
+        """
+        Runs a script in the host, starting it if needed.
+        @param string script: The script to run.
+        @returns The stdout, stderr and exit code of the script. The exit code
+            is $LASTEXITCODE if it is set, 1 if the script wrote an error and
+            0 otherwise, or the exit code of powershell.exe if the script
+            exited it.
+        @rtype tuple[bytes, bytes, int]
+        @raises WinRMError: The host did not start or the script did not
+            finish within script_timeout_sec and the host was recycled.
+        """
+        with self._lock:
+            if not self.alive:
+                self._start()
+            deadline = time.monotonic() + self.script_timeout_sec if self.script_timeout_sec is not None else None
+            self.scripts_run += 1
+            return self._run(script, deadline)
+
+    def close(self) -> None:
+        """Stops the process, the shell goes back to the pool if it came from one"""
+        with self._lock:
+            self._stop(healthy=True)
+
+    def _start(self) -> None:
+        self.starts += 1
+        self._token = ("__winrm_pshost_%s" % uuid.uuid4().hex).encode()
+        command = build_command(BOOTSTRAP_SCRIPT, token=self._token.decode())
+        if self.shell_pool:
+            self._shell = self.shell_pool.acquire(**self.shell_options)
+            self._shell_id = self._shell.shell_id
+        else:
+            self._shell_id = self.protocol.open_shell(**self.shell_options)
+
+        try:
+            self._command_id = self.protocol.run_command(self._shell_id, command, console_mode_stdin=False, skip_cmd_shell=True)
+            # an empty script confirms the loop is running
+            deadline = time.monotonic() + self.startup_timeout_sec
+            self._run("", deadline)
+            if self.startup_script:
+                stdout, stderr, return_code = self._run(self.startup_script, deadline)
+                if return_code != 0:
+                    raise WinRMError("the startup script failed with exit code %d: %s" % (return_code, stderr.decode("utf-8", errors="replace")))
+            if not self.alive:
+                raise WinRMError("powershell.exe exited while starting")
+        except BaseException:
+            self._stop(healthy=False)
+            raise
+
+    def _stop(self, healthy: bool) -> None:
+        shell, shell_id, command_id = self._shell, self._shell_id, self._command_id
+        self._shell = self._shell_id = self._command_id = None
+        if shell_id is None:
+            return
+
+        try:
+            if command_id is not None:
+                self.protocol.cleanup_command(shell_id, command_id)
+        except Exception:
+            # the shell is closed below, which also ends the process
+            healthy = False
+
+        if shell is not None and self.shell_pool:
+            if healthy:
+                self.shell_pool.release(shell)
+            else:
+                self.shell_pool.discard(shell)
+        else:
+            try:
+                self.protocol.close_shell(shell_id, close_session=False)
+            except Exception:
+                pass
+
+    def _run(self, script: str, deadline: float | None) -> tuple[bytes, bytes, int]:
+        assert self._shell_id is not None and self._command_id is not None
+        script_id = self._next_id
+        self._next_id += 1
+        try:
+            line = b"%d %s\n" % (script_id, base64.b64encode(script.encode("utf-8")))
+            self.protocol.send_command_input(self._shell_id, self._command_id, line)
+            return self._collect(script_id, deadline)
+        except BaseException:
+            if self.alive:
+                self._stop(healthy=False)
+            raise
+
+    def _collect(self, script_id: int, deadline: float | None) -> tuple[bytes, bytes, int]:
+        assert self._shell_id is not None and self._command_id is not None
+        stdout_end = re.compile(re.escape(self._token) + rb" %d (-?\d+)\r?\n" % script_id)
+        stderr_end = re.compile(re.escape(self._token) + rb" %d\r?\n" % script_id)
+        stdout = bytearray()
+        stderr = bytearray()
+        stdout_match: re.Match[bytes] | None = None
+        stderr_match: re.Match[bytes] | None = None
+
+        while stdout_match is None or stderr_match is None:
+            if deadline is not None and time.monotonic() > deadline:
+                raise WinRMError("the PowerShell host did not finish script %d in time, it has been recycled" % script_id)
+            try:
+                out, err, return_code, done = self.protocol.get_command_output_raw(self._shell_id, self._command_id)
+            except WinRMOperationTimeoutError:
+                continue
+
+            # the sentinel can be split between two Receives
+            if stdout_match is None and out:
+                start = max(0, len(stdout) - len(self._token) - 32)
+                stdout += out
+                stdout_match = stdout_end.search(stdout, start)
+            if stderr_match is None and err:
+                start = max(0, len(stderr) - len(self._token) - 32)
+                stderr += err
+                stderr_match = stderr_end.search(stderr, start)
+
+            if done:
+                # the script exited powershell.exe
+                self._stop(healthy=True)
+                return bytes(stdout), bytes(stderr), return_code
+
+        return bytes(stdout[: stdout_match.start()]), bytes(stderr[: stderr_match.start()]), int(stdout_match.group(1))
@@ -0,0 +1,538 @@
+"""A PowerShell Remoting Protocol (MS-PSRP) client on top of Protocol.
+
+A RunspacePool is a WSMan shell of the Microsoft.PowerShell resource. The
+server keeps its runspaces open, so a pipeline only costs a Command, the
+Receives for its output and a Signal instead of starting powershell.exe.
+PSRP messages are split into fragments that are sent base64 encoded in the
+WSMan messages, the output is deserialized from CLIXML, see winrm.clixml.
+"""
+
+from __future__ import annotations
+
+import base64
+import collections.abc
+import struct
+import threading
+import time
+import typing as t
+import uuid
+
+import xmltodict
+
+from winrm import clixml
+from winrm.clixml import PSObject
+from winrm.encryption import Encryption
+from winrm.envelope import EnvelopeTemplate
+from winrm.exceptions import WinRMError, WinRMOperationTimeoutError
+from winrm.protocol import Protocol
+
+__all__ = ["RunspacePool", "Pipeline", "PSResult", "Message", "Defragmenter", "fragment"]
+
+RESOURCE_URI = "http://schemas.microsoft.com/powershell/{0}"
+PROTOCOL_VERSION = "2.3"
+SHELL_NS = "http://schemas.microsoft.com/wbem/wsman/1/windows/shell"
+
+SIGNAL_TERMINATE = SHELL_NS + "/signal/terminate"
+SIGNAL_CTRL_C = "http://schemas.microsoft.com/powershell/signal/crtl_c"
+
+# the destination of a message
+CLIENT = 0x00000001
+SERVER = 0x00000002
+
+# message types, MS-PSRP 2.2.1
+SESSION_CAPABILITY = 0x00010002
+INIT_RUNSPACEPOOL = 0x00010004
+APPLICATION_PRIVATE_DATA = 0x00021009
+RUNSPACEPOOL_STATE = 0x00021005
+CREATE_PIPELINE = 0x00021006
+PIPELINE_INPUT = 0x00041002
+END_OF_PIPELINE_INPUT = 0x00041003
+PIPELINE_OUTPUT = 0x00041004
+ERROR_RECORD = 0x00041005
+PIPELINE_STATE = 0x00041006
+DEBUG_RECORD = 0x00041007
+VERBOSE_RECORD = 0x00041008
+WARNING_RECORD = 0x00041009
+PROGRESS_RECORD = 0x00041010
+INFORMATION_RECORD = 0x00041011
+PIPELINE_HOST_CALL = 0x00041100
+
+# RunspacePoolState values
+RUNSPACEPOOL_OPENED = 2
+RUNSPACEPOOL_CLOSED = 3
+RUNSPACEPOOL_BROKEN = 5
+
+# PSInvocationState values
+PIPELINE_RUNNING = 1
+PIPELINE_STOPPED = 3
+PIPELINE_COMPLETED = 4
+PIPELINE_FAILED = 5
+PIPELINE_DONE_STATES = (PIPELINE_STOPPED, PIPELINE_COMPLETED, PIPELINE_FAILED)
+
+_BOM = b"\xef\xbb\xbf"
+_FRAGMENT_HEADER = struct.Struct(">QQBI")
+_MESSAGE_HEADER = struct.Struct("<II")
+_START = 0x1
+_END = 0x2
+_NIL_UUID = uuid.UUID(int=0)
+
+_ENUM = ["System.Enum", "System.ValueType", "System.Object"]
+_APARTMENT_STATE = PSObject(["System.Threading.ApartmentState"] + _ENUM, to_string="Unknown", value=2)
+_THREAD_OPTIONS = PSObject(["System.Management.Automation.Runspaces.PSThreadOptions"] + _ENUM, to_string="Default", value=0)
+_STREAM_OPTIONS = PSObject(["System.Management.Automation.RemoteStreamOptions"] + _ENUM, to_string="None", value=0)
+_NO_MERGE = PSObject(["System.Management.Automation.Runspaces.PipelineResultTypes"] + _ENUM, to_string="None", value=0)
+_NO_HOST = PSObject(properties={"_isHostNull": True, "_isHostUINull": True, "_isHostRawUINull": True, "_useRunspaceHost": True})
+
+
+class Message(t.NamedTuple):
+    """A PSRP message, data is the UTF-8 CLIXML without the byte order mark"""
+
+    destination: int
+    message_type: int
+    rpid: uuid.UUID
+    pid: uuid.UUID | None
+    data: bytes
+
+    def pack(self) -> bytes:
+        header = _MESSAGE_HEADER.pack(self.destination, self.message_type)
+        return header + self.rpid.bytes_le + (self.pid or _NIL_UUID).bytes_le + _BOM + self.data
+
+    @classmethod
+    def unpack(cls, blob: bytes) -> Message:
+        if len(blob) < 40:
+            raise WinRMError("PSRP message of %d bytes is too short" % len(blob))
+        destination, message_type = _MESSAGE_HEADER.unpack_from(blob)
+        pid = uuid.UUID(bytes_le=blob[24:40])
+        data = blob[40:]
+        if data.startswith(_BOM):
+            data = data[3:]
+        return cls(destination, message_type, uuid.UUID(bytes_le=blob[8:24]), pid if pid != _NIL_UUID else None, data)
+
+
+def fragment(message: bytes, object_id: int, max_size: int) -> list[bytes]:
+    """
+    Splits a packed message into fragments of at most max_size bytes.
+    @param bytes message: The message from Message.pack.
+    @param int object_id: The id of the message, unique within the pool.
+    @param int max_size: The maximum size of a fragment with its header.
+    @returns The fragments, each with its header.
+    @rtype list[bytes]
+    """
+    blob_size = max_size - _FRAGMENT_HEADER.size
+    if blob_size < 1:
+        raise WinRMError("a fragment of %d bytes has no room for data" % max_size)
+    fragments = []
+    count = max(1, -(-len(message) // blob_size))
+    for i in range(count):
+        blob = message[i * blob_size : (i + 1) * blob_size]
+        flags = (_START if i == 0 else 0) | (_END if i == count - 1 else 0)
+        fragments.append(_FRAGMENT_HEADER.pack(object_id, i, flags, len(blob)) + blob)
+    return fragments
+
+
+class Defragmenter(object):
+    """Joins the fragments received into messages, the fragments of several
+    messages can be interleaved and a fragment can be split between two
+    reads.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._partial: dict[int, bytearray] = {}
+
+    def feed(self, data: bytes) -> list[Message]:
+        """
+        Adds received data and returns the messages it completes.
+        @param bytes data: The decoded stdout of a Receive.
+        @rtype list[Message]
+        """
+        self._buffer += data
+        messages = []
+        pos = 0
+        while len(self._buffer) - pos >= _FRAGMENT_HEADER.size:
+            object_id, fragment_id, flags, length = _FRAGMENT_HEADER.unpack_from(self._buffer, pos)
+            end = pos + _FRAGMENT_HEADER.size + length
+            if end > len(self._buffer):
+                break
+            blob = self._buffer[pos + _FRAGMENT_HEADER.size : end]
+            pos = end
+
+            if flags & _START:
+                self._partial[object_id] = bytearray()
+            elif object_id not in self._partial:
+                raise WinRMError("PSRP fragment %d of object %d has no start fragment" % (fragment_id, object_id))
+            self._partial[object_id] += blob
+            if flags & _END:
+                messages.append(Message.unpack(bytes(self._partial.pop(object_id))))
+        del self._buffer[:pos]
+        return messages
+
+
+class PSResult(t.NamedTuple):
+    """The output of a pipeline, the records are deserialized PSObjects"""
+
+    output: list[t.Any]
+    errors: list[t.Any]
+    warnings: list[str]
+    verbose: list[str]
+    debug: list[str]
+    information: list[t.Any]
+    state: int
+
+    @property
+    def had_errors(self) -> bool:
+        return self.state == PIPELINE_FAILED or bool(self.errors)
+
+
+class RunspacePool(object):
+    """
+    A pool of PowerShell runspaces on the remote host. Pipelines started with
+    begin run concurrently, up to max_runspaces at a time on the server. run
+    can be called from several threads, at most max_runspaces of them wait
+    for a pipeline at a time.
+
+    @param Protocol protocol: The protocol used to reach the host.
+    @param int min_runspaces: The number of runspaces the server keeps open.
+    @param int max_runspaces: The number of pipelines that run at once.
+    @param string configuration_name: The session configuration to connect
+        to (default Microsoft.PowerShell).
+    @param int open_timeout_sec: The number of seconds the server has to
+        open the pool.
+    """
+
+    DEFAULT_OPEN_TIMEOUT_SEC = 60
+
+    def __init__(
+        self,
+        protocol: Protocol,
+        min_runspaces: int = 1,
+        max_runspaces: int = 1,
+        configuration_name: str = "Microsoft.PowerShell",
+        open_timeout_sec: int | float = DEFAULT_OPEN_TIMEOUT_SEC,
+    ) -> None:
+        if not 1 <= min_runspaces <= max_runspaces:
+            raise WinRMError("min_runspaces must be at least 1 and at most max_runspaces")
+        self.protocol = protocol
+        self.min_runspaces = min_runspaces
+        self.max_runspaces = max_runspaces
+        self.resource_uri = RESOURCE_URI.format(configuration_name)
+        self.open_timeout_sec = open_timeout_sec
+        self.id = uuid.uuid4()
+        self.shell_id: str | None = None
+        self.state = 0
+        self.application_private_data: t.Any = None
+
+        self._object_id = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_runspaces)
+
+    def __enter__(self) -> RunspacePool:
+        self.open()
+        return self
+
+    def __exit__(self, *args: t.Any) -> None:
+        self.close()
+
+    def open(self) -> None:
+        """Creates the pool on the server and waits until it is opened"""
+        if self.shell_id is not None:
+            return
+        serializer = clixml.Serializer()
+        capability = (
+            '<Obj RefId="0"><MS><Version N="protocolversion">{0}</Version><Version N="PSVersion">2.0</Version>'
+            '<Version N="SerializationVersion">1.1.0.1</Version></MS></Obj>'
+        ).format(PROTOCOL_VERSION)
+        init = serializer.dumps(
+            PSObject(
+                properties={
+                    "MinRunspaces": self.min_runspaces,
+                    "MaxRunspaces": self.max_runspaces,
+                    "PSThreadOptions": _THREAD_OPTIONS,
+                    "ApartmentState": _APARTMENT_STATE,
+                    "HostInfo": _NO_HOST,
+                    "ApplicationArguments": None,
+                }
+            )
+        )
+        # both messages are a few hundred bytes, far from filling the Create
+        max_size = self.protocol.max_env_sz // 2
+        fragments = self._fragments(SESSION_CAPABILITY, None, capability.encode(), max_size)
+        fragments += self._fragments(INIT_RUNSPACEPOOL, None, init.encode(), max_size)
+        res = self.protocol.send_message(self._build_create(base64.b64encode(b"".join(fragments)).decode()))
+        self.shell_id = self.protocol._parse_open_shell(res)
+
+        deadline = time.monotonic() + self.open_timeout_sec
+        defragmenter = Defragmenter()
+        try:
+            while self.state != RUNSPACEPOOL_OPENED:
+                if time.monotonic() > deadline:
+                    raise WinRMError("the runspace pool did not open within %s seconds" % self.open_timeout_sec)
+                for message in defragmenter.feed(self._receive(None)[0]):
+                    if message.message_type == APPLICATION_PRIVATE_DATA:
+                        self.application_private_data = clixml.loads(message.data)
+                    elif message.message_type == RUNSPACEPOOL_STATE:
+                        state = clixml.loads(message.data)
+                        self.state = state.RunspaceState
+                        if self.state in (RUNSPACEPOOL_BROKEN, RUNSPACEPOOL_CLOSED):
+                            raise WinRMError("the runspace pool could not be opened: %s" % state.properties.get("ExceptionAsErrorRecord", self.state))
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        """Closes the pool and the runspaces on the server"""
+        shell_id, self.shell_id = self.shell_id, None
+        if shell_id is None:
+            return
+        self.state = RUNSPACEPOOL_CLOSED
+        header = self.protocol.build_wsman_header(
+            action="http://schemas.xmlsoap.org/ws/2004/09/transfer/Delete", resource_uri=self.resource_uri, shell_id=shell_id
+        )
+        header.setdefault("env:Body", {})
+        try:
+            self.protocol.send_message(xmltodict.unparse({"env:Envelope": header}))
+        finally:
+            self.protocol._forget_shell(shell_id)
+
+    def begin(self, script: str, input: collections.abc.Iterable[t.Any] | None = None) -> Pipeline:
+        """
+        Starts a script on the pool without waiting for it, see Pipeline.wait.
+        @param string script: The PowerShell script to run.
+        @param iterable input: Objects piped into the script, $input.
+        @rtype Pipeline
+        """
+        self.open()
+        pipeline = Pipeline(self, script, input)
+        pipeline.start()
+        return pipeline
+
+    def run(self, script: str, input: collections.abc.Iterable[t.Any] | None = None) -> PSResult:
+        """
+        Runs a script on the pool and waits for it to finish.
+        @param string script: The PowerShell script to run.
+        @param iterable input: Objects piped into the script, $input.
+        @returns The output and the records written by the script.
+        @rtype PSResult
+        """
+        with self._slots:
+            return self.begin(script, input).wait()
+
+    def _next_object_id(self) -> int:
+        with self._lock:
+            self._object_id += 1
+            return self._object_id
+
+    def _fragments(self, message_type: int, pid: uuid.UUID | None, data: bytes, max_size: int | None = None) -> list[bytes]:
+        message = Message(SERVER, message_type, self.id, pid, data).pack()
+        return fragment(message, self._next_object_id(), max_size or self._fragment_size())
+
+    def _fragment_size(self) -> int:
+        # a fragment goes either in the Arguments of a Command or in a Send
+        envelope = max(len(self._build_command(_NIL_UUID, "").encode("utf-8")), len(self._build_send(str(_NIL_UUID), "").encode("utf-8")))
+        room = self.protocol.max_env_sz - envelope
+        if self.protocol.transport.encryption is not None:
+            room -= Encryption.max_overhead(self.protocol.max_env_sz)
+        return room // 4 * 3
+
+    def _receive(self, pid: uuid.UUID | None) -> tuple[bytes, bool]:
+        assert self.shell_id is not None
+        try:
+            res = self.protocol.send_message(self._build_receive(pid))
+        except WinRMOperationTimeoutError:
+            return b"", False
+        stdout, _, _, done = self.protocol._parse_receive(res)
+        return stdout, done
+
+    def _header(self, action: str, shell_id: str, message_id: str) -> dict[str, t.Any]:
+        return self.protocol.build_wsman_header(action=SHELL_NS + "/" + action, resource_uri=self.resource_uri, shell_id=shell_id, message_id=message_id)
+
+    def _build_create(self, creation_xml: str) -> str:
+        header = self.protocol.build_wsman_header(action="http://schemas.xmlsoap.org/ws/2004/09/transfer/Create", resource_uri=self.resource_uri)
+        header["env:Header"]["w:OptionSet"] = {
+            "@env:mustUnderstand": "true",
+            "w:Option": {"@Name": "protocolversion", "@MustComply": "true", "#text": PROTOCOL_VERSION},
+        }
+        header["env:Body"] = {
+            "rsp:Shell": {
+                "@ShellId": str(self.id).upper(),
+                "rsp:InputStreams": "stdin pr",
+                "rsp:OutputStreams": "stdout",
+                "creationXml": {"@xmlns": "http://schemas.microsoft.com/powershell", "#text": creation_xml},
+            }
+        }
+        return xmltodict.unparse({"env:Envelope": header})
+
+    def _build_receive(self, pid: uuid.UUID | None) -> str:
+        assert self.shell_id is not None
+        field = EnvelopeTemplate.field
+
+        def build() -> dict[str, t.Any]:
+            header = self._header("Receive", field("shell_id"), field("message_id"))
+            header["env:Header"]["w:OptionSet"] = {"w:Option": {"@Name": "WSMAN_CMDSHELL_OPTION_KEEPALIVE", "#text": "TRUE"}}
+            stream: dict[str, t.Any] = {"#text": "stdout"}
+            if pid is not None:
+                stream["@CommandId"] = field("command_id")
+            header["env:Body"] = {"rsp:Receive": {"rsp:DesiredStream": stream}}
+            return {"env:Envelope": header}
+
+        template = self.protocol._shell_template(("psrp_receive", self.resource_uri, pid is not None), self.shell_id, build)
+        return template.render(message_id=str(uuid.uuid4()), command_id=str(pid).upper())
+
+    def _build_command(self, pid: uuid.UUID, arguments: str) -> str:
+        assert self.shell_id is not None
+        field = EnvelopeTemplate.field
+
+        def build() -> dict[str, t.Any]:
+            header = self._header("Command", field("shell_id"), field("message_id"))
+            header["env:Body"] = {"rsp:CommandLine": {"@CommandId": field("command_id"), "rsp:Command": "", "rsp:Arguments": field("arguments")}}
+            return {"env:Envelope": header}
+
+        template = self.protocol._shell_template(("psrp_command", self.resource_uri), self.shell_id, build)
+        return template.render(message_id=str(uuid.uuid4()), command_id=str(pid).upper(), arguments=arguments)
+
+    def _build_send(self, command_id: str, data: str) -> str:
+        assert self.shell_id is not None
+        field = EnvelopeTemplate.field
+
+        def build() -> dict[str, t.Any]:
+            header = self._header("Send", field("shell_id"), field("message_id"))
+            header["env:Body"] = {"rsp:Send": {"rsp:Stream": {"@Name": "stdin", "@CommandId": field("command_id"), "#text": field("data")}}}
+            return {"env:Envelope": header}
+
+        template = self.protocol._shell_template(("psrp_send", self.resource_uri), self.shell_id, build)
+        return template.render(message_id=str(uuid.uuid4()), command_id=command_id.upper(), data=data)
+
+    def _build_signal(self, pid: uuid.UUID, code: str) -> str:
+        assert self.shell_id is not None
+        field = EnvelopeTemplate.field
+
+        def build() -> dict[str, t.Any]:
+            header = self._header("Signal", field("shell_id"), field("message_id"))
+            header["env:Body"] = {"rsp:Signal": {"@CommandId": field("command_id"), "rsp:Code": field("code")}}
+            return {"env:Envelope": header}
+
+        template = self.protocol._shell_template(("psrp_signal", self.resource_uri), self.shell_id, build)
+        return template.render(message_id=str(uuid.uuid4()), command_id=str(pid).upper(), code=code)
+
+
+class Pipeline(object):
+    """A script running in a RunspacePool, created by RunspacePool.begin"""
+
+    def __init__(self, pool: RunspacePool, script: str, input: collections.abc.Iterable[t.Any] | None = None) -> None:
+        self.pool = pool
+        self.script = script
+        self.input = input
+        self.id = uuid.uuid4()
+        self.state = 0
+        self._result: PSResult | None = None
+
+    def start(self) -> None:
+        """Sends the pipeline and its input to the server"""
+        pool = self.pool
+        serializer = clixml.Serializer()
+        command = PSObject(
+            properties={
+                "Cmd": self.script,
+                "IsScript": True,
+                "UseLocalScope": None,
+                "MergeMyResult": _NO_MERGE,
+                "MergeToResult": _NO_MERGE,
+                "MergePreviousResults": _NO_MERGE,
+                "MergeError": _NO_MERGE,
+                "MergeWarning": _NO_MERGE,
+                "MergeVerbose": _NO_MERGE,
+                "MergeDebug": _NO_MERGE,
+                "MergeInformation": _NO_MERGE,
+                "Args": [],
+            }
+        )
+        create = serializer.dumps(
+            PSObject(
+                properties={
+                    "NoInput": self.input is None,
+                    "ApartmentState": _APARTMENT_STATE,
+                    "RemoteStreamOptions": _STREAM_OPTIONS,
+                    "AddToHistory": False,
+                    "HostInfo": _NO_HOST,
+                    "PowerShell": PSObject(
+                        properties={
+                            "IsNested": False,
+                            "ExtraCmds": None,
+                            "Cmds": [command],
+                            "History": None,
+                            "RedirectShellErrorOutputPipe": False,
+                        }
+                    ),
+                    "IsNested": False,
+                }
+            )
+        )
+
+        # the first fragment goes with the Command, the others are sent
+        fragments = pool._fragments(CREATE_PIPELINE, self.id, create.encode())
+        pool.protocol.send_message(pool._build_command(self.id, base64.b64encode(fragments[0]).decode()))
+        self.state = PIPELINE_RUNNING
+        self._send(fragments[1:])
+
+        if self.input is not None:
+            for value in self.input:
+                self._send(pool._fragments(PIPELINE_INPUT, self.id, clixml.dumps(value).encode()))
+            self._send(pool._fragments(END_OF_PIPELINE_INPUT, self.id, b""))
+
+    def stop(self) -> None:
+        """Asks the server to stop the pipeline, wait returns once it stopped"""
+        self.pool.protocol.send_message(self.pool._build_signal(self.id, SIGNAL_CTRL_C))
+
+    def wait(self) -> PSResult:
+        """
+        Receives the output until the pipeline has finished.
+        @returns The output and the records written by the script.
+        @rtype PSResult
+        """
+        if self._result is not None:
+            return self._result
+
+        output: list[t.Any] = []
+        errors: list[t.Any] = []
+        streams: dict[int, list[t.Any]] = {WARNING_RECORD: [], VERBOSE_RECORD: [], DEBUG_RECORD: [], INFORMATION_RECORD: []}
+        defragmenter = Defragmenter()
+        done = False
+        while self.state not in PIPELINE_DONE_STATES:
+            if done:
+                raise WinRMError("the pipeline ended without a final state")
+            stdout, done = self.pool._receive(self.id)
+            for message in defragmenter.feed(stdout):
+                kind = message.message_type
+                if kind == PIPELINE_OUTPUT:
+                    output.append(clixml.loads(message.data))
+                elif kind == ERROR_RECORD:
+                    errors.append(clixml.loads(message.data))
+                elif kind in (WARNING_RECORD, VERBOSE_RECORD, DEBUG_RECORD):
+                    record = clixml.loads(message.data)
+                    streams[kind].append(record.properties.get("InformationalRecord_Message", str(record)))
+                elif kind == INFORMATION_RECORD:
+                    streams[kind].append(clixml.loads(message.data))
+                elif kind == PIPELINE_STATE:
+                    state = clixml.loads(message.data)
+                    self.state = state.PipelineState
+                    reason = state.properties.get("ExceptionAsErrorRecord")
+                    if reason is not None:
+                        errors.append(reason)
+                elif kind == PIPELINE_HOST_CALL:
+                    # the pool was opened without a host, the server only
+                    # sends host calls for a script that insists on one
+                    raise WinRMError("the pipeline called the PowerShell host which is not supported")
+
+        try:
+            self.pool.protocol.send_message(self.pool._build_signal(self.id, SIGNAL_TERMINATE))
+        except WinRMError:
+            # the server may have removed the command already
+            pass
+        self._result = PSResult(
+            output, errors, streams[WARNING_RECORD], streams[VERBOSE_RECORD], streams[DEBUG_RECORD], streams[INFORMATION_RECORD], self.state
+        )
+        return self._result
+
+    def _send(self, fragments: list[bytes]) -> None:
+        for data in fragments:
+            self.pool.protocol.send_message(self.pool._build_send(str(self.id), base64.b64encode(data).decode()))
@@ -0,0 +1,390 @@
+"""Keeps WinRS shells open so that consecutive commands can reuse them"""
+
+from __future__ import annotations
+
+import collections.abc
+import contextlib
+import threading
+import time
+import typing as t
+
+from winrm.exceptions import WinRMError, WSManFaultError
+from winrm.protocol import Protocol
+from winrm.transport import password_digest
+
+# ERROR_WINRS_SHELL_NOT_FOUND, returned when the server has already removed
+# the shell, e.g. because it reached its IdleTimeOut.
+WSMAN_SHELL_NOT_FOUND = 2150858843
+
+ShellKey = t.Tuple[t.Tuple[str, t.Any], ...]
+
+
+class PooledShell(object):
+    """A shell owned by a ShellPool"""
+
+    def __init__(self, shell_id: str, key: ShellKey) -> None:
+        self.shell_id = shell_id
+        self.key = key
+        self.created = self.last_used = time.monotonic()
+        self.uses = 0
+
+    def __repr__(self) -> str:
+        return "<PooledShell {0} uses={1}>".format(self.shell_id, self.uses)
+
+
+class ShellPool(object):
+    """A pool of open shells on a single host.
+
+    Opening a shell costs a Create round trip and a new process on the
+    server, closing it a Delete round trip. The pool hands out idle shells
+    instead so a command only costs Command, Receive and Signal. Shells are
+    keyed by the options they were created with, only a shell created with
+    the same codepage, working directory, environment and profile setting is
+    reused.
+
+    Shells idle for more than idle_timeout_sec are closed. A shell unused for
+    more than health_check_after_sec is checked with Protocol.shell_alive
+    before it is handed out again and replaced when the server has removed
+    it. If the server removes a shell behind our back anyway, the failed
+    Command is retried once on a freshly created shell. Shells that were in
+    use when an error occurred are discarded rather than returned to the
+    pool.
+
+    @param Protocol protocol: The protocol used to create and delete shells.
+    @param int max_size: The maximum number of shells open at the same time.
+        Callers block until a shell is released when the limit is reached.
+    @param int idle_timeout_sec: The number of seconds a shell can stay
+        unused before it is closed. This should stay below the server
+        IdleTimeOut (default 2 hours).
+    @param float health_check_after_sec: The number of seconds a shell can
+        stay unused before it is checked on reuse, None never checks. A
+        shell that just ran a command is reused without the extra round trip.
+    @param float acquire_timeout_sec: The number of seconds acquire waits for
+        a shell when max_size shells are in use before it raises WinRMError,
+        None waits forever.
+    """
+
+    DEFAULT_MAX_SIZE = 5
+    DEFAULT_IDLE_TIMEOUT_SEC = 60
+    DEFAULT_HEALTH_CHECK_AFTER_SEC = 15
+    DEFAULT_ACQUIRE_TIMEOUT_SEC = 300
+
+    def __init__(
+        self,
+        protocol: Protocol,
+        max_size: int = DEFAULT_MAX_SIZE,
+        idle_timeout_sec: int | float = DEFAULT_IDLE_TIMEOUT_SEC,
+        health_check_after_sec: int | float | None = DEFAULT_HEALTH_CHECK_AFTER_SEC,
+        acquire_timeout_sec: int | float | None = DEFAULT_ACQUIRE_TIMEOUT_SEC,
+    ) -> None:
+        if max_size < 1:
+            raise WinRMError("max_size must be at least 1")
+
+        self.protocol = protocol
+        self.max_size = max_size
+        self.idle_timeout_sec = idle_timeout_sec
+        self.health_check_after_sec = health_check_after_sec
+        self.acquire_timeout_sec = acquire_timeout_sec
+
+        self._lock = threading.Condition()
+        self._idle: dict[ShellKey, list[PooledShell]] = {}
+        self._size = 0
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        """The number of shells currently open, idle or in use"""
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        """The number of open shells waiting to be reused"""
+        with self._lock:
+            return sum(len(shells) for shells in self._idle.values())
+
+    @contextlib.contextmanager
+    def command(
+        self,
+        command: str,
+        arguments: collections.abc.Iterable[str | bytes] = (),
+        console_mode_stdin: bool = True,
+        skip_cmd_shell: bool = False,
+        **shell_options: t.Any,
+    ) -> collections.abc.Iterator[tuple[str, str]]:
+        """
+        Runs a command on a pooled shell created with the shell_options and
+        yields the shell and command id. The shell is returned to the pool
+        when the block exits normally and closed when it raises. The caller
+        is responsible for cleaning up the command.
+        @param string command: The command to run, see Protocol.run_command
+        @param iterable of string arguments: The command arguments
+        @param bool console_mode_stdin: See Protocol.run_command
+        @param bool skip_cmd_shell: See Protocol.run_command
+        @param shell_options: Keyword arguments for Protocol.open_shell
+        """
+        arguments = list(arguments)
+        shell = self.acquire(**shell_options)
+        try:
+            command_id = self.protocol.run_command(shell.shell_id, command, arguments, console_mode_stdin, skip_cmd_shell)
+        except WSManFaultError as err:
+            if shell.uses == 0 or not self._is_shell_gone(err):
+                self.release(shell)
+                raise
+
+            # the server removed the idle shell, retry once on a new one
+            self.discard(shell, close=False)
+            shell = self.acquire(**shell_options)
+            try:
+                command_id = self.protocol.run_command(shell.shell_id, command, arguments, console_mode_stdin, skip_cmd_shell)
+            except BaseException:
+                self.discard(shell)
+                raise
+        except BaseException:
+            self.discard(shell)
+            raise
+
+        try:
+            yield shell.shell_id, command_id
+        except BaseException:
+            self.discard(shell)
+            raise
+        else:
+            self.release(shell)
+
+    def acquire(self, **shell_options: t.Any) -> PooledShell:
+        """
+        Takes an idle shell matching shell_options from the pool or opens a
+        new one. The shell must be given back with release or discard.
+        @param shell_options: Keyword arguments for Protocol.open_shell
+        @returns The shell to run commands on.
+        @rtype PooledShell
+        @raises WinRMError: The pool is closed or no shell became free within
+            acquire_timeout_sec.
+        """
+        key = self._build_key(shell_options)
+        self.evict_idle()
+        deadline = time.monotonic() + self.acquire_timeout_sec if self.acquire_timeout_sec is not None else None
+
+        while True:
+            shell, evicted = self._take(key, deadline)
+            if evicted:
+                self._close_quietly(evicted)
+            if shell is None:
+                break
+            if self._healthy(shell):
+                return shell
+            # the server removed the shell, try the next one
+            self.discard(shell, close=False)
+
+        try:
+            shell_id = self.protocol.open_shell(**shell_options)
+        except BaseException:
+            with self._lock:
+                self._size -= 1
+                self._lock.notify()
+            raise
+
+        return PooledShell(shell_id, key)
+
+    def release(self, shell: PooledShell) -> None:
+        """
+        Returns a healthy shell to the pool so it can be reused.
+        @param PooledShell shell: The shell from acquire
+        """
+        shell.uses += 1
+        shell.last_used = time.monotonic()
+        with self._lock:
+            if not self._closed:
+                self._idle.setdefault(shell.key, []).append(shell)
+                self._lock.notify()
+                return
+
+            self._size -= 1
+
+        self._close(shell)
+
+    def discard(self, shell: PooledShell, close: bool = True) -> None:
+        """
+        Removes a shell from the pool, e.g. after an error left it in an
+        unknown state.
+        @param PooledShell shell: The shell from acquire
+        @param bool close: Whether to send a Delete for the shell, set to False
+            if the shell is known to be gone.
+        """
+        with self._lock:
+            self._size -= 1
+            self._lock.notify()
+
+        if close:
+            self._close_quietly(shell)
+
+    def evict_idle(self) -> None:
+        """Closes the shells that have been idle for longer than idle_timeout_sec"""
+        expired: list[PooledShell] = []
+        cutoff = time.monotonic() - self.idle_timeout_sec
+        with self._lock:
+            for key, shells in list(self._idle.items()):
+                keep = [s for s in shells if s.last_used > cutoff]
+                expired.extend(s for s in shells if s.last_used <= cutoff)
+                if keep:
+                    self._idle[key] = keep
+                else:
+                    del self._idle[key]
+            self._size -= len(expired)
+            if expired:
+                self._lock.notify_all()
+
+        for shell in expired:
+            self._close_quietly(shell)
+
+    def close(self) -> None:
+        """Closes every idle shell, shells in use are closed on release"""
+        with self._lock:
+            self._closed = True
+            shells = [s for key_shells in self._idle.values() for s in key_shells]
+            self._idle.clear()
+            self._size -= len(shells)
+            self._lock.notify_all()
+
+        for shell in shells:
+            self._close_quietly(shell)
+        self.protocol.transport.close_session()
+
+    def _take(self, key: ShellKey, deadline: float | None) -> tuple[PooledShell | None, PooledShell | None]:
+        """Returns an idle shell for key, or None when a slot for a new shell
+        was reserved, and the shell evicted to make room
+        """
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise WinRMError("the shell pool has been closed")
+
+                shells = self._idle.get(key)
+                if shells:
+                    return shells.pop(), None
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, None
+
+                # make room by closing the least recently used shell of
+                # another key, otherwise wait for one to be released
+                evicted = self._pop_lru()
+                if evicted:
+                    self._size += 1
+                    return None, evicted
+
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    raise WinRMError("no shell of the pool became free within %s seconds, all %d are in use" % (self.acquire_timeout_sec, self.max_size))
+                self._lock.wait(timeout)
+
+    def _healthy(self, shell: PooledShell) -> bool:
+        if self.health_check_after_sec is None or time.monotonic() - shell.last_used <= self.health_check_after_sec:
+            return True
+        try:
+            return self.protocol.shell_alive(shell.shell_id)
+        except BaseException:
+            self.discard(shell)
+            raise
+
+    def _pop_lru(self) -> PooledShell | None:
+        candidates = [(shells[0].last_used, key) for key, shells in self._idle.items() if shells]
+        if not candidates:
+            return None
+
+        key = min(candidates)[1]
+        shells = self._idle[key]
+        shell = shells.pop(0)
+        if not shells:
+            del self._idle[key]
+        self._size -= 1
+        return shell
+
+    def _close(self, shell: PooledShell) -> None:
+        # keep the HTTP session around, other shells still use it
+        self.protocol.close_shell(shell.shell_id, close_session=False)
+
+    def _close_quietly(self, shell: PooledShell) -> None:
+        try:
+            self._close(shell)
+        except Exception:
+            # the shell or connection is likely gone already, there is
+            # nothing left to clean up
+            pass
+
+    @staticmethod
+    def _build_key(shell_options: dict[str, t.Any]) -> ShellKey:
+        key = []
+        for name, value in sorted(shell_options.items()):
+            if isinstance(value, dict):
+                value = tuple(sorted(value.items()))
+            key.append((name, value))
+        return tuple(key)
+
+    @staticmethod
+    def _is_shell_gone(err: WSManFaultError) -> bool:
+        return err.wsman_fault_code == WSMAN_SHELL_NOT_FOUND
+
+
+# the settings of a Protocol and its Transport that must match for two
+# sessions to share a pool, the password is added as a hash
+_SHARED_POOL_PROTOCOL_SETTINGS = ("operation_timeout_sec", "min_receive_timeout_sec", "stream_receive", "locale", "max_env_sz")
+_SHARED_POOL_TRANSPORT_SETTINGS = (
+    "endpoint",
+    "username",
+    "auth_method",
+    "realm",
+    "service",
+    "keytab",
+    "ca_trust_path",
+    "cert_pem",
+    "cert_key_pem",
+    "read_timeout_sec",
+    "server_cert_validation",
+    "kerberos_delegation",
+    "kerberos_hostname_override",
+    "message_encryption",
+    "credssp_disable_tlsv1_2",
+    "credssp_auth_mechanism",
+    "credssp_minimum_version",
+    "send_cbt",
+    "proxy",
+    "pool_maxsize",
+    "pool_idle_timeout_sec",
+    "share_connections",
+)
+
+_shared_pools: dict[tuple[t.Any, ...], ShellPool] = {}
+_shared_pools_lock = threading.Lock()
+
+
+def _shared_pool_key(protocol: Protocol) -> tuple[t.Any, ...]:
+    transport = protocol.transport
+    return (
+        password_digest(getattr(transport, "password", None)),
+        tuple(getattr(protocol, name, None) for name in _SHARED_POOL_PROTOCOL_SETTINGS),
+        tuple(getattr(transport, name, None) for name in _SHARED_POOL_TRANSPORT_SETTINGS),
+    )
+
+
+def get_shared_pool(protocol: Protocol, **kwargs: t.Any) -> ShellPool:
+    """
+    Gets the process wide ShellPool for the host and user of protocol,
+    creating it with protocol and kwargs if it does not exist yet. Shells
+    belong to the user that created them so Sessions to the same host with
+    the same credentials can share them. The commands of a pool are sent
+    with the Protocol that created it, so a protocol with a different
+    password or other connection settings, e.g. timeouts, certificate
+    validation, message encryption or proxy, gets a pool of its own.
+    @param Protocol protocol: The protocol used to reach the host.
+    @param kwargs: Extra ShellPool arguments when the pool is created.
+    @returns The pool shared by all sessions to this host.
+    @rtype ShellPool
+    """
+    key = _shared_pool_key(protocol)
+    with _shared_pools_lock:
+        pool = _shared_pools.get(key)
+        if pool is None or pool._closed:
+            pool = _shared_pools[key] = ShellPool(protocol, **kwargs)
+        return pool
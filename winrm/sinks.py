@@ -0,0 +1,211 @@
+"""Destinations for command output that bound how much of it is kept in memory"""
+
+from __future__ import annotations
+
+import collections.abc
+import functools
+import mmap
+import tempfile
+import typing as t
+
+__all__ = ["OutputSink", "BufferSink", "FileSink", "SpillSink", "TailSink"]
+
+
+class OutputSink(object):
+    """Base class for the destinations of a stdout or stderr stream.
+
+    Session.run_cmd writes every chunk received for the stream to the sink,
+    the Response reads the output back through getvalue when std_out or
+    std_err is accessed.
+    """
+
+    __slots__ = ()
+
+    def write(self, data: bytes) -> None:
+        raise NotImplementedError()  # pragma: no cover
+
+    def getvalue(self) -> bytes:
+        """Returns the output kept by the sink"""
+        raise NotImplementedError()  # pragma: no cover
+
+    def head(self, size: int) -> bytes:
+        """Returns the first size bytes of the output kept by the sink"""
+        return self.getvalue()[:size]
+
+    def iter_chunks(self, size: int) -> collections.abc.Iterator[bytes | memoryview]:
+        """Yields the output kept by the sink in pieces of about size bytes"""
+        view = memoryview(self.getvalue())
+        return (view[i : i + size] for i in range(0, len(view), size))
+
+    def close(self) -> None:
+        pass
+
+
+class BufferSink(OutputSink):
+    """Keeps the whole output in memory, this is the default"""
+
+    __slots__ = ("_chunks",)
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+
+    def write(self, data: bytes) -> None:
+        self._chunks.append(data)
+
+    def getvalue(self) -> bytes:
+        if len(self._chunks) > 1:
+            self._chunks = [b"".join(self._chunks)]
+        return self._chunks[0] if self._chunks else b""
+
+    def head(self, size: int) -> bytes:
+        return self._chunks[0][:size] if len(self._chunks) == 1 else super().head(size)
+
+    def iter_chunks(self, size: int) -> collections.abc.Iterator[bytes | memoryview]:
+        return iter(list(self._chunks))
+
+
+class FileSink(OutputSink):
+    """Writes the output straight to a binary file object, nothing is kept
+
+    @param fileobj: The file object to write to, e.g. open(path, 'wb').
+    @param bool close: Close fileobj when the sink is closed.
+    """
+
+    def __init__(self, fileobj: t.BinaryIO, close: bool = False) -> None:
+        self.fileobj = fileobj
+        self._close = close
+
+    def write(self, data: bytes) -> None:
+        self.fileobj.write(data)
+
+    def getvalue(self) -> bytes:
+        return b""
+
+    def close(self) -> None:
+        if self._close:
+            self.fileobj.close()
+        else:
+            self.fileobj.flush()
+
+
+class SpillSink(OutputSink):
+    """Keeps the output in memory until it grows past threshold bytes, then
+    moves it to an anonymous temporary file.
+
+    @param int threshold: The number of bytes kept in memory.
+    @param string dir: The directory to create the temporary file in.
+    """
+
+    DEFAULT_THRESHOLD = 1024 * 1024
+
+    def __init__(self, threshold: int = DEFAULT_THRESHOLD, dir: str | None = None) -> None:
+        self.threshold = threshold
+        self.dir = dir
+        self.size = 0
+        self._buffer: bytearray | None = bytearray()
+        self._file: t.BinaryIO | None = None
+
+    @property
+    def spilled(self) -> bool:
+        """Whether the output has been moved to disk"""
+        return self._file is not None
+
+    @property
+    def fileobj(self) -> t.BinaryIO | None:
+        """The temporary file holding the output once spilled, positioned at the start"""
+        if self._file:
+            self._file.flush()
+            self._file.seek(0)
+        return self._file
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self._buffer is not None:
+            if self.size <= self.threshold:
+                self._buffer += data
+                return
+
+            self._file = t.cast(t.BinaryIO, tempfile.TemporaryFile(dir=self.dir))
+            self._file.write(self._buffer)
+            self._buffer = None
+
+        t.cast(t.BinaryIO, self._file).write(data)
+
+    def getvalue(self) -> bytes:
+        if self._buffer is not None:
+            return bytes(self._buffer)
+        return t.cast(t.BinaryIO, self.fileobj).read()
+
+    def getbuffer(self) -> memoryview:
+        """Returns a read only view of the output without copying it, spilled
+        output is memory mapped from the temporary file.
+        """
+        if self._buffer is not None:
+            return memoryview(self._buffer).toreadonly()
+
+        fileobj = t.cast(t.BinaryIO, self.fileobj)
+        return memoryview(mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def head(self, size: int) -> bytes:
+        if self._buffer is not None:
+            return bytes(self._buffer[:size])
+        return t.cast(t.BinaryIO, self.fileobj).read(size)
+
+    def iter_chunks(self, size: int) -> collections.abc.Iterator[bytes | memoryview]:
+        # spilled output is read back from the file a piece at a time
+        if self._buffer is not None:
+            return super().iter_chunks(size)
+        return iter(functools.partial(t.cast(t.BinaryIO, self.fileobj).read, size), b"")
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+
+
+class TailSink(OutputSink):
+    """Keeps only the last max_bytes of the output, like a ring buffer.
+
+    @param int max_bytes: The number of bytes to keep.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._trimmed = 0
+        self._buffer = bytearray()
+
+    @property
+    def dropped(self) -> int:
+        """The number of bytes dropped from the beginning of the output"""
+        return self._trimmed + max(len(self._buffer) - self.max_bytes, 0)
+
+    @property
+    def truncated(self) -> bool:
+        """Whether the beginning of the output was dropped"""
+        return self.dropped > 0
+
+    def write(self, data: bytes) -> None:
+        if len(data) >= self.max_bytes:
+            self._trimmed += len(self._buffer) + len(data) - self.max_bytes
+            self._buffer[:] = data[len(data) - self.max_bytes :]
+            return
+
+        self._buffer += data
+        # trimming only once twice the size is buffered keeps the cost of
+        # moving the kept bytes down amortized over the writes
+        if len(self._buffer) >= 2 * self.max_bytes:
+            excess = len(self._buffer) - self.max_bytes
+            self._trimmed += excess
+            del self._buffer[:excess]
+
+    def getvalue(self) -> bytes:
+        excess = max(len(self._buffer) - self.max_bytes, 0)
+        return bytes(self._buffer[excess:])
+
+
+def as_sink(target: OutputSink | t.BinaryIO | None) -> OutputSink:
+    """Returns the sink for a run_cmd stdout or stderr argument"""
+    if target is None:
+        return BufferSink()
+    if isinstance(target, OutputSink):
+        return target
+    return FileSink(target)
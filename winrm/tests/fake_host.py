@@ -0,0 +1,194 @@
+"""A transport that answers like a Windows host, running the transfer scripts
+of winrm.transfer in Python on an in memory file system.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import re
+import struct
+import uuid
+import xml.etree.ElementTree as ET
+
+from winrm import transfer
+from winrm.transport import Transport
+
+RESPONSE = (
+    '<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:a="http://schemas.xmlsoap.org/ws/2004/08/addressing"'
+    ' xmlns:w="http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd" xmlns:rsp="http://schemas.microsoft.com/wbem/wsman/1/windows/shell">'
+    "<s:Header><a:RelatesTo>%s</a:RelatesTo></s:Header><s:Body>%s</s:Body></s:Envelope>"
+)
+COMMAND_STATE = '<rsp:CommandState CommandId="%s" State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/%s">%s</rsp:CommandState>'
+
+
+def _text(root: ET.Element, name: str) -> str:
+    node = next((node for node in root.iter() if node.tag.endswith("}" + name)), None)
+    return "" if node is None or node.text is None else node.text
+
+
+class Process(object):
+    def __init__(self, script: str) -> None:
+        self.script = script
+        self.stdin = bytearray()
+        self.stdout = bytearray()
+        self.stderr = bytearray()
+        self.exit_code: int | None = None
+
+
+class FakeHost(Transport):
+    """Stands in for protocol.transport. files maps remote paths to their
+    content, a Receive returns at most receive_size bytes of output. actions
+    lists the WSMan actions received, e.g. Create or Receive.
+    """
+
+    def __init__(self, receive_size: int = 100000) -> None:
+        super().__init__("http://windows-host:5985/wsman", username="user", password="pass", auth_method="basic")
+        self.files: dict[str, bytearray] = {}
+        self.processes: dict[str, Process] = {}
+        self.receive_size = receive_size
+        self.messages = 0
+        self.actions: list[str] = []
+
+    def close_session(self) -> None:
+        pass
+
+    def send_message(self, message: str | bytes) -> bytes:
+        self.messages += 1
+        root = ET.fromstring(message)
+        action = _text(root, "Action").rsplit("/", 1)[1]
+        relates_to = _text(root, "MessageID")
+        self.actions.append(action)
+
+        if action == "Create":
+            body = '<w:Selector Name="ShellId">%s</w:Selector>' % uuid.uuid4()
+        elif action == "Command":
+            command_id = str(uuid.uuid4()).upper()
+            self.processes[command_id] = process = Process(self._decode_script(_text(root, "Command")))
+            self.start(process)
+            body = "<rsp:CommandId>%s</rsp:CommandId>" % command_id
+        elif action == "Send":
+            stream = next(node for node in root.iter() if node.tag.endswith("}Stream"))
+            process = self.processes[stream.get("CommandId", "")]
+            process.stdin += base64.b64decode(stream.text or "")
+            if stream.get("End") == "true":
+                process.exit_code = self.run(process)
+            else:
+                self.input(process)
+            body = ""
+        elif action == "Receive":
+            command_id = next(node for node in root.iter() if node.tag.endswith("}DesiredStream")).get("CommandId", "")
+            body = self._receive(command_id)
+        else:
+            body = ""
+
+        return (RESPONSE % (relates_to, body)).encode()
+
+    def _receive(self, command_id: str) -> str:
+        process = self.processes[command_id]
+        streams = []
+        room = self.receive_size
+        for name in ["stdout", "stderr"]:
+            data: bytearray = getattr(process, name)
+            chunk = data[:room]
+            del data[:room]
+            room -= len(chunk)
+            if chunk:
+                streams.append('<rsp:Stream Name="%s" CommandId="%s">%s</rsp:Stream>' % (name, command_id, base64.b64encode(chunk).decode()))
+
+        if process.exit_code is None or process.stdout or process.stderr:
+            state = COMMAND_STATE % (command_id, "Running", "")
+        else:
+            state = COMMAND_STATE % (command_id, "Done", "<rsp:ExitCode>%d</rsp:ExitCode>" % process.exit_code)
+        return "<rsp:ReceiveResponse>%s%s</rsp:ReceiveResponse>" % ("".join(streams), state)
+
+    @staticmethod
+    def _decode_script(command: str) -> str:
+        match = re.search(r"(?i)-EncodedCommand (\S+)", command)
+        return base64.b64decode(match.group(1)).decode("utf-16-le") if match else command
+
+    def start(self, process: Process) -> None:
+        """Called when the command starts, the transfer scripts run once
+        their stdin is closed.
+        """
+
+    def input(self, process: Process) -> None:
+        """Called when input was sent without closing stdin"""
+
+    def run(self, process: Process) -> int:
+        """Runs the script of the process once its stdin is closed and
+        returns the exit code.
+        """
+        match = re.match(r"\$path = '((?:[^']|'')*)'\n((?:\$\w+ = \d+\n)*)", process.script)
+        if not match:
+            process.stderr += b"unknown script"
+            return 1
+        path = match.group(1).replace("''", "'")
+        numbers = dict((name, int(value)) for name, value in re.findall(r"\$(\w+) = (\d+)", match.group(2)))
+        offset = numbers.get("offset", 0)
+        body = process.script[match.end() :]
+
+        if body == transfer.HASH_SCRIPT:
+            return self._hash(process, path, numbers["block"])
+        if body == transfer.PATCH_SCRIPT:
+            return self._patch(process, path)
+
+        if body == transfer.SIZE_SCRIPT:
+            process.stdout += b"%d\r\n" % len(self.files.get(path, b""))
+            return 0
+
+        if body == transfer.PUT_SCRIPT:
+            content = self.files.setdefault(path, bytearray())
+        elif path in self.files:
+            content = self.files[path]
+        else:
+            process.stderr += b"Could not find file '%s'." % path.encode()
+            return 1
+
+        if offset > len(content):
+            process.stderr += b"offset %d is past the end of %s" % (offset, path.encode())
+            return 1
+
+        if body == transfer.PUT_SCRIPT:
+            del content[offset:]
+            content += process.stdin
+            process.stdout += b"%d %s\r\n" % (len(content), hashlib.sha256(content).hexdigest().encode())
+        else:
+            process.stdout += content[offset:]
+            process.stderr += b"%d %s\r\n" % (len(content), hashlib.sha256(content).hexdigest().encode())
+        return 0
+
+    def _hash(self, process: Process, root: str, block: int) -> int:
+        prefix = root.rstrip("\\") + "\\"
+        for path, content in sorted(self.files.items()):
+            if path.startswith(prefix):
+                name = base64.b64encode(path[len(prefix) :].encode("utf-8"))
+                blocks = "".join(hashlib.sha256(content[i : i + block]).hexdigest() for i in range(0, len(content), block))
+                process.stdout += b"%s %d %s %s\r\n" % (name, len(content), hashlib.sha256(content).hexdigest().encode(), blocks.encode())
+        return 0
+
+    def _patch(self, process: Process, root: str) -> int:
+        data = memoryview(process.stdin)
+        position = 0
+
+        def read(size: int) -> memoryview:
+            nonlocal position
+            position += size
+            return data[position - size : position]
+
+        while True:
+            kind = read(1)[0]
+            if kind == 0:
+                return 0
+            path = root.rstrip("\\") + "\\" + bytes(read(struct.unpack("<i", read(4))[0])).decode("utf-8").replace("/", "\\")
+            if kind == 2:
+                del self.files[path]
+                continue
+            content = self.files.setdefault(path, bytearray())
+            size, count = struct.unpack("<qi", read(12))
+            del content[size:]
+            content.extend(bytes(size - len(content)))
+            for _ in range(count):
+                offset, length = struct.unpack("<qi", read(12))
+                content[offset : offset + length] = read(length)
+            process.stdout += b"%d %s\r\n" % (len(content), hashlib.sha256(content).hexdigest().encode())
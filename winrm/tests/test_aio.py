@@ -0,0 +1,261 @@
+import asyncio
+import base64
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from winrm.aio import AsyncProtocol, AsyncSession, AsyncTransport, _SpnegoAuth
+from winrm.encryption import Encryption
+from winrm.exceptions import InvalidCredentialsError, WinRMError, WSManFaultError
+from winrm.tests.conftest import open_shell_response
+
+FAULT_RESPONSE = b"""<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope">
+<s:Body><s:Fault>
+<s:Code><s:Value>s:Receiver</s:Value></s:Code>
+<s:Reason><s:Text xml:lang="en-US">the shell was not found</s:Text></s:Reason>
+<s:Detail><f:WSManFault xmlns:f="http://schemas.microsoft.com/wbem/wsman/1/wsmanfault" Code="2150858843"/></s:Detail>
+</s:Fault></s:Body></s:Envelope>"""
+
+
+class AsyncTransportStub(object):
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def send_message(self, message):
+        return self.transport.send_message(message)
+
+    async def close_session(self):
+        pass
+
+
+@pytest.fixture
+def async_protocol_fake(protocol_fake):
+    protocol = AsyncProtocol(endpoint="http://windows-host:5985/wsman", transport="plaintext", username="john.smith", password="secret")
+    protocol.transport = AsyncTransportStub(protocol_fake.transport)
+    return protocol
+
+
+class HttpServer(object):
+    """Answers each request with handler(headers, body, connection_state) -> (status, headers, body)"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+        self.connections = 0
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.url = "http://127.0.0.1:%d/wsman" % self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *args):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        state = {}
+        try:
+            while True:
+                head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+                headers = dict((k.lower(), v.strip()) for k, _, v in (line.partition(":") for line in head[1:] if line))
+                body = await reader.readexactly(int(headers["content-length"]))
+                self.requests.append((headers, body))
+
+                status, response_headers, response_body = self.handler(headers, body, state)
+                lines = ["HTTP/1.1 %d Status" % status] + ["%s: %s" % h for h in response_headers]
+                if ("Transfer-Encoding", "chunked") in response_headers:
+                    half = len(response_body) // 2
+                    chunks = [response_body[:half], response_body[half:], b""]
+                    response_body = b"".join(b"%x\r\n%s\r\n" % (len(c), c) for c in chunks)
+                else:
+                    lines.append("Content-Length: %d" % len(response_body))
+                writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + response_body)
+                await writer.drain()
+                if ("Connection", "close") in response_headers:
+                    break
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+
+class SpnegoAuthSession(object):
+    """Holds a server side spnego context for Encryption"""
+
+    def __init__(self, context):
+        self.auth = _SpnegoAuth(context)
+
+
+def test_open_shell_and_close_shell(async_protocol_fake):
+    async def run():
+        shell_id = await async_protocol_fake.open_shell()
+        await async_protocol_fake.close_shell(shell_id)
+        return shell_id
+
+    assert asyncio.run(run()) == "11111111-1111-1111-1111-111111111113"
+
+
+def test_get_command_output(async_protocol_fake):
+    async def run():
+        shell_id = await async_protocol_fake.open_shell()
+        command_id = await async_protocol_fake.run_command(shell_id, "ipconfig", ["/all"])
+        chunks = [chunk async for chunk in async_protocol_fake.iter_command_output(shell_id, command_id)]
+        output = await async_protocol_fake.get_command_output(shell_id, command_id)
+        await async_protocol_fake.cleanup_command(shell_id, command_id)
+        await async_protocol_fake.close_shell(shell_id)
+        return chunks, output
+
+    chunks, (std_out, std_err, status_code) = asyncio.run(run())
+    assert chunks[-1] == ("exit_code", 0)
+    assert b"".join(c[1] for c in chunks if c[0] == "stdout") == std_out
+    assert b"Windows IP Configuration" in std_out
+    assert std_err == b""
+    assert status_code == 0
+
+
+def test_session_run_cmd_and_run_ps(async_protocol_fake):
+    async def run():
+        async with AsyncSession("windows-host", auth=("john.smith", "secret")) as s:
+            s.protocol = async_protocol_fake
+            return await s.run_cmd("ipconfig", ["/all"]), await s.run_ps('Write-Error "Error"')
+
+    cmd, ps = asyncio.run(run())
+    assert cmd.status_code == 0
+    assert b"Windows IP Configuration" in cmd.std_out
+    assert ps.status_code == 1
+    assert b'Write-Error "Error"' in ps.std_err
+
+
+def test_basic_auth_over_http():
+    def handler(headers, body, state):
+        return 200, [("Content-Type", "application/soap+xml;charset=UTF-8"), ("Transfer-Encoding", "chunked")], open_shell_response.encode()
+
+    async def run():
+        async with HttpServer(handler) as server:
+            protocol = AsyncProtocol(server.url, transport="basic", username="user", password="pass")
+            shell_ids = await asyncio.gather(*[protocol.open_shell() for _ in range(6)])
+            await protocol.transport.close_session()
+            return server, shell_ids
+
+    server, shell_ids = asyncio.run(run())
+    assert shell_ids == ["11111111-1111-1111-1111-111111111113"] * 6
+    assert server.connections <= AsyncTransport.DEFAULT_MAX_CONNECTIONS
+    headers, body = server.requests[0]
+    assert headers["authorization"] == "Basic " + base64.b64encode(b"user:pass").decode()
+    assert b"http://schemas.xmlsoap.org/ws/2004/09/transfer/Create" in body
+
+
+def test_rejected_credentials():
+    async def run():
+        async with HttpServer(lambda headers, body, state: (401, [], b"")) as server:
+            await AsyncProtocol(server.url, transport="basic", username="user", password="wrong").open_shell()
+
+    with pytest.raises(InvalidCredentialsError):
+        asyncio.run(run())
+
+
+def test_wsman_fault():
+    async def run():
+        async with HttpServer(lambda headers, body, state: (500, [], FAULT_RESPONSE)) as server:
+            await AsyncProtocol(server.url, transport="basic", username="user", password="pass").open_shell()
+
+    with pytest.raises(WSManFaultError) as exc:
+        asyncio.run(run())
+
+    assert exc.value.code == 500
+    assert exc.value.reason == "the shell was not found"
+    assert exc.value.wsman_fault_code == 2150858843
+
+
+def test_ntlm_message_encryption(tmp_path, monkeypatch):
+    spnego = pytest.importorskip("spnego")
+
+    user_file = tmp_path / "ntlm_users"
+    user_file.write_text("DOMAIN:user:pass\n")
+    monkeypatch.setenv("NTLM_USER_FILE", str(user_file))
+
+    def handler(headers, body, state):
+        if "authorization" in headers:
+            context = state.setdefault("context", spnego.server(protocol="ntlm"))
+            token = context.step(base64.b64decode(headers["authorization"].split(" ", 1)[1]))
+            if not context.complete:
+                return 401, [("WWW-Authenticate", "Negotiate " + base64.b64encode(token).decode())], b""
+            state["encryption"] = Encryption(SpnegoAuthSession(context), "ntlm")
+            return 200, [], b""
+
+        request = state["encryption"].decrypt(body, headers["content-type"], "127.0.0.1")
+        assert b"http://schemas.xmlsoap.org/ws/2004/09/transfer/Create" in request
+        response, content_type = state["encryption"].encrypt(open_shell_response.encode(), "127.0.0.1")
+        return 200, [("Content-Type", content_type)], response
+
+    async def run():
+        async with HttpServer(handler) as server:
+            protocol = AsyncProtocol(server.url, transport="ntlm", username="DOMAIN\\user", password="pass")
+            shell_id = await protocol.open_shell()
+            await protocol.transport.close_session()
+            return server, shell_id
+
+    server, shell_id = asyncio.run(run())
+    assert shell_id == "11111111-1111-1111-1111-111111111113"
+    assert server.requests[-1][0]["content-type"].startswith('multipart/encrypted;protocol="application/HTTP-SPNEGO-session-encrypted"')
+
+
+def test_ntlm_reauthenticates_after_the_server_closed_the_connection(tmp_path, monkeypatch):
+    spnego = pytest.importorskip("spnego")
+
+    user_file = tmp_path / "ntlm_users"
+    user_file.write_text("DOMAIN:user:pass\n")
+    monkeypatch.setenv("NTLM_USER_FILE", str(user_file))
+
+    def handler(headers, body, state):
+        if "authorization" in headers:
+            context = state.setdefault("context", spnego.server(protocol="ntlm"))
+            token = context.step(base64.b64decode(headers["authorization"].split(" ", 1)[1]))
+            if not context.complete:
+                return 401, [("WWW-Authenticate", "Negotiate " + base64.b64encode(token).decode())], b""
+            state["encryption"] = Encryption(SpnegoAuthSession(context), "ntlm")
+            return 200, [], b""
+        if "encryption" not in state:
+            # an encrypted message on a connection that never authenticated
+            return 401, [], b""
+
+        state["encryption"].decrypt(body, headers["content-type"], "127.0.0.1")
+        response, content_type = state["encryption"].encrypt(open_shell_response.encode(), "127.0.0.1")
+        return 200, [("Content-Type", content_type), ("Connection", "close")], response
+
+    async def run():
+        async with HttpServer(handler) as server:
+            protocol = AsyncProtocol(server.url, transport="ntlm", username="DOMAIN\\user", password="pass", max_connections=1)
+            shell_ids = [await protocol.open_shell(), await protocol.open_shell()]
+            await protocol.transport.close_session()
+            return server, shell_ids
+
+    server, shell_ids = asyncio.run(run())
+    assert shell_ids == ["11111111-1111-1111-1111-111111111113"] * 2
+    # the second message went to a new connection without a security context before it was authenticated
+    assert server.connections == 3
+
+
+def test_unsupported_auth_methods():
+    with pytest.raises(WinRMError, match="credssp is not supported"):
+        AsyncProtocol("http://windows-host:5985/wsman", transport="credssp", username="user", password="pass")
+
+    with pytest.raises(WinRMError, match="does not support it"):
+        AsyncProtocol("http://windows-host:5985/wsman", transport="basic", username="user", password="pass", message_encryption="always")
+
+    with pytest.raises(WinRMError, match="proxies are not supported"):
+        AsyncProtocol("http://windows-host:5985/wsman", transport="basic", username="user", password="pass", proxy="http://proxy:3128")
+
+
+def test_environment_proxy_is_not_bypassed(monkeypatch):
+    monkeypatch.setenv("HTTP_PROXY", "http://proxy:3128")
+    monkeypatch.delenv("NO_PROXY", raising=False)
+    monkeypatch.delenv("no_proxy", raising=False)
+
+    with pytest.raises(WinRMError, match="the environment defines one"):
+        AsyncProtocol("http://windows-host:5985/wsman", transport="basic", username="user", password="pass", proxy="legacy_requests")
+
+    # without proxy the environment is ignored
+    AsyncProtocol("http://windows-host:5985/wsman", transport="basic", username="user", password="pass")
@@ -0,0 +1,141 @@
+import datetime
+import decimal
+import uuid
+
+import pytest
+
+from winrm import clixml
+from winrm.clixml import PSObject
+from winrm.exceptions import WinRMError
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        None,
+        True,
+        42,
+        2**40,
+        1.5,
+        decimal.Decimal("1.10"),
+        "text",
+        b"\x00\xff",
+        uuid.UUID("6a9d5cd2-7e2a-4a6f-9c49-2a0bb4f9a4a6"),
+        datetime.datetime(2024, 2, 29, 13, 5, 7, 123456, tzinfo=datetime.timezone.utc),
+        datetime.timedelta(days=1, hours=2, minutes=3, seconds=4.5),
+        -datetime.timedelta(seconds=90),
+        [1, "two", [3]],
+        {"key": [1, 2], "nested": {"a": None}},
+    ],
+)
+def test_roundtrip(value):
+    assert clixml.loads(clixml.dumps(value)) == value
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "line\r\nnext\ttab",
+        "_x0041_ is not an escape",
+        "<&>\"'",
+        "emoji \U0001f600",
+        "\x00\x1f",
+    ],
+)
+def test_string_escapes(value):
+    assert clixml.loads(clixml.dumps(value)) == value
+
+
+def test_decode_string_escapes():
+    assert clixml.decode_string("a_x000D__x000A_b") == "a\r\nb"
+    assert clixml.decode_string("_xD83D__xDE00_") == "\U0001f600"
+    assert clixml.encode_string("a\rb_x0041_") == "a_x000D_b_x005F_x0041_"
+
+
+def test_object_properties_types_and_refs():
+    data = (
+        '<Obj RefId="0"><TN RefId="0"><T>System.IO.FileInfo</T><T>System.Object</T></TN><ToString>C:\\a.txt</ToString>'
+        '<Props><S N="Name">a.txt</S><I64 N="Length">12</I64></Props><MS><Obj N="Parent" RefId="1"><TNRef RefId="0" />'
+        '<ToString>C:\\</ToString></Obj><Ref N="Self" RefId="0" /></MS></Obj>'
+    )
+    value = clixml.loads(data)
+    assert isinstance(value, PSObject)
+    assert value.type_names == ["System.IO.FileInfo", "System.Object"]
+    assert (value.Name, value["Length"], str(value)) == ("a.txt", 12, "C:\\a.txt")
+    assert value.Parent.type_names == value.type_names
+    assert value.Self is value
+    with pytest.raises(AttributeError):
+        value.Missing
+
+
+def test_primitive_wrapped_in_object():
+    data = '<Obj RefId="0"><TN RefId="0"><T>System.String</T><T>System.Object</T></TN><ToString>abc</ToString><S>abc</S><MS><I32 N="Extra">1</I32></MS></Obj>'
+    assert clixml.loads(data) == "abc"
+
+
+def test_serialize_psobject_reuses_type_names():
+    enum = PSObject(["System.DayOfWeek", "System.Enum", "System.Object"], to_string="Monday", value=1)
+    data = clixml.dumps(PSObject(properties={"First": enum, "Second": enum}))
+    assert data.count("<TN ") == 1 and data.count("<TNRef ") == 1
+    value = clixml.loads(data)
+    assert (value.First, value.Second) == (1, 1)
+
+
+def test_loads_stream():
+    data = (
+        '<Objs Version="1.1.0.1" xmlns="http://schemas.microsoft.com/powershell/2004/04"><!-- stderr -->'
+        '<S S="Error">boom_x000D__x000A_</S><Obj S="progress" RefId="0"><MS><I64 N="SourceId">1</I64></MS></Obj></Objs>'
+    )
+    error, progress = clixml.loads_stream(data)
+    assert error == "boom\r\n"
+    assert progress.SourceId == 1
+
+
+@pytest.mark.parametrize("data", ["<Unknown />", "<I32>x</I32>", '<Ref RefId="9" />'])
+def test_invalid(data):
+    with pytest.raises(WinRMError):
+        clixml.loads(data)
+
+
+def test_cannot_serialize():
+    with pytest.raises(WinRMError, match="cannot serialize object"):
+        clixml.dumps(object())
+
+
+STDERR = (
+    b'#< CLIXML\r\n<Objs Version="1.1.0.1" xmlns="http://schemas.microsoft.com/powershell/2004/04">'
+    b'<Obj S="progress" RefId="0"><TN RefId="0"><T>System.Management.Automation.PSCustomObject</T><T>System.Object</T></TN>'
+    b'<MS><I64 N="SourceId">1</I64><PR N="Record"><AV>Preparing modules for first use.</AV><AI>0</AI><Nil /><PI>-1</PI><PC>-1</PC>'
+    b"<T>Completed</T><SR>-1</SR><SD> </SD></PR></MS></Obj>"
+    b'<S S="Error">boom_x000D__x000A_</S><S S="warning">careful</S>'
+    b'<Obj S="information" RefId="1"><TNRef RefId="0" /><MS><S N="MessageData">hello</S></MS></Obj></Objs>'
+)
+
+
+def test_stream_decoder_byte_by_byte():
+    decoder = clixml.StreamDecoder()
+    records = []
+    for i in range(len(STDERR)):
+        records += decoder.feed(STDERR[i : i + 1])
+    records += decoder.close()
+
+    assert [record.stream for record in records] == ["progress", "error", "warning", "information"]
+    assert records[0].value.Record.Activity == "Preparing modules for first use."
+    assert records[0].value.Record.PercentComplete == -1
+    assert records[1].value == "boom\r\n"
+    assert records[3].value.MessageData == "hello"
+    assert records[3].value.type_names == ["System.Management.Automation.PSCustomObject", "System.Object"]
+
+
+def test_stream_decoder_skips_streams():
+    records = clixml.decode_stream(STDERR, streams=["information"])
+    # the type names of the skipped progress record are still known
+    assert [(record.stream, record.value.type_names[0]) for record in records] == [("information", "System.Management.Automation.PSCustomObject")]
+    assert clixml.stream_text(STDERR) == "boom\ncareful"
+
+
+def test_stream_decoder_incomplete():
+    decoder = clixml.StreamDecoder()
+    decoder.feed(STDERR[:-10])
+    with pytest.raises(WinRMError, match="ended before"):
+        decoder.close()
@@ -0,0 +1,90 @@
+import base64
+import gzip
+import re
+
+import pytest
+
+from winrm import Session
+from winrm.compression import WRAPPER_SCRIPT, DecompressSink, wrap_command, wrap_script
+from winrm.exceptions import WinRMError
+from winrm.powershell import MAX_COMMAND_LINE
+from winrm.sinks import BufferSink
+from winrm.tests.fake_host import FakeHost
+
+OUTPUT = b"".join(b"Information  10/17/2026 08:%02d:00  Service Control Manager  7036\r\n" % (i % 60) for i in range(2000))
+
+
+class CompressingHost(FakeHost):
+    """Runs the wrapper as if the child wrote OUTPUT to stdout"""
+
+    def start(self, process):
+        if process.script.endswith(WRAPPER_SCRIPT):
+            process.stdout += gzip.compress(OUTPUT)
+            process.stderr += b"warning\r\n"
+            process.exit_code = 3
+
+
+def decode(command):
+    return base64.b64decode(re.search("-EncodedCommand (.*)", command).group(1)).decode("utf-16-le")
+
+
+def test_decompress_sink():
+    compressed = gzip.compress(OUTPUT)
+    sink = DecompressSink(BufferSink())
+    for i in range(0, len(compressed), 7):
+        sink.write(compressed[i : i + 7])
+    sink.finish()
+
+    assert sink.getvalue() == OUTPUT
+    assert sink.head(11) == b"Information"
+    assert sink.compressed_bytes == len(compressed)
+
+
+def test_decompress_sink_errors():
+    sink = DecompressSink(BufferSink())
+    with pytest.raises(WinRMError, match="could not be decompressed"):
+        sink.write(b"not compressed")
+
+    sink = DecompressSink(BufferSink())
+    sink.write(gzip.compress(OUTPUT)[:100])
+    with pytest.raises(WinRMError, match="ended after 100 bytes"):
+        sink.finish()
+
+    # the command wrote nothing at all
+    DecompressSink(BufferSink()).finish()
+
+
+def test_wrap_command():
+    script = decode(wrap_command("dir", ["/s", b"C:\\it's"]))
+
+    assert script.startswith("$file = 'cmd.exe'\n$arguments = '/c dir /s C:\\it''s'\n")
+    assert script.endswith(WRAPPER_SCRIPT)
+
+
+def test_wrap_script():
+    script = decode(wrap_script("Get-WinEvent -LogName 'System'"))
+
+    assert script.startswith("$file = 'powershell.exe'\n$script = 'Get-WinEvent -LogName ''System'''\n")
+
+
+def test_wrap_too_long():
+    assert len(wrap_script("x" * 2000)) <= MAX_COMMAND_LINE
+
+    with pytest.raises(WinRMError, match="cmd.exe accepts at most 8191"):
+        wrap_script("x" * 3000)
+    with pytest.raises(WinRMError, match="cmd.exe accepts at most 8191"):
+        wrap_command("echo", ["x" * 3000])
+
+
+@pytest.mark.parametrize(
+    "run", [lambda s: s.run_cmd("wevtutil", ["qe", "System"], compress_output=True), lambda s: s.run_ps("Get-WinEvent", compress_output=True)]
+)
+def test_run_compressed(run):
+    s = Session("windows-host", auth=("john.smith", "secret"))
+    s.protocol.transport = CompressingHost()
+
+    r = run(s)
+
+    assert r.std_out == OUTPUT
+    assert r.std_err == b"warning\r\n"
+    assert r.status_code == 3
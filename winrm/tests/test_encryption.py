@@ -173,6 +173,59 @@ def test_decrypt_large_credssp_message():
     assert actual == test_unencrypted_message
 
 
+@pytest.mark.parametrize("protocol", ["ntlm", "credssp"])
+def test_encrypt_decrypt_round_trip(protocol):
+    test_session = SessionTest()
+    test_message = bytes(range(256)) * 1000
+    encryption = Encryption(test_session, protocol)
+
+    body, content_type = encryption.encrypt(test_message, "testhost.com")
+
+    assert body.count(b"--Encrypted Boundary\r\n") == (2 * 16 if protocol == "credssp" else 2)
+    assert encryption.decrypt(body, content_type, "testhost.com") == test_message
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 100000])
+def test_decrypt_stream(chunk_size):
+    test_session = SessionTest()
+    test_message = bytes(range(256)) * 200
+    encryption = Encryption(test_session, "credssp")
+    body, content_type = encryption.encrypt(test_message, "testhost.com")
+    received = []
+
+    def chunks():
+        for i in range(0, len(body), chunk_size):
+            received.append(i + chunk_size)
+            yield body[i : i + chunk_size]
+
+    parts = []
+    for part in encryption.decrypt_stream(chunks(), content_type, "testhost.com"):
+        parts.append((part, received[-1]))
+
+    assert b"".join(part for part, _ in parts) == test_message
+    assert [len(part) for part, _ in parts] == [16384, 16384, 16384, 2048]
+    if chunk_size == 1:
+        # every part is yielded once the boundary after it has been received
+        payloads = [i for i in range(len(body)) if body.startswith(b"\tContent-Type: application/octet-stream", i)]
+        assert [offset for _, offset in parts] == [body.index(b"--Encrypted Boundary", i) + 20 for i in payloads]
+
+
+def test_decrypt_stream_length_mismatch():
+    test_session = SessionTest()
+    encryption = Encryption(test_session, "ntlm")
+    body, content_type = encryption.encrypt(b"unencrypted message", "testhost.com")
+    body = body.replace(b"Length=19", b"Length=20")
+
+    with pytest.raises(WinRMError, match="message has been tampered with"):
+        list(encryption.decrypt_stream([body[:50], body[50:]], content_type, "testhost.com"))
+
+
+def test_decrypt_stream_decryption_not_needed():
+    encryption = Encryption(SessionTest(), "ntlm")
+
+    assert list(encryption.decrypt_stream([b"unencrypted ", b"message"], "application/soap+xml", "testhost.com")) == [b"unencrypted ", b"message"]
+
+
 def test_decrypt_message_decryption_not_needed():
     test_session = SessionTest()
     test_response = ResponseTest("application/soap+xml", "unencrypted message")
@@ -0,0 +1,109 @@
+import uuid
+
+import pytest
+import xmltodict
+from mock import patch
+
+from winrm.envelope import EnvelopeTemplate
+from winrm.protocol import Protocol
+
+MESSAGE_ID = "11111111-1111-1111-1111-111111111111"
+SHELL_ID = "11111111-1111-1111-1111-111111111113"
+COMMAND_ID = "11111111-1111-1111-1111-111111111114"
+AWKWARD = "a & b < c > d \"e\" 'f'\r\n\tg"
+
+
+@pytest.fixture
+def protocol():
+    with patch("uuid.uuid4", return_value=uuid.UUID(MESSAGE_ID)):
+        yield Protocol(endpoint="http://windows-host:5985/wsman", transport="plaintext", username="john.smith", password="secret")
+
+
+def test_render_matches_unparse():
+    field = EnvelopeTemplate.field
+    template = EnvelopeTemplate.compile({"a": {"@x": field("attr"), "b": "uuid:" + field("text"), "c": {"@y": "static", "#text": field("text")}}})
+
+    for value in ["plain", AWKWARD, ""]:
+        expected = xmltodict.unparse({"a": {"@x": value, "b": "uuid:" + value, "c": {"@y": "static", "#text": value}}})
+        assert template.render(attr=value, text=value) == expected
+
+
+def test_bind():
+    field = EnvelopeTemplate.field
+    template = EnvelopeTemplate.compile({"a": {"@x": field("attr"), "b": field("text")}})
+
+    bound = template.bind(attr=AWKWARD)
+
+    assert [name for name, _ in bound.fields] == ["text"]
+    assert bound.render(text="value") == template.render(attr=AWKWARD, text="value")
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"working_directory": "C:\\temp & more", "idle_timeout": "PT60S", "env_vars": {"PATH": "%PATH%;C:\\bin", AWKWARD: AWKWARD}},
+        {"noprofile": True, "codepage": 65001, "env_vars": {"A": "1"}},
+    ],
+)
+def test_open_shell_envelope(protocol, kwargs):
+    values = dict(i_stream="stdin", o_stream="stdout stderr", working_directory=None, env_vars=None, noprofile=False, codepage=437, idle_timeout=None)
+    values.update(kwargs)
+
+    expected = protocol._open_shell_envelope(
+        values["i_stream"],
+        values["o_stream"],
+        values["working_directory"],
+        list((values["env_vars"] or {}).items()),
+        str(values["noprofile"]).upper(),
+        str(values["codepage"]),
+        values["idle_timeout"],
+    )
+    actual = protocol._build_open_shell(**values)
+
+    assert actual == xmltodict.unparse(expected)
+
+
+@pytest.mark.parametrize("arguments", [[], ["/all"], [b"/c", AWKWARD]])
+def test_run_command_envelope(protocol, arguments):
+    unicode_args = " ".join(a if isinstance(a, str) else a.decode() for a in arguments)
+    expected = protocol._run_command_envelope(SHELL_ID, AWKWARD, unicode_args or None, "TRUE", "FALSE")
+
+    # rendered twice to cover the template cached for the shell
+    for _ in range(2):
+        assert protocol._build_run_command(SHELL_ID, AWKWARD, arguments, True, False) == xmltodict.unparse(expected)
+
+
+def test_shell_envelopes(protocol):
+    message_id = uuid.UUID(MESSAGE_ID)
+
+    assert protocol._build_close_shell(SHELL_ID, message_id) == xmltodict.unparse(protocol._close_shell_envelope(SHELL_ID, MESSAGE_ID))
+    assert protocol._build_cleanup_command(SHELL_ID, COMMAND_ID, message_id) == xmltodict.unparse(
+        protocol._cleanup_command_envelope(SHELL_ID, COMMAND_ID, MESSAGE_ID)
+    )
+    assert protocol._build_receive(SHELL_ID, COMMAND_ID) == xmltodict.unparse(protocol._receive_envelope(SHELL_ID, COMMAND_ID))
+    assert protocol._build_send_command_input(SHELL_ID, COMMAND_ID, b"echo hi\r\n", True) == xmltodict.unparse(
+        protocol._send_command_input_envelope(SHELL_ID, COMMAND_ID, "ZWNobyBoaQ0K", "true")
+    )
+
+
+def test_operation_timeout_change(protocol):
+    before = protocol._build_receive(SHELL_ID, COMMAND_ID)
+    protocol.operation_timeout_sec = 5
+
+    after = protocol._build_receive(SHELL_ID, COMMAND_ID)
+
+    assert "<w:OperationTimeout>PT20S</w:OperationTimeout>" in before
+    assert "<w:OperationTimeout>PT5S</w:OperationTimeout>" in after
+
+
+def test_shell_templates_are_released(protocol):
+    protocol._build_receive(SHELL_ID, COMMAND_ID)
+    assert SHELL_ID in protocol._shell_templates
+
+    protocol._forget_shell(SHELL_ID)
+    assert SHELL_ID not in protocol._shell_templates
+
+    for i in range(protocol.MAX_SHELL_TEMPLATES + 10):
+        protocol._build_receive("shell-%d" % i, COMMAND_ID)
+    assert len(protocol._shell_templates) == protocol.MAX_SHELL_TEMPLATES
@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+
+import winrm.fleet
+from winrm import Fleet, Response
+from winrm.exceptions import InvalidCredentialsError, WinRMError, WinRMTransportError
+
+
+class SessionFake(object):
+    """Stands in for Session, the behaviour of a host is set in hosts"""
+
+    hosts = {}
+    lock = threading.Lock()
+    running = {}
+    max_running = {}
+    cancels = {}
+
+    def __init__(self, target, auth, **kwargs):
+        self.target = target
+        self.kwargs = kwargs
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def run_cmd(self, command, args=(), **kwargs):
+        self.cancels[self.target] = kwargs.get("cancel")
+        with self.lock:
+            self.running[self.target] = self.running.get(self.target, 0) + 1
+            self.max_running[self.target] = max(self.max_running.get(self.target, 0), self.running[self.target])
+        try:
+            delay, error = self.hosts.get(self.target, (0, None))
+            time.sleep(delay)
+            if error:
+                raise error
+            return Response((self.target.encode(), b"", 0))
+        finally:
+            with self.lock:
+                self.running[self.target] -= 1
+
+    def run_ps(self, script, **kwargs):
+        return self.run_cmd(script, **kwargs)
+
+
+@pytest.fixture
+def session_fake(monkeypatch):
+    monkeypatch.setattr(winrm.fleet, "Session", SessionFake)
+    SessionFake.hosts = {}
+    SessionFake.running = {}
+    SessionFake.max_running = {}
+    SessionFake.cancels = {}
+    return SessionFake
+
+
+def test_results_in_completion_order(session_fake):
+    session_fake.hosts = {"slow": (0.2, None), "fast": (0, None)}
+    fleet = Fleet(["slow", "fast"], auth=("john.smith", "secret"), max_workers=2)
+
+    results = list(fleet.run_cmd("hostname"))
+
+    assert [r.host for r in results] == ["fast", "slow"]
+    assert all(r.ok for r in results)
+    assert results[1].response.std_out == b"slow"
+
+
+def test_failures_summary(session_fake):
+    session_fake.hosts = {
+        "denied": (0, InvalidCredentialsError("rejected")),
+        "broken": (0, WinRMTransportError("http", 500, "")),
+    }
+    fleet = Fleet(["denied", "broken", "ok"], auth=("john.smith", "secret"))
+
+    results = list(fleet.run_ps("hostname"))
+
+    assert sorted(r.host for r in results) == ["broken", "denied", "ok"]
+    assert Fleet.summarize(results) == {"InvalidCredentialsError": ["denied"], "WinRMTransportError": ["broken"]}
+
+
+def test_concurrency_limits(session_fake):
+    session_fake.hosts = {"a": (0.05, None), "b": (0.05, None)}
+    fleet = Fleet(["a"] * 4 + ["b"] * 4, auth=("john.smith", "secret"), max_workers=3, per_host_limit=2)
+
+    results = list(fleet.run_cmd("hostname"))
+
+    assert len(results) == 8
+    assert session_fake.max_running == {"a": 2, "b": 2}
+
+
+def test_deadline(session_fake):
+    session_fake.hosts = {"hung": (0.5, None)}
+    fleet = Fleet(["hung", "ok"], auth=("john.smith", "secret"), deadline_sec=0.1)
+
+    start = time.monotonic()
+    results = list(fleet.run_cmd("hostname"))
+
+    assert time.monotonic() - start < 0.4
+    assert [r.host for r in results] == ["ok", "hung"]
+    assert isinstance(results[1].error, TimeoutError)
+    # the late command is cancelled so its worker is freed
+    assert session_fake.cancels["hung"].is_set()
+    assert not session_fake.cancels["ok"].is_set()
+
+
+def test_cancel(session_fake):
+    session_fake.hosts = {"hung": (0.5, None)}
+    fleet = Fleet(["hung", "hung", "queued"], auth=("john.smith", "secret"), max_workers=1, per_host_limit=1)
+    cancel = threading.Event()
+
+    results = fleet.run_ps("hostname", cancel=cancel)
+    threading.Timer(0.05, cancel.set).start()
+    results = list(results)
+
+    # the caller's event cancels the running command, the rest never start
+    assert session_fake.cancels["hung"].is_set()
+    assert sorted(r.host for r in results) == ["hung", "hung", "queued"]
+    assert Fleet.summarize(r for r in results if r.host == "queued") == {"WinRMCommandCancelledError": ["queued"]}
+
+
+def test_no_cancel_without_deadline(session_fake):
+    # nothing can be cancelled, run_ps may use a PowerShellHost
+    list(Fleet(["ok"], auth=("john.smith", "secret")).run_ps("hostname"))
+    assert session_fake.cancels["ok"] is None
+
+
+def test_invalid_limits():
+    with pytest.raises(WinRMError, match="max_workers"):
+        Fleet(["host"], auth=("john.smith", "secret"), max_workers=0)
+
+    with pytest.raises(WinRMError, match="per_host_limit"):
+        Fleet(["host"], auth=("john.smith", "secret"), per_host_limit=0)
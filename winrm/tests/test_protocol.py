@@ -1,6 +1,21 @@
+import base64
+import io
+import re
+import threading
+import xml.etree.ElementTree as ET
+
 import pytest
 
+from winrm.encryption import Encryption
+from winrm.exceptions import (
+    WinRMCommandCancelledError,
+    WinRMCommandTimeoutError,
+    WinRMError,
+    WinRMOperationTimeoutError,
+    WSManFaultError,
+)
 from winrm.protocol import Protocol
+from winrm.tests.fake_host import FakeHost
 
 
 @pytest.mark.parametrize("func_name", ["build_wsman_header", "_get_soap_header"])
@@ -96,3 +111,295 @@ def test_fail_set_operation_timeout_as_sec():
     with pytest.raises(ValueError) as exc:
         Protocol("endpoint", username="username", password="password", read_timeout_sec=30, operation_timeout_sec="29a")
     assert str(exc.value) == "failed to parse operation_timeout_sec as int: " "invalid literal for int() with base 10: '29a'"
+
+
+def test_iter_command_output(protocol_fake):
+    shell_id = protocol_fake.open_shell()
+    command_id = protocol_fake.run_command(shell_id, "ipconfig", ["/all"])
+
+    chunks = list(protocol_fake.iter_command_output(shell_id, command_id))
+    assert chunks[-1] == ("exit_code", 0)
+    assert [stream for stream, _ in chunks[:-1]] == ["stdout"]
+    assert chunks[0][1].startswith(b"\r\nWindows IP Configuration")
+
+    protocol_fake.cleanup_command(shell_id, command_id)
+    protocol_fake.close_shell(shell_id)
+
+
+def test_iter_command_output_receives_on_demand(protocol_fake, monkeypatch):
+    responses = [
+        (b"first", b"", -1, False),
+        WinRMOperationTimeoutError(),
+        (b"", b"error", -1, False),
+        (b"last", b"", 3, True),
+    ]
+    requests = []
+
+    def get_command_output_raw(shell_id, command_id):
+        requests.append(command_id)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(protocol_fake, "get_command_output_raw", get_command_output_raw)
+    output = protocol_fake.iter_command_output("shell", "command")
+
+    assert next(output) == ("stdout", b"first")
+    assert len(requests) == 1
+    assert next(output) == ("stderr", b"error")
+    assert len(requests) == 3
+    assert list(output) == [("stdout", b"last"), ("exit_code", 3)]
+
+
+def test_get_command_output_max_output_bytes(protocol_fake, monkeypatch):
+    responses = [(b"12345", b"", -1, False), (b"", b"678", -1, False), (b"never", b"", 0, True)]
+    signals = []
+    monkeypatch.setattr(protocol_fake, "get_command_output_raw", lambda shell_id, command_id: responses.pop(0))
+    monkeypatch.setattr(protocol_fake, "send_message", lambda message: signals.append(message))
+    monkeypatch.setattr(protocol_fake, "_check_relates_to", lambda response, message_id: None)
+
+    output = protocol_fake.get_command_output("shell", "command", max_output_bytes=7)
+
+    assert output == (b"12345", b"67", -1)
+    assert (output.stdout, output.stderr, output.return_code, output.truncated) == (b"12345", b"67", -1, True)
+    assert len(responses) == 1
+    assert len(signals) == 1 and "signal/terminate" in signals[0]
+    # the command was already terminated
+    protocol_fake.cleanup_command("shell", "command")
+    assert len(signals) == 1
+
+
+def test_get_command_output_within_max_output_bytes(protocol_fake):
+    shell_id = protocol_fake.open_shell()
+    command_id = protocol_fake.run_command(shell_id, "ipconfig", ["/all"])
+    output = protocol_fake.get_command_output(shell_id, command_id, max_output_bytes=1 << 20)
+    assert output.return_code == 0
+    assert not output.truncated
+    protocol_fake.cleanup_command(shell_id, command_id)
+    protocol_fake.close_shell(shell_id)
+
+
+def test_get_command_output_cancel(protocol_fake, monkeypatch):
+    cancel = threading.Event()
+    responses = [(b"partial", b"err", -1, False), WinRMOperationTimeoutError()]
+    signals = []
+
+    def get_command_output_raw(shell_id, command_id):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            cancel.set()
+            raise response
+        return response
+
+    monkeypatch.setattr(protocol_fake, "get_command_output_raw", get_command_output_raw)
+    monkeypatch.setattr(protocol_fake, "send_message", lambda message: signals.append(message))
+    monkeypatch.setattr(protocol_fake, "_check_relates_to", lambda response, message_id: None)
+
+    with pytest.raises(WinRMCommandCancelledError) as exc:
+        protocol_fake.get_command_output("shell", "command", cancel=cancel)
+
+    assert (exc.value.stdout, exc.value.stderr) == (b"partial", b"err")
+    assert len(signals) == 1 and "signal/terminate" in signals[0]
+    protocol_fake.cleanup_command("shell", "command")
+    assert len(signals) == 1
+
+
+def test_iter_command_output_timeout(protocol_fake, monkeypatch):
+    def send_message(message):
+        raise WinRMError("host is unreachable")
+
+    monkeypatch.setattr(protocol_fake, "send_message", send_message)
+
+    with pytest.raises(WinRMCommandTimeoutError, match="within 0 seconds") as exc:
+        next(protocol_fake.iter_command_output("shell", "command", timeout_sec=0))
+    assert not isinstance(exc.value, WinRMCommandCancelledError)
+    # the terminate signal failed, cleanup_command tries again
+    assert isinstance(exc.value.__cause__, WinRMError)
+    assert "command" not in protocol_fake._terminated_commands
+
+
+def build_receive_response(chunks, state="Done", exit_code="0"):
+    streams = "".join('<rsp:Stream Name="%s" CommandId="1">%s</rsp:Stream>' % (name, base64.b64encode(data).decode()) for name, data in chunks)
+    streams += '<rsp:Stream Name="stdout" CommandId="1" End="true"/>'
+    exit_code = "<rsp:ExitCode>%s</rsp:ExitCode>" % exit_code if exit_code is not None else ""
+    return (
+        '<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" xmlns:rsp="http://schemas.microsoft.com/wbem/wsman/1/windows/shell">'
+        "<s:Body><rsp:ReceiveResponse>%s"
+        '<rsp:CommandState CommandId="1" State="http://schemas.microsoft.com/wbem/wsman/1/windows/shell/CommandState/%s">%s</rsp:CommandState>'
+        "</rsp:ReceiveResponse></s:Body></s:Envelope>" % (streams, state, exit_code)
+    ).encode()
+
+
+def test_parse_receive_multiple_chunks(protocol_fake):
+    # chunk sizes that need no padding, one or two padding characters
+    chunks = [("stdout", b"abc" * 10), ("stderr", b"e"), ("stdout", b"de"), ("stdout", b"f" * 4), ("stderr", b"rr" * 3), ("stdout", b"ghi")]
+
+    stdout, stderr, return_code, command_done = protocol_fake._parse_receive(build_receive_response(chunks, exit_code="3"))
+
+    assert stdout == b"abc" * 10 + b"de" + b"f" * 4 + b"ghi"
+    assert stderr == b"e" + b"rr" * 3
+    assert return_code == 3
+    assert command_done is True
+
+
+def test_parse_receive_running(protocol_fake):
+    res = build_receive_response([("stdout", b"partial")], state="Running", exit_code=None)
+
+    assert protocol_fake._parse_receive(res) == (b"partial", b"", -1, False)
+
+
+def test_iter_command_output_stream_receive():
+    responses = [
+        build_receive_response([("stdout", b"first" * 100), ("stderr", b"error")], state="Running", exit_code=None),
+        WinRMOperationTimeoutError(),
+        build_receive_response([("stdout", b"last")], exit_code="3"),
+    ]
+
+    class StreamingTransport(object):
+        def send_message_stream(self, message):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            # hand the response to the parser in pieces that split elements
+            for i in range(0, len(response), 7):
+                yield response[i : i + 7]
+
+    protocol = Protocol("endpoint", username="username", password="password", stream_receive=True)
+    protocol.transport = StreamingTransport()
+
+    output = list(protocol.iter_command_output("shell", "command"))
+
+    assert output == [("stdout", b"first" * 100), ("stderr", b"error"), ("stdout", b"last"), ("exit_code", 3)]
+    assert responses == []
+
+
+class SendRecorder(object):
+    """Records the input of every Send message"""
+
+    encryption = None
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, message):
+        self.messages.append(message)
+        root = ET.fromstring(message)
+        stream = next(node for node in root.iter() if node.tag.endswith("Stream"))
+        self.stdin = getattr(self, "stdin", b"") + base64.b64decode(stream.text or "")
+        self.ends = getattr(self, "ends", []) + [stream.get("End")]
+        return b""
+
+
+@pytest.mark.parametrize(
+    "make_input",
+    [
+        lambda data: data,
+        lambda data: bytearray(data),
+        lambda data: io.BytesIO(data),
+        lambda data: (data[i : i + 777] for i in range(0, len(data), 777)),
+    ],
+)
+def test_stream_command_input(make_input):
+    data = bytes(range(256)) * 100
+    protocol = Protocol("endpoint", username="username", password="password")
+    protocol.max_env_sz = 8192
+    protocol.transport = SendRecorder()
+
+    stats = protocol.stream_command_input("shell", "command", make_input(data))
+
+    assert protocol.transport.stdin == data
+    assert protocol.transport.ends == ["false"] * (stats.messages - 1) + ["true"]
+    assert all(len(message.encode()) <= 8192 for message in protocol.transport.messages)
+    assert len(protocol.transport.messages[0].encode()) > 8192 - 4
+    assert stats.bytes_sent == len(data)
+    assert stats.bytes_per_sec > 0
+
+
+def test_stream_command_input_encrypted():
+    protocol = Protocol("endpoint", username="username", password="password")
+    protocol.max_env_sz = 8192
+    protocol.transport = SendRecorder()
+    protocol.transport.encryption = object()
+
+    protocol.stream_command_input("shell", "command", b"a" * 10000)
+
+    assert protocol.transport.stdin == b"a" * 10000
+    assert len(protocol.transport.messages[0].encode()) + Encryption.max_overhead(8192) <= 8192
+    assert len(protocol.transport.messages[0].encode()) + Encryption.max_overhead(8192) > 8192 - 4
+
+
+def test_stream_command_input_empty():
+    protocol = Protocol("endpoint", username="username", password="password")
+    protocol.transport = SendRecorder()
+
+    assert protocol.stream_command_input("shell", "command", iter([])).messages == 1
+    assert protocol.transport.ends == ["true"]
+
+    protocol.transport = SendRecorder()
+    assert protocol.stream_command_input("shell", "command", b"", end=False).messages == 0
+    assert protocol.transport.messages == []
+
+    protocol.max_env_sz = 100
+    with pytest.raises(WinRMError, match="leaves no room for input"):
+        protocol.stream_command_input("shell", "command", b"input")
+
+
+def test_adaptive_receive_timeout(monkeypatch):
+    protocol = Protocol("endpoint", username="username", password="password", min_receive_timeout_sec=1, operation_timeout_sec=3, read_timeout_sec=5)
+    running = build_receive_response([], state="Running", exit_code=None)
+    responses = [
+        WinRMOperationTimeoutError(),
+        running,
+        WinRMOperationTimeoutError(),
+        build_receive_response([("stdout", b"out")], state="Running", exit_code=None),
+    ]
+    responses += [WinRMOperationTimeoutError(), build_receive_response([])]
+    timeouts = []
+
+    def send_message(message):
+        timeouts.append(re.search(r"<w:OperationTimeout>PT(\d+)S<", message).group(1))
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(protocol, "send_message", send_message)
+
+    assert protocol.get_command_output("shell", "command") == (b"out", b"", 0)
+    assert timeouts == ["1", "2", "3", "3", "1", "2"]
+    assert (protocol.receive_stats.receives, protocol.receive_stats.empty_receives) == (6, 4)
+    assert protocol.receive_stats.empty_rate == pytest.approx(4 / 6)
+
+
+def test_receive_timeout_capped_by_deadline(protocol_fake, monkeypatch):
+    messages = []
+    monkeypatch.setattr(protocol_fake, "send_message", lambda message: messages.append(message) or build_receive_response([]))
+    protocol_fake.receive_stats.reset()
+
+    protocol_fake.get_command_output("shell", "command", timeout_sec=5)
+
+    assert "<w:OperationTimeout>PT5S</w:OperationTimeout>" in messages[0]
+    assert (protocol_fake.receive_stats.receives, protocol_fake.receive_stats.empty_rate) == (1, 0)
+
+
+def test_invalid_receive_timeout(protocol_fake):
+    with pytest.raises(WinRMError, match="read_timeout_sec must exceed operation_timeout_sec"):
+        protocol_fake.get_command_output_raw("shell", "command", operation_timeout_sec=protocol_fake.read_timeout_sec)
+    with pytest.raises(WinRMError, match="min_receive_timeout_sec"):
+        Protocol("endpoint", username="username", password="password", min_receive_timeout_sec=25)
+
+
+def test_shell_alive(monkeypatch):
+    protocol = Protocol("endpoint", username="username", password="password")
+    protocol.transport = FakeHost()
+    shell_id = protocol.open_shell()
+
+    assert protocol.shell_alive(shell_id)
+    assert protocol.transport.actions[-1] == "Get"
+
+    def send_message(message):
+        raise WSManFaultError(500, "", "", "The request for the Windows Remote Shell with ShellId failed", wsman_fault_code=2150858843)
+
+    monkeypatch.setattr(protocol, "send_message", send_message)
+    assert not protocol.shell_alive(shell_id)
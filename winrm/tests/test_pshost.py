@@ -0,0 +1,142 @@
+import base64
+import re
+
+import pytest
+
+from winrm import Session
+from winrm.exceptions import WinRMError
+from winrm.pshost import BOOTSTRAP_SCRIPT, PowerShellHost
+from winrm.shellpool import ShellPool
+from winrm.tests.fake_host import FakeHost
+
+
+class PowerShellFake(FakeHost):
+    """Runs the bootstrap loop, the scripts are a few cmdlets with one
+    argument: Write-Output, Write-Error, Start-Sleep, exit and assignments.
+    """
+
+    def start(self, process):
+        if process.script.endswith(BOOTSTRAP_SCRIPT):
+            process.token = re.match(r"\$token = '(\w+)'", process.script).group(1).encode()
+            process.variables = {}
+
+    def input(self, process):
+        while b"\n" in process.stdin:
+            line, _, rest = bytes(process.stdin).partition(b"\n")
+            process.stdin[:] = rest
+            script_id, script = line.split(b" ")
+            if self.execute(process, script_id, base64.b64decode(script).decode()):
+                return
+
+    def execute(self, process, script_id, script):
+        code = 0
+        for statement in filter(None, script.splitlines()):
+            name, _, value = statement.partition(" ")
+            value = process.variables.get(value, value)
+            if name.startswith("$"):
+                process.variables[name] = value.lstrip("= ")
+            elif name == "Write-Output":
+                process.stdout += b"%s\r\n" % value.encode()
+            elif name == "Write-Error":
+                process.stderr += b"%s\r\n" % value.encode()
+                code = 1
+            elif name == "exit":
+                process.exit_code = int(value)
+                return True
+            elif name == "Start-Sleep":
+                return True
+        process.stdout += b"%s %s %d\r\n" % (process.token, script_id, code)
+        process.stderr += b"%s %s\r\n" % (process.token, script_id)
+        return False
+
+
+@pytest.fixture
+def transport():
+    return PowerShellFake()
+
+
+@pytest.fixture
+def session(transport):
+    session = Session("windows-host", auth=("john.smith", "secret"), ps_host=True)
+    session.protocol.transport = transport
+    return session
+
+
+def test_variables_persist(session, transport):
+    r = session.run_ps("$greeting = hello")
+    assert (r.std_out, r.std_err, r.status_code) == (b"", b"", 0)
+
+    r = session.run_ps("Write-Output $greeting\nWrite-Output world")
+    assert r.std_out == b"hello\r\nworld\r\n"
+
+    # one shell and one process for all scripts
+    assert transport.actions.count("Create") == 1
+    assert transport.actions.count("Command") == 1
+
+    session.close()
+    assert transport.actions[-2:] == ["Signal", "Delete"]
+
+
+def test_error(session):
+    r = session.run_ps("Write-Error boom")
+
+    assert r.std_err == b"boom\r\n"
+    assert r.status_code == 1
+
+
+def test_exit_restarts(session, transport):
+    r = session.run_ps("Write-Output bye\nexit 3")
+    assert (r.std_out, r.status_code) == (b"bye\r\n", 3)
+
+    r = session.run_ps("Write-Output again")
+    assert r.std_out == b"again\r\n"
+    assert transport.actions.count("Command") == 2
+
+
+def test_wedged_host_is_recycled(transport):
+    host = PowerShellHost(Session("windows-host", auth=("john.smith", "secret")).protocol, script_timeout_sec=0.05)
+    host.protocol.transport = transport
+
+    with pytest.raises(WinRMError, match="did not finish script 1 in time"):
+        host.run("Start-Sleep 3600")
+    assert not host.alive
+    assert transport.actions[-2:] == ["Signal", "Delete"]
+
+    assert host.run("Write-Output ok") == (b"ok\r\n", b"", 0)
+    assert host.starts == 2
+
+
+def test_startup_script(transport):
+    protocol = Session("windows-host", auth=("john.smith", "secret")).protocol
+    protocol.transport = transport
+    host = PowerShellHost(protocol, startup_script="$module = loaded")
+
+    assert host.run("Write-Output $module") == (b"loaded\r\n", b"", 0)
+
+    with pytest.raises(WinRMError, match="startup script failed with exit code 1: broken"):
+        PowerShellHost(protocol, startup_script="Write-Error broken").run("")
+
+
+def test_shell_from_pool(transport):
+    protocol = Session("windows-host", auth=("john.smith", "secret")).protocol
+    protocol.transport = transport
+    pool = ShellPool(protocol)
+    host = PowerShellHost(protocol, pool, codepage=65001)
+
+    host.run("Write-Output ok")
+    assert (pool.size, pool.idle) == (1, 0)
+
+    host.close()
+    assert (pool.size, pool.idle) == (1, 1)
+
+
+def test_session_host_keeps_pool_free(transport):
+    session = Session("windows-host", auth=("john.smith", "secret"), ps_host=True)
+    session.protocol.transport = transport
+    session.shell_pool = ShellPool(session.protocol, max_size=1, acquire_timeout_sec=1)
+
+    assert session.run_ps("Write-Output ok").std_out == b"ok\r\n"
+    # the host has a shell of its own, the only pooled shell is still free
+    shell = session.shell_pool.acquire()
+    assert session.shell_pool.size == 1
+    session.shell_pool.release(shell)
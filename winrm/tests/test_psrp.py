@@ -0,0 +1,280 @@
+import base64
+import threading
+import uuid
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from winrm import clixml, psrp
+from winrm.exceptions import WinRMError
+from winrm.protocol import Protocol
+from winrm.tests.fake_host import COMMAND_STATE, RESPONSE, _text
+
+# server messages in the form Windows PowerShell 5.1 sends them
+APPLICATION_PRIVATE_DATA = (
+    '<Obj RefId="0"><MS><Obj N="ApplicationPrivateData" RefId="1"><TN RefId="0">'
+    "<T>System.Management.Automation.PSPrimitiveDictionary</T><T>System.Collections.Hashtable</T><T>System.Object</T></TN>"
+    '<DCT><En><S N="Key">DebugMode</S><I32 N="Value">1</I32></En><En><S N="Key">PSVersionTable</S><Obj N="Value" RefId="2"><TNRef RefId="0" />'
+    '<DCT><En><S N="Key">PSVersion</S><Version N="Value">5.1.17763.592</Version></En>'
+    '<En><S N="Key">PSEdition</S><S N="Value">Desktop</S></En></DCT></Obj></En></DCT></Obj></MS></Obj>'
+)
+RUNSPACEPOOL_OPENED = '<Obj RefId="0"><MS><I32 N="RunspaceState">2</I32></MS></Obj>'
+RUNSPACEPOOL_BROKEN = (
+    '<Obj RefId="0"><MS><I32 N="RunspaceState">5</I32><Obj N="ExceptionAsErrorRecord" RefId="1"><TN RefId="0">'
+    "<T>System.Management.Automation.ErrorRecord</T><T>System.Object</T></TN><ToString>Access is denied.</ToString></Obj></MS></Obj>"
+)
+SERVICE_OUTPUT = (
+    '<Obj RefId="0"><TN RefId="0"><T>Selected.System.ServiceProcess.ServiceController</T><T>System.Management.Automation.PSCustomObject</T>'
+    '<T>System.Object</T></TN><ToString>@{Name=WinRM; Status=Running}</ToString><MS><S N="Name">WinRM</S>'
+    '<Obj N="Status" RefId="1"><TN RefId="1"><T>System.ServiceProcess.ServiceControllerStatus</T><T>System.Enum</T><T>System.ValueType</T>'
+    "<T>System.Object</T></TN><ToString>Running</ToString><I32>4</I32></Obj></MS></Obj>"
+)
+ERROR_RECORD = (
+    '<Obj RefId="0"><TN RefId="0"><T>System.Management.Automation.ErrorRecord</T><T>System.Object</T></TN>'
+    "<ToString>Cannot find path 'C:\\missing' because it does not exist.</ToString><MS>"
+    '<Obj N="Exception" RefId="1"><TN RefId="1"><T>System.Management.Automation.ItemNotFoundException</T><T>System.Exception</T>'
+    "<T>System.Object</T></TN><ToString>System.Management.Automation.ItemNotFoundException: Cannot find path 'C:\\missing' because it does not exist.</ToString>"
+    "<Props><S N=\"Message\">Cannot find path 'C:\\missing' because it does not exist.</S></Props></Obj>"
+    '<Nil N="TargetObject" /><S N="FullyQualifiedErrorId">PathNotFound,Microsoft.PowerShell.Commands.GetChildItemCommand</S>'
+    '<B N="SerializeExtendedInfo">false</B></MS></Obj>'
+)
+WARNING_RECORD = (
+    '<Obj RefId="0"><TN RefId="0"><T>System.Management.Automation.WarningRecord</T><T>System.Management.Automation.InformationalRecord</T>'
+    '<T>System.Object</T></TN><ToString>disk is almost full</ToString><MS><S N="InformationalRecord_Message">disk is almost full</S>'
+    '<B N="InformationalRecord_SerializeInvocationInfo">false</B></MS></Obj>'
+)
+PIPELINE_COMPLETED = '<Obj RefId="0"><MS><I32 N="PipelineState">4</I32></MS></Obj>'
+PIPELINE_FAILED = (
+    '<Obj RefId="0"><MS><I32 N="PipelineState">5</I32><Obj N="ExceptionAsErrorRecord" RefId="1"><TN RefId="0">'
+    "<T>System.Management.Automation.ErrorRecord</T><T>System.Object</T></TN><ToString>boom</ToString>"
+    '<MS><S N="FullyQualifiedErrorId">boom</S></MS></Obj></MS></Obj>'
+)
+
+SCRIPTS = {
+    "Get-Service WinRM | Select-Object Name, Status": [(psrp.PIPELINE_OUTPUT, SERVICE_OUTPUT), (psrp.PIPELINE_STATE, PIPELINE_COMPLETED)],
+    "Get-ChildItem C:\\missing; Write-Warning 'disk is almost full'": [
+        (psrp.ERROR_RECORD, ERROR_RECORD),
+        (psrp.WARNING_RECORD, WARNING_RECORD),
+        (psrp.PIPELINE_STATE, PIPELINE_COMPLETED),
+    ],
+    "throw 'boom'": [(psrp.PIPELINE_STATE, PIPELINE_FAILED)],
+}
+
+
+class Pipeline(object):
+    def __init__(self, pid):
+        self.pid = pid
+        self.defragmenter = psrp.Defragmenter()
+        self.script = None
+        self.no_input = True
+        self.input = []
+        self.output = bytearray()
+        self.finished = False
+
+
+class PSRPHost(object):
+    """Stands in for protocol.transport, answers like the PSRP endpoint of a
+    Windows host. The output of a script is taken from SCRIPTS, the script
+    $input | ForEach-Object { $_ } writes its input back.
+    """
+
+    encryption = None
+
+    def __init__(self, pool_state=RUNSPACEPOOL_OPENED, receive_size=2000):
+        self.pool_state = pool_state
+        self.receive_size = receive_size
+        self.actions = []
+        self.pool_messages = []
+        self.pool_output = bytearray()
+        self.pipelines = {}
+        self.signals = []
+        self.object_id = 0
+        self.largest_message = 0
+        self.lock = threading.Lock()
+
+    def close_session(self):
+        pass
+
+    def send_message(self, message):
+        root = ET.fromstring(message)
+        action = _text(root, "Action").rsplit("/", 1)[1]
+        with self.lock:
+            self.largest_message = max(self.largest_message, len(message.encode("utf-8")))
+            self.actions.append(action)
+            body = getattr(self, "_" + action.lower())(root)
+        return (RESPONSE % (_text(root, "MessageID"), body)).encode()
+
+    def _write(self, output, rpid, pid, message_type, data):
+        self.object_id += 1
+        message = psrp.Message(psrp.CLIENT, message_type, rpid, pid, data.encode()).pack()
+        output += b"".join(psrp.fragment(message, self.object_id, 500))
+
+    def _create(self, root):
+        shell = next(node for node in root.iter() if node.tag.endswith("}Shell"))
+        self.rpid = uuid.UUID(shell.get("ShellId"))
+        creation_xml = next(node for node in root.iter() if node.tag.endswith("}creationXml"))
+        self.pool_messages = psrp.Defragmenter().feed(base64.b64decode(creation_xml.text))
+        self._write(self.pool_output, self.rpid, None, psrp.SESSION_CAPABILITY, self.pool_messages[0].data.decode())
+        self._write(self.pool_output, self.rpid, None, psrp.APPLICATION_PRIVATE_DATA, APPLICATION_PRIVATE_DATA)
+        self._write(self.pool_output, self.rpid, None, psrp.RUNSPACEPOOL_STATE, self.pool_state)
+        return '<w:Selector Name="ShellId">%s</w:Selector>' % shell.get("ShellId")
+
+    def _command(self, root):
+        command_line = next(node for node in root.iter() if node.tag.endswith("}CommandLine"))
+        pipeline = self.pipelines[command_line.get("CommandId")] = Pipeline(uuid.UUID(command_line.get("CommandId")))
+        self._feed(pipeline, base64.b64decode(_text(root, "Arguments")))
+        return "<rsp:CommandId>%s</rsp:CommandId>" % command_line.get("CommandId")
+
+    def _send(self, root):
+        stream = next(node for node in root.iter() if node.tag.endswith("}Stream"))
+        self._feed(self.pipelines[stream.get("CommandId")], base64.b64decode(stream.text))
+        return ""
+
+    def _feed(self, pipeline, data):
+        for message in pipeline.defragmenter.feed(data):
+            if message.message_type == psrp.CREATE_PIPELINE:
+                create = clixml.loads(message.data)
+                pipeline.script = create.PowerShell.Cmds[0].Cmd
+                pipeline.no_input = create.NoInput
+            elif message.message_type == psrp.PIPELINE_INPUT:
+                pipeline.input.append(message.data.decode())
+            elif message.message_type == psrp.END_OF_PIPELINE_INPUT:
+                pipeline.no_input = True
+        if pipeline.script is not None and pipeline.no_input and not pipeline.finished:
+            pipeline.finished = True
+            if pipeline.script == "$input | ForEach-Object { $_ }":
+                responses = [(psrp.PIPELINE_OUTPUT, data) for data in pipeline.input] + [(psrp.PIPELINE_STATE, PIPELINE_COMPLETED)]
+            else:
+                responses = SCRIPTS[pipeline.script]
+            for message_type, data in responses:
+                self._write(pipeline.output, self.rpid, pipeline.pid, message_type, data)
+
+    def _receive(self, root):
+        command_id = next(node for node in root.iter() if node.tag.endswith("}DesiredStream")).get("CommandId")
+        if command_id is None:
+            output, state = self.pool_output, ""
+        else:
+            pipeline = self.pipelines[command_id]
+            output = pipeline.output
+            done = pipeline.finished and len(output) <= self.receive_size
+            state = COMMAND_STATE % (command_id, "Done" if done else "Running", "<rsp:ExitCode>0</rsp:ExitCode>" if done else "")
+        chunk = bytes(output[: self.receive_size])
+        del output[: self.receive_size]
+        stream = '<rsp:Stream Name="stdout">%s</rsp:Stream>' % base64.b64encode(chunk).decode() if chunk else ""
+        return "<rsp:ReceiveResponse>%s%s</rsp:ReceiveResponse>" % (stream, state)
+
+    def _signal(self, root):
+        self.signals.append(_text(root, "Code"))
+        return ""
+
+    def _delete(self, root):
+        return ""
+
+
+@pytest.fixture
+def host():
+    return PSRPHost()
+
+
+@pytest.fixture
+def protocol(host):
+    protocol = Protocol("http://windows-host:5985/wsman", username="user", password="pass")
+    protocol.transport = host
+    return protocol
+
+
+def test_fragment_and_defragment_interleaved():
+    rpid = uuid.uuid4()
+    first = psrp.Message(psrp.SERVER, psrp.PIPELINE_INPUT, rpid, uuid.uuid4(), b"a" * 250)
+    second = psrp.Message(psrp.SERVER, psrp.PIPELINE_INPUT, rpid, None, b"b" * 10)
+    first_fragments = psrp.fragment(first.pack(), 1, 100)
+    assert len(first_fragments) == 4
+    data = first_fragments[0] + psrp.fragment(second.pack(), 2, 100)[0] + b"".join(first_fragments[1:])
+
+    defragmenter = psrp.Defragmenter()
+    messages = defragmenter.feed(data[:150])
+    messages += defragmenter.feed(data[150:])
+    assert messages == [second, first]
+
+
+def test_defragment_without_start_fragment():
+    fragments = psrp.fragment(psrp.Message(psrp.SERVER, psrp.PIPELINE_INPUT, uuid.uuid4(), None, b"x" * 200).pack(), 1, 100)
+    with pytest.raises(WinRMError, match="no start fragment"):
+        psrp.Defragmenter().feed(fragments[1])
+
+
+def test_open_sends_capability_and_pool_size(host, protocol):
+    with psrp.RunspacePool(protocol, min_runspaces=2, max_runspaces=4) as pool:
+        assert pool.state == psrp.RUNSPACEPOOL_OPENED
+        assert pool.shell_id == str(pool.id).upper()
+        assert pool.application_private_data["ApplicationPrivateData"]["PSVersionTable"]["PSVersion"] == "5.1.17763.592"
+
+    capability, init = [clixml.loads(message.data) for message in host.pool_messages]
+    assert capability.protocolversion == "2.3"
+    assert (init.MinRunspaces, init.MaxRunspaces) == (2, 4)
+    assert host.actions == ["Create", "Receive", "Delete"]
+    assert pool.shell_id is None
+
+
+def test_open_broken_pool():
+    host = PSRPHost(pool_state=RUNSPACEPOOL_BROKEN)
+    protocol = Protocol("http://windows-host:5985/wsman", username="user", password="pass")
+    protocol.transport = host
+    with pytest.raises(WinRMError, match="Access is denied"):
+        psrp.RunspacePool(protocol).open()
+    assert host.actions[-1] == "Delete"
+
+
+def test_run_deserializes_output(host, protocol):
+    with psrp.RunspacePool(protocol) as pool:
+        result = pool.run("Get-Service WinRM | Select-Object Name, Status")
+
+    assert not result.had_errors
+    assert result.state == psrp.PIPELINE_COMPLETED
+    [service] = result.output
+    assert service.Name == "WinRM"
+    assert service.Status == 4
+    assert str(service) == "@{Name=WinRM; Status=Running}"
+    assert host.signals == [psrp.SIGNAL_TERMINATE]
+
+
+def test_run_collects_errors_and_warnings(protocol):
+    with psrp.RunspacePool(protocol) as pool:
+        result = pool.run("Get-ChildItem C:\\missing; Write-Warning 'disk is almost full'")
+        failed = pool.run("throw 'boom'")
+
+    assert result.had_errors and result.state == psrp.PIPELINE_COMPLETED
+    assert result.errors[0].FullyQualifiedErrorId.startswith("PathNotFound")
+    assert result.errors[0].Exception.Message == "Cannot find path 'C:\\missing' because it does not exist."
+    assert result.warnings == ["disk is almost full"]
+    assert failed.state == psrp.PIPELINE_FAILED
+    assert [str(error) for error in failed.errors] == ["boom"]
+
+
+def test_long_script_and_input_are_fragmented(host, protocol):
+    protocol.max_env_sz = 4000
+    values = ["x" * 3000, 42, {"a": [1, 2]}]
+    with psrp.RunspacePool(protocol) as pool:
+        result = pool.run("$input | ForEach-Object { $_ }", input=values)
+
+    assert result.output == values
+    assert host.actions.count("Send") > len(values) + 1
+    assert host.largest_message <= 4000
+
+
+def test_pipelines_run_concurrently(host, protocol):
+    with psrp.RunspacePool(protocol, max_runspaces=2) as pool:
+        first = pool.begin("Get-Service WinRM | Select-Object Name, Status")
+        second = pool.begin("throw 'boom'")
+        assert second.wait().state == psrp.PIPELINE_FAILED
+        assert first.wait().output[0].Name == "WinRM"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(pool.run("Get-Service WinRM | Select-Object Name, Status"))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert [result.output[0].Name for result in results] == ["WinRM"] * 4
+    assert len(host.pipelines) == 6
@@ -1,6 +1,15 @@
+import collections
+import io
+import logging
+import re
+import threading
+
+import mock
 import pytest
 
-from winrm import Session
+from winrm import Response, Session
+from winrm.exceptions import WinRMError
+from winrm.sinks import SpillSink, TailSink
 
 
 def test_run_cmd(protocol_fake):
@@ -89,3 +98,172 @@ def test_decode_clixml_invalid_xml():
         actual = s._clean_error_msg(msg)
 
     assert actual == msg
+
+
+def test_response_clixml_stderr_is_converted_when_read():
+    msg = b'#< CLIXML\r\n<Objs Version="1.1.0.1" xmlns="http://schemas.microsoft.com/powershell/2004/04"><S S="Error">boom_x000D__x000A_</S></Objs>'
+    r = Response((b"", msg, 1), clixml_stderr=True)
+    assert r._std_err_text is None
+    assert r.std_err == b"boom"
+    assert [(record.stream, record.value) for record in r.stderr_records] == [("error", "boom\r\n")]
+    assert Response((b"", msg, 1)).stderr_records == []
+
+
+def test_response_is_compact():
+    r = Response((b"out", b"err", 0))
+    assert not hasattr(r, "__dict__")
+    with pytest.raises(AttributeError):
+        r.extra = 1
+
+
+def test_response_backed_by_chunks_and_views():
+    r = Response(([b"a", b"b\r\n", b"c"], memoryview(b"err"), 0))
+    assert list(r.iter_lines()) == ["ab", "c"]
+    assert r.std_out == b"ab\r\nc"
+    assert r.std_err == b"err"
+    assert repr(r) == "<Response code 0, out \"b'ab\\r\\nc'\", err \"b'err'\">"
+
+
+def test_response_text_uses_codepage():
+    data = "caf\u00e9 \u2500\r\n".encode("utf-8")
+    assert Response((data, b"", 0), codepage=65001).stdout_text == "caf\u00e9 \u2500\r\n"
+    r = Response(("caf\u00e9\r\n".encode("cp437"), b"", 0))
+    assert r.stdout_text == "caf\u00e9\r\n"
+    assert r.stdout_text is r.stdout_text
+
+
+def test_response_iter_lines_splits_characters_between_chunks():
+    r = Response(([b"one\r\ntw\xc3", b"\xa9\r", b"\nthree"], b"", 0), codepage=65001)
+    assert list(r.iter_lines()) == ["one", "tw\u00e9", "three"]
+
+
+def test_response_iter_lines_from_spilled_sink():
+    sink = SpillSink(threshold=10)
+    for i in range(1000):
+        sink.write(b"line %d\r\n" % i)
+    assert sink.spilled
+    r = Response((sink, b"", 0))
+    assert list(r.iter_lines()) == ["line %d" % i for i in range(1000)]
+
+
+def test_stream_cmd(protocol_fake):
+    s = Session("windows-host", auth=("john.smith", "secret"))
+    s.protocol = protocol_fake
+
+    chunks = list(s.stream_cmd("ipconfig", ["/all"]))
+
+    assert chunks[-1] == ("exit_code", 0)
+    assert b"Windows IP Configuration" in b"".join(data for stream, data in chunks if stream == "stdout")
+
+
+def test_stream_ps(protocol_fake):
+    s = Session("windows-host", auth=("john.smith", "secret"))
+    s.protocol = protocol_fake
+
+    chunks = list(s.stream_ps('Write-Error "Error"'))
+
+    assert chunks[-1] == ("exit_code", 1)
+    assert b"".join(data for stream, data in chunks if stream == "stderr").startswith(b"#< CLIXML")
+
+
+def test_run_cmd_with_sinks(protocol_fake):
+    s = Session("windows-host", auth=("john.smith", "secret"))
+    s.protocol = protocol_fake
+    stdout = TailSink(8)
+    stderr = io.BytesIO()
+
+    r = s.run_cmd("ipconfig", ["/all"], stdout=stdout, stderr=stderr)
+
+    assert r.status_code == 0
+    assert r.std_out == stdout.getvalue()
+    assert len(r.std_out) == 8
+    assert stdout.truncated
+    assert r.std_err == b""
+    assert repr(r).startswith("<Response code 0")
+
+
+def test_run_ps_with_stderr_file(protocol_fake):
+    s = Session("windows-host", auth=("john.smith", "secret"))
+    s.protocol = protocol_fake
+    stderr = io.BytesIO()
+
+    r = s.run_ps('Write-Error "Error"', stderr=stderr)
+
+    assert r.status_code == 1
+    assert stderr.getvalue().startswith(b"#< CLIXML")
+
+
+def test_run_cmd_max_output_bytes(protocol_fake):
+    s = Session("windows-host", auth=("john.smith", "secret"))
+    s.protocol = protocol_fake
+
+    r = s.run_cmd("ipconfig", ["/all"], max_output_bytes=10)
+
+    assert r.truncated
+    assert r.std_out == b"\r\nWindows "
+    assert r.status_code == -1
+    assert repr(r).startswith("<Response code -1 truncated")
+    assert not s.run_cmd("ipconfig", ["/all"], max_output_bytes=1 << 20).truncated
+
+
+class RoundTripCounter(object):
+    """Counts the requests sent per WSMan action, Delete can be held back"""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.actions = collections.Counter()
+        self.delete_allowed = threading.Event()
+        self.delete_allowed.set()
+
+    def send_message(self, message):
+        action = re.search(r"<a:Action[^>]*>[^<]*/(\w+)</a:Action>", message).group(1)
+        if action == "Delete":
+            self.delete_allowed.wait(5)
+        self.actions[action] += 1
+        return self.transport.send_message(message)
+
+    def close_session(self):
+        pass
+
+
+@pytest.mark.parametrize(
+    "teardown, round_trips",
+    [
+        ("full", {"Create": 1, "Command": 1, "Receive": 1, "Signal": 1, "Delete": 1}),
+        ("minimal", {"Create": 1, "Command": 1, "Receive": 1, "Delete": 1}),
+        ("background", {"Create": 1, "Command": 1, "Receive": 1}),
+    ],
+)
+def test_run_cmd_teardown_round_trips(protocol_fake, monkeypatch, teardown, round_trips):
+    counter = RoundTripCounter(protocol_fake.transport)
+    if teardown == "background":
+        # run_cmd must not wait for the Delete
+        counter.delete_allowed.clear()
+    monkeypatch.setattr(protocol_fake, "transport", counter)
+    s = Session("windows-host", auth=("john.smith", "secret"), teardown=teardown)
+    s.protocol = protocol_fake
+
+    with s:
+        assert s.run_cmd("ipconfig", ["/all"]).status_code == 0
+        # the round trips made before run_cmd returned
+        assert counter.actions == round_trips
+        counter.delete_allowed.set()
+
+    assert counter.actions["Delete"] == 1
+
+
+def test_background_teardown_logs_failure(caplog):
+    s = Session("windows-host", auth=("john.smith", "secret"), teardown="background")
+    s.protocol = mock.MagicMock()
+    s.protocol.close_shell.side_effect = WinRMError("shell is gone")
+
+    with caplog.at_level(logging.WARNING, logger="winrm"):
+        s._close_shell_later("shell-1")
+        s.close()
+
+    assert "Failed to delete shell shell-1 in the background: shell is gone" in caplog.text
+
+
+def test_invalid_teardown():
+    with pytest.raises(WinRMError, match="teardown must be one of"):
+        Session("windows-host", auth=("john.smith", "secret"), teardown="none")
@@ -0,0 +1,280 @@
+import threading
+
+import pytest
+
+from winrm import Session
+from winrm.exceptions import WinRMCommandCancelledError, WinRMError, WSManFaultError
+from winrm.shellpool import WSMAN_SHELL_NOT_FOUND, ShellPool, get_shared_pool
+
+
+class TransportFake(object):
+    endpoint = "http://windows-host:5985/wsman"
+    username = "john.smith"
+    auth_method = "plaintext"
+    password = "secret"
+
+    def __init__(self):
+        self.closed = 0
+
+    def close_session(self):
+        self.closed += 1
+
+
+class ProtocolFake(object):
+    def __init__(self):
+        self.transport = TransportFake()
+        self.opened = []
+        self.closed = []
+        self.commands = []
+        self.gone = set()
+        self.checked = []
+
+    def open_shell(self, **kwargs):
+        shell_id = "shell-%d" % len(self.opened)
+        self.opened.append((shell_id, kwargs))
+        return shell_id
+
+    def close_shell(self, shell_id, close_session=True):
+        self.closed.append(shell_id)
+
+    def shell_alive(self, shell_id):
+        self.checked.append(shell_id)
+        return shell_id not in self.gone
+
+    def run_command(self, shell_id, command, arguments=(), console_mode_stdin=True, skip_cmd_shell=False):
+        if shell_id in self.gone:
+            raise WSManFaultError(500, "", "", "shell not found", wsman_fault_code=WSMAN_SHELL_NOT_FOUND)
+        self.commands.append((shell_id, command))
+        return "command-%d" % len(self.commands)
+
+
+def test_reuse_shell():
+    protocol = ProtocolFake()
+    pool = ShellPool(protocol)
+
+    for _ in range(3):
+        with pool.command("hostname") as (shell_id, command_id):
+            assert shell_id == "shell-0"
+
+    assert len(protocol.opened) == 1
+    assert protocol.closed == []
+    assert pool.size == 1
+    assert pool.idle == 1
+
+    pool.close()
+    assert protocol.closed == ["shell-0"]
+    assert protocol.transport.closed == 1
+    assert pool.size == 0
+
+
+def test_shells_keyed_by_options():
+    protocol = ProtocolFake()
+    pool = ShellPool(protocol)
+
+    with pool.command("hostname", codepage=65001, env_vars={"A": "1"}) as (shell_id, _):
+        assert shell_id == "shell-0"
+    with pool.command("hostname", codepage=437) as (shell_id, _):
+        assert shell_id == "shell-1"
+    with pool.command("hostname", env_vars={"A": "1"}, codepage=65001) as (shell_id, _):
+        assert shell_id == "shell-0"
+
+    assert protocol.opened[0][1] == {"codepage": 65001, "env_vars": {"A": "1"}}
+
+
+def test_shell_discarded_on_error():
+    protocol = ProtocolFake()
+    pool = ShellPool(protocol)
+
+    with pytest.raises(ValueError):
+        with pool.command("hostname"):
+            raise ValueError()
+
+    assert protocol.closed == ["shell-0"]
+    assert pool.size == 0
+
+    with pool.command("hostname") as (shell_id, _):
+        assert shell_id == "shell-1"
+
+
+def test_replace_shell_removed_by_server():
+    protocol = ProtocolFake()
+    pool = ShellPool(protocol)
+
+    with pool.command("hostname"):
+        pass
+    protocol.gone.add("shell-0")
+
+    with pool.command("hostname") as (shell_id, command_id):
+        assert shell_id == "shell-1"
+
+    # the gone shell is not sent a Delete
+    assert protocol.closed == []
+    assert pool.size == 1
+
+
+def test_fault_on_new_shell_not_retried():
+    protocol = ProtocolFake()
+    protocol.gone.add("shell-0")
+    pool = ShellPool(protocol)
+
+    with pytest.raises(WSManFaultError):
+        with pool.command("hostname"):
+            pass
+
+    assert len(protocol.opened) == 1
+
+
+def test_evict_idle_shells():
+    protocol = ProtocolFake()
+    pool = ShellPool(protocol, idle_timeout_sec=0)
+
+    with pool.command("hostname"):
+        pass
+    with pool.command("hostname") as (shell_id, _):
+        assert shell_id == "shell-1"
+
+    assert protocol.closed == ["shell-0"]
+
+
+def test_max_size_evicts_other_keys():
+    protocol = ProtocolFake()
+    pool = ShellPool(protocol, max_size=1)
+
+    with pool.command("hostname", codepage=437):
+        pass
+    with pool.command("hostname", codepage=65001) as (shell_id, _):
+        assert shell_id == "shell-1"
+
+    assert protocol.closed == ["shell-0"]
+    assert pool.size == 1
+
+
+def test_max_size_blocks_until_released():
+    protocol = ProtocolFake()
+    pool = ShellPool(protocol, max_size=1)
+    acquired = []
+
+    shell = pool.acquire()
+    worker = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    worker.start()
+    worker.join(0.1)
+    assert acquired == []
+
+    pool.release(shell)
+    worker.join(5)
+    assert acquired[0] is shell
+
+
+def test_closed_pool():
+    pool = ShellPool(ProtocolFake())
+    pool.close()
+
+    with pytest.raises(WinRMError, match="the shell pool has been closed"):
+        pool.acquire()
+
+
+def test_acquire_timeout():
+    pool = ShellPool(ProtocolFake(), max_size=1, acquire_timeout_sec=0.05)
+    pool.acquire()
+
+    with pytest.raises(WinRMError, match="no shell of the pool became free within 0.05 seconds, all 1 are in use"):
+        pool.acquire()
+
+
+def test_health_check():
+    protocol = ProtocolFake()
+    pool = ShellPool(protocol, health_check_after_sec=10)
+    pool.release(pool.acquire())
+
+    # a shell that just ran a command is reused without a check
+    shell = pool.acquire()
+    assert (shell.shell_id, protocol.checked) == ("shell-0", [])
+
+    pool.release(shell)
+    shell.last_used -= 11
+    protocol.gone.add("shell-0")
+    shell = pool.acquire()
+
+    # the removed shell is replaced without a Delete
+    assert (shell.shell_id, protocol.checked) == ("shell-1", ["shell-0"])
+    assert protocol.closed == []
+    assert pool.size == 1
+
+
+def test_shared_pool():
+    protocol = ProtocolFake()
+    pool = get_shared_pool(protocol)
+
+    assert get_shared_pool(ProtocolFake()) is pool
+    pool.close()
+    assert get_shared_pool(protocol) is not pool
+
+
+@pytest.mark.parametrize(
+    "name, value",
+    [
+        ("password", "wrong"),
+        ("read_timeout_sec", 60),
+        ("server_cert_validation", "ignore"),
+        ("message_encryption", "never"),
+        ("proxy", "http://proxy:3128"),
+    ],
+)
+def test_shared_pool_settings_differ(name, value):
+    protocol = ProtocolFake()
+    pool = get_shared_pool(protocol)
+
+    other = ProtocolFake()
+    setattr(other.transport, name, value)
+    other_pool = get_shared_pool(other)
+    assert other_pool is not pool
+    assert other_pool.protocol is other
+
+    pool.close()
+    other_pool.close()
+
+
+def test_shared_pool_protocol_settings_differ():
+    protocol = ProtocolFake()
+    pool = get_shared_pool(protocol)
+
+    other = ProtocolFake()
+    other.operation_timeout_sec = 40
+    other_pool = get_shared_pool(other)
+    assert other_pool is not pool
+
+    pool.close()
+    other_pool.close()
+
+
+def test_session_run_cmd_with_pool(protocol_fake):
+    s = Session("windows-host", auth=("john.smith", "secret"), shell_pool=True)
+    s.protocol = protocol_fake
+    s.shell_pool = ShellPool(protocol_fake)
+
+    with s:
+        for _ in range(2):
+            r = s.run_cmd("ipconfig", ["/all"])
+            assert r.status_code == 0
+            assert b"Windows IP Configuration" in r.std_out
+
+        assert s.shell_pool.size == 1
+
+    assert s.shell_pool.size == 0
+
+
+def test_session_cancelled_command_keeps_shell(protocol_fake):
+    s = Session("windows-host", auth=("john.smith", "secret"), shell_pool=True)
+    s.protocol = protocol_fake
+    s.shell_pool = ShellPool(protocol_fake)
+    cancel = threading.Event()
+    cancel.set()
+
+    with s:
+        with pytest.raises(WinRMCommandCancelledError) as exc:
+            s.run_cmd("ipconfig", ["/all"], cancel=cancel)
+        assert exc.value.stdout == b""
+        assert s.shell_pool.idle == 1
+
+        assert s.run_cmd("ipconfig", ["/all"]).status_code == 0
+        assert s.shell_pool.size == 1
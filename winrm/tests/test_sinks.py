@@ -0,0 +1,66 @@
+import io
+
+from winrm.sinks import BufferSink, FileSink, SpillSink, TailSink, as_sink
+
+
+def test_buffer_sink():
+    sink = BufferSink()
+    assert sink.getvalue() == b""
+
+    sink.write(b"abc")
+    sink.write(b"def")
+    assert sink.head(4) == b"abcd"
+    assert sink.getvalue() == b"abcdef"
+
+
+def test_file_sink():
+    fileobj = io.BytesIO()
+    sink = as_sink(fileobj)
+    assert isinstance(sink, FileSink)
+
+    sink.write(b"abc")
+    sink.close()
+    assert fileobj.getvalue() == b"abc"
+    assert sink.getvalue() == b""
+
+
+def test_spill_sink_in_memory():
+    sink = SpillSink(threshold=10)
+    sink.write(b"0123456789")
+
+    assert not sink.spilled
+    assert sink.fileobj is None
+    assert sink.getvalue() == b"0123456789"
+    assert bytes(sink.getbuffer()) == b"0123456789"
+
+
+def test_spill_sink_to_disk():
+    sink = SpillSink(threshold=10)
+    sink.write(b"01234")
+    sink.write(b"56789")
+    sink.write(b"abc")
+
+    assert sink.spilled
+    assert sink.size == 13
+    assert sink.head(3) == b"012"
+    assert sink.getvalue() == b"0123456789abc"
+    assert bytes(sink.getbuffer()) == b"0123456789abc"
+    assert sink.fileobj.read() == b"0123456789abc"
+    sink.close()
+
+
+def test_tail_sink():
+    sink = TailSink(4)
+    sink.write(b"ab")
+    assert sink.getvalue() == b"ab"
+    assert not sink.truncated
+
+    for char in b"cdefghij":
+        sink.write(bytes([char]))
+    assert sink.getvalue() == b"ghij"
+    assert sink.dropped == 6
+    assert sink.truncated
+
+    sink.write(b"klmnop")
+    assert sink.getvalue() == b"mnop"
+    assert sink.dropped == 12
@@ -0,0 +1,125 @@
+import hashlib
+import os
+
+import pytest
+
+from winrm import Session
+from winrm.exceptions import WinRMTransferError
+from winrm.tests.fake_host import FakeHost
+
+REMOTE_PATH = "C:\\temp\\it's here.bin"
+
+
+@pytest.fixture
+def session():
+    session = Session("windows-host", auth=("john.smith", "secret"))
+    session.protocol.max_env_sz = 16384
+    session.protocol.transport = FakeHost(receive_size=5000)
+    return session
+
+
+@pytest.fixture
+def local_file(tmp_path):
+    path = tmp_path / "local.bin"
+    path.write_bytes(os.urandom(100000))
+    return path
+
+
+def test_put_and_get_file(session, local_file, tmp_path):
+    data = local_file.read_bytes()
+
+    put = session.put_file(str(local_file), REMOTE_PATH)
+    assert session.protocol.transport.files[REMOTE_PATH] == data
+    assert put.size == put.transferred == len(data)
+    assert put.sha256 == hashlib.sha256(data).hexdigest()
+    # the whole file goes through one process in envelope sized Sends
+    assert session.protocol.transport.messages < 20
+
+    copy = tmp_path / "copy.bin"
+    get = session.get_file(REMOTE_PATH, str(copy))
+    assert copy.read_bytes() == data
+    assert get == get._replace(size=len(data), transferred=len(data), sha256=put.sha256)
+
+
+def test_put_file_resume(session, local_file):
+    data = local_file.read_bytes()
+    session.protocol.transport.files[REMOTE_PATH] = bytearray(data[:30000])
+
+    result = session.put_file(str(local_file), REMOTE_PATH, resume=True)
+
+    assert session.protocol.transport.files[REMOTE_PATH] == data
+    assert result.transferred == len(data) - 30000
+
+
+def test_get_file_resume(session, local_file, tmp_path):
+    data = local_file.read_bytes()
+    session.protocol.transport.files[REMOTE_PATH] = bytearray(data)
+    copy = tmp_path / "copy.bin"
+    copy.write_bytes(data[:12345])
+
+    result = session.get_file(REMOTE_PATH, str(copy), resume=True)
+
+    assert copy.read_bytes() == data
+    assert result.transferred == len(data) - 12345
+
+
+def test_hash_mismatch(session, local_file, tmp_path):
+    # resuming from a remote file with different content
+    session.protocol.transport.files[REMOTE_PATH] = bytearray(b"x" * 1000)
+
+    with pytest.raises(WinRMTransferError, match="does not match after the transfer"):
+        session.put_file(str(local_file), REMOTE_PATH, offset=1000)
+
+    with pytest.raises(WinRMTransferError, match="does not match after the transfer"):
+        session.get_file(REMOTE_PATH, str(local_file), offset=1000)
+
+
+def test_remote_failure(session, tmp_path):
+    with pytest.raises(WinRMTransferError, match="exit code 1: Could not find file"):
+        session.get_file("C:\\missing.bin", str(tmp_path / "copy.bin"))
+
+
+def test_sync_dir(session, tmp_path):
+    local = tmp_path / "site"
+    (local / "bin").mkdir(parents=True)
+    (local / "bin" / "app.dll").write_bytes(os.urandom(10000))
+    (local / "index.html").write_bytes(b"<html></html>")
+    (local / "empty.txt").write_bytes(b"")
+    files = session.protocol.transport.files
+    files["C:\\site\\stale.txt"] = bytearray(b"old")
+
+    result = session.sync_dir(str(local), "C:\\site", delete=True, block_size=1000, processes=0)
+
+    assert result.copied == ["bin/app.dll", "empty.txt", "index.html"]
+    assert result.deleted == ["stale.txt"]
+    assert result.bytes_sent == 10013
+    assert sorted(files) == ["C:\\site\\bin\\app.dll", "C:\\site\\empty.txt", "C:\\site\\index.html"]
+    assert files["C:\\site\\bin\\app.dll"] == (local / "bin" / "app.dll").read_bytes()
+
+    # change one block and shrink another file
+    data = bytearray((local / "bin" / "app.dll").read_bytes())
+    data[4500:4510] = b"x" * 10
+    (local / "bin" / "app.dll").write_bytes(data + b"tail")
+    (local / "index.html").write_bytes(b"<html>")
+
+    result = session.sync_dir(str(local), "C:\\site", block_size=1000)
+
+    assert result.copied == result.deleted == []
+    assert result.updated == ["bin/app.dll", "index.html"]
+    assert result.unchanged == 1
+    # block 4 and the new last block of app.dll and the whole index.html
+    assert result.bytes_sent == 1000 + 4 + 6
+    assert files["C:\\site\\bin\\app.dll"] == data + b"tail"
+    assert files["C:\\site\\index.html"] == b"<html>"
+
+
+def test_sync_dir_unchanged(session, tmp_path):
+    (tmp_path / "a.txt").write_bytes(b"a")
+    session.sync_dir(str(tmp_path), "C:\\site", processes=0)
+    messages = session.protocol.transport.messages
+
+    result = session.sync_dir(str(tmp_path), "C:\\site", processes=0)
+
+    assert result == result._replace(copied=[], updated=[], deleted=[], unchanged=1, bytes_sent=0)
+    # only the hashing pass runs
+    assert session.protocol.transport.messages - messages < 10
@@ -1,8 +1,10 @@
 # coding=utf-8
+import io
 import os
 import unittest
 
 import mock
+import requests
 
 from winrm import transport
 from winrm.exceptions import InvalidCredentialsError, WinRMError
@@ -307,3 +309,151 @@ class TestTransport(unittest.TestCase):
         t_default.close_session()
         self.assertFalse(mock_session.return_value.close.called)
         self.assertIsNone(t_default.session)
+
+    @mock.patch("requests.Session")
+    def test_send_message_stream(self, mock_session):
+        body = b"<s:Envelope>" + b"x" * 100 + b"</s:Envelope>"
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = io.BytesIO(body)
+        mock_session.return_value.send.return_value = response
+
+        t_default = transport.Transport(
+            endpoint="Endpoint",
+            server_cert_validation="ignore",
+            username="test",
+            password="test",
+            auth_method="basic",
+        )
+        t_default.STREAM_CHUNK_SIZE = 16
+        chunks = list(t_default.send_message_stream("message"))
+
+        self.assertEqual(body, b"".join(chunks))
+        self.assertEqual(16, len(chunks[0]))
+        self.assertTrue(mock_session.return_value.send.call_args[1]["stream"])
+
+    @mock.patch("requests.Session")
+    def test_send_message_stream_encrypted_releases_connection(self, mock_session):
+        response = mock.MagicMock()
+        mock_session.return_value.send.return_value = response
+
+        t_default = transport.Transport(endpoint="Endpoint", username="test", password="test", auth_method="basic")
+        t_default.build_session()
+        t_default.encryption = mock.MagicMock()
+        t_default.encryption.decrypt_stream.return_value = iter([b"part1", b"part2"])
+
+        stream = t_default.send_message_stream("message")
+        self.assertEqual(b"part1", next(stream))
+
+        # a suspended consumer must not hold the connection or the lock
+        response.close.assert_called_once()
+        self.assertFalse(t_default._encryption_lock.locked())
+        self.assertEqual([b"part2"], list(stream))
+
+    def test_exchange_rebuilds_expired_encrypted_session(self):
+        t_default = transport.Transport(endpoint="Endpoint", username="test", password="test", auth_method="basic", pool_idle_timeout_sec=60)
+        old_session, new_session = mock.MagicMock(), mock.MagicMock()
+        old_encryption, new_encryption = object(), object()
+        t_default.session, t_default.encryption = old_session, old_encryption
+        t_default._pooled = transport._PooledSession(old_session, 60)
+        t_default._pooled.last_used -= 61
+
+        def build_session():
+            t_default.encryption = new_encryption
+            return new_session
+
+        with mock.patch.object(t_default, "_build_session", side_effect=build_session):
+            with t_default._exchange() as pair:
+                # the session and its encryption are only replaced together
+                self.assertEqual((new_session, new_encryption), pair)
+                self.assertTrue(t_default._encryption_lock.locked())
+
+        old_session.close.assert_called_once()
+
+    def test_build_session_pool_maxsize(self):
+        t_default = transport.Transport(endpoint="https://example.com", username="test", password="test", auth_method="basic", pool_maxsize=4)
+        session = t_default.build_session()
+        self.assertEqual(4, session.get_adapter("https://example.com/wsman")._pool_maxsize)
+        self.assertIs(session.get_adapter("http://example.com/wsman"), session.get_adapter("https://example.com/wsman"))
+
+    def test_build_session_invalid_pool_maxsize(self):
+        with self.assertRaises(WinRMError) as exc:
+            transport.Transport(endpoint="https://example.com", username="test", password="test", auth_method="basic", pool_maxsize=0)
+        self.assertEqual("pool_maxsize must be at least 1", str(exc.exception))
+
+    def test_build_session_idle_timeout(self):
+        t_default = transport.Transport(endpoint="https://example.com", username="test", password="test", auth_method="basic", pool_idle_timeout_sec=60)
+        session = t_default.build_session()
+        with mock.patch.object(session, "close") as close:
+            self.assertIs(session, t_default.build_session())
+            self.assertFalse(close.called)
+
+            t_default._pooled.last_used -= 61
+            self.assertIs(session, t_default.build_session())
+            close.assert_called_once_with()
+
+    def test_build_session_shared(self):
+        kwargs = dict(endpoint="https://example.com", username="test", password="test", auth_method="basic", share_connections=True)
+        first = transport.Transport(**kwargs)
+        second = transport.Transport(**kwargs)
+        other_user = transport.Transport(**dict(kwargs, username="other"))
+
+        session = first.build_session()
+        self.assertIs(session, second.build_session())
+        self.assertIsNot(session, other_user.build_session())
+
+        with mock.patch.object(session, "close") as close:
+            first.close_session()
+            self.assertFalse(close.called)
+            second.close_session()
+            close.assert_called_once_with()
+        other_user.close_session()
+        self.assertEqual({}, transport._shared_sessions)
+
+        # a new session once the last one was closed
+        self.assertIsNot(session, first.build_session())
+        first.close_session()
+
+    def test_build_session_shared_kept_until_idle(self):
+        kwargs = dict(endpoint="https://example.com", username="test", password="test", auth_method="basic", share_connections=True)
+        first = transport.Transport(pool_idle_timeout_sec=60, **kwargs)
+        session = first.build_session()
+        first.close_session()
+
+        second = transport.Transport(pool_idle_timeout_sec=60, **kwargs)
+        self.assertIs(session, second.build_session())
+        second.close_session()
+
+        transport._shared_sessions[second._shared_session_key()].last_used -= 61
+        third = transport.Transport(pool_idle_timeout_sec=60, **kwargs)
+        self.assertIsNot(session, third.build_session())
+        third.close_session()
+        transport._shared_sessions.clear()
+
+    def test_shared_session_key_password_digest(self):
+        kwargs = dict(endpoint="https://example.com", username="test", auth_method="basic", share_connections=True)
+        key = transport.Transport(password="secret", **kwargs)._shared_session_key()
+
+        self.assertNotIn("secret", key)
+        self.assertIn(transport.password_digest("secret"), key)
+        self.assertNotEqual(key, transport.Transport(password="other", **kwargs)._shared_session_key())
+
+    @unittest.skipUnless(transport.HAVE_NTLM, "requests_ntlm is not installed")
+    def test_build_session_shared_connection_bound_auth(self):
+        kwargs = dict(endpoint="https://example.com", username="test", password="test", auth_method="ntlm", share_connections=True)
+        first = transport.Transport(**kwargs)
+        second = transport.Transport(**kwargs)
+
+        self.assertIsNot(first.build_session(), second.build_session())
+        self.assertEqual({}, transport._shared_sessions)
+
+    @mock.patch("winrm.transport.Encryption")
+    @mock.patch.object(transport.Transport, "_send_message_request")
+    def test_setup_encryption_single_connection(self, send_message_request, encryption):
+        t_default = transport.Transport(endpoint="http://example.com", username="test", password="test", auth_method="basic")
+        session = requests.Session()
+        t_default.setup_encryption(session)
+
+        adapter = session.get_adapter("http://example.com/wsman")
+        self.assertEqual((1, True), (adapter._pool_maxsize, adapter._pool_block))
+        send_message_request.assert_called_once()
@@ -0,0 +1,111 @@
+import pytest
+
+from winrm import Session, xml_backend
+from winrm.exceptions import (
+    WinRMError,
+    WinRMOperationTimeoutError,
+    WinRMTransportError,
+    WSManFaultError,
+)
+from winrm.protocol import Protocol
+from winrm.tests.test_aio import FAULT_RESPONSE
+from winrm.tests.test_protocol import build_receive_response
+
+TIMEOUT_FAULT = FAULT_RESPONSE.replace(b"2150858843", b"2150858793")
+
+
+@pytest.fixture(params=["stdlib", "lxml"])
+def backend(request):
+    if request.param == "lxml" and not xml_backend.HAVE_LXML:
+        pytest.skip("lxml is not installed")
+
+    yield xml_backend.set_backend(request.param)
+    xml_backend.set_backend()
+
+
+@pytest.fixture
+def protocol():
+    return Protocol("endpoint", username="username", password="password")
+
+
+def test_parse_receive(backend, protocol):
+    res = build_receive_response([("stdout", b"out"), ("stderr", b"err"), ("stdout", b"put")], exit_code="1")
+
+    assert protocol._parse_receive(res) == (b"output", b"err", 1, True)
+
+
+def test_parse_receive_skips_comments(backend, protocol):
+    res = build_receive_response([("stdout", b"out")]).replace(b"<s:Body>", b"<s:Body><!-- comment --><?pi data?>")
+
+    assert protocol._parse_receive(res) == (b"out", b"", 0, True)
+
+
+def test_pull_parser(backend, protocol):
+    res = build_receive_response([("stdout", b"out"), ("stderr", b"err")])
+    parser = xml_backend.pull_parser()
+    parser.feed(res[:50])
+    parser.feed(res[50:])
+    parser.close()
+
+    assert [node.get("Name") for _, node in parser.read_events() if node.tag.endswith("Stream")] == ["stdout", "stderr", "stdout"]
+
+
+def test_parse_fault(backend, protocol):
+    fault = protocol._parse_fault(WinRMTransportError("http", 500, FAULT_RESPONSE.decode()))
+    assert isinstance(fault, WSManFaultError)
+    assert fault.wsman_fault_code == 2150858843
+    assert fault.reason == "the shell was not found"
+
+    assert isinstance(protocol._parse_fault(WinRMTransportError("http", 500, TIMEOUT_FAULT.decode())), WinRMOperationTimeoutError)
+
+    error = WinRMTransportError("http", 500, "not xml")
+    assert protocol._parse_fault(error) is error
+
+
+@pytest.mark.parametrize(
+    "detail",
+    [
+        '<f:WSManFault xmlns:f="http://schemas.microsoft.com/wbem/wsman/1/wsmanfault" Code="2150858793" Machine="host"><f:Message /></f:WSManFault>',
+        "<WSManFault xmlns='http://schemas.microsoft.com/wbem/wsman/1/wsmanfault'\n  Code='2150858793'/>",
+    ],
+)
+def test_parse_timeout_fault_without_xml(protocol, monkeypatch, detail):
+    response = FAULT_RESPONSE.decode().replace('<f:WSManFault xmlns:f="http://schemas.microsoft.com/wbem/wsman/1/wsmanfault" Code="2150858843"/>', detail)
+    assert detail in response
+    error = WinRMTransportError("http", 500, response)
+    assert isinstance(protocol._parse_fault_xml(error), WinRMOperationTimeoutError)
+
+    # the fast path does not parse the response
+    monkeypatch.setattr(xml_backend, "fromstring", None)
+    assert isinstance(protocol._parse_fault(error), WinRMOperationTimeoutError)
+
+
+def test_parse_fault_mentioning_timeout_code(protocol):
+    response = FAULT_RESPONSE.decode().replace("the shell was not found", '&lt;f:WSManFault Code="2150858793"&gt; was not expected')
+    fault = protocol._parse_fault(WinRMTransportError("http", 500, response))
+    assert isinstance(fault, WSManFaultError)
+    assert fault.wsman_fault_code == 2150858843
+
+
+def test_entities_are_not_expanded(backend):
+    doc = b'<!DOCTYPE a [<!ENTITY e SYSTEM "file:///etc/passwd">]><a>&e;</a>'
+
+    try:
+        root = xml_backend.fromstring(doc)
+    except Exception:
+        return
+    assert not root.text
+
+
+def test_clean_error_msg(backend):
+    msg = b'#< CLIXML\r\n<Objs Version="1.1.0.1" xmlns="http://schemas.microsoft.com/powershell/2004/04"><S S="Error">line_x000D__x000A_</S><S S="Error">more</S></Objs>'
+
+    assert Session._clean_error_msg(msg) == b"line\nmore"
+
+
+def test_set_backend():
+    assert xml_backend.set_backend().name == ("lxml" if xml_backend.HAVE_LXML else "stdlib")
+    assert xml_backend.get_backend().name == xml_backend.set_backend().name
+
+    with pytest.raises(WinRMError, match="invalid or unavailable XML backend: expat"):
+        xml_backend.set_backend("expat")
@@ -0,0 +1,509 @@
+"""Copies files to and from a Windows host through the stdin and stdout of a
+single PowerShell process per file.
+
+The file content is sent with Send messages as large as max_env_sz allows and
+received through the command output instead of being embedded in command
+lines, which are limited to 8191 characters. Both sides hash the whole file
+with SHA256 and the transfer fails when the hashes differ.
+
+sync_dir copies a directory tree by comparing SHA256 hashes of fixed size
+blocks, only the blocks that differ are sent.
+
+Like winrm.compression the scripts avoid APIs newer than .NET 2.0 and
+PowerShell 2.0, e.g. Stream.CopyTo and Get-ChildItem -File.
+"""
+
+from __future__ import annotations
+
+import collections.abc
+import concurrent.futures
+import hashlib
+import os
+import re
+import struct
+import time
+import typing as t
+from base64 import b64decode
+
+from winrm.exceptions import WinRMError, WinRMTransferError
+from winrm.powershell import build_command
+
+if t.TYPE_CHECKING:
+    from winrm import Session
+    from winrm.protocol import CommandInput
+
+__all__ = ["TransferResult", "SyncResult", "put_file", "get_file", "sync_dir"]
+
+# the file is read in blocks of this size to hash the part before the offset
+READ_SIZE = 1024 * 1024
+
+# the default size of the blocks compared by sync_dir
+SYNC_BLOCK_SIZE = 1024 * 1024
+
+# the scripts start with the variables passed to build_command, $path and
+# $offset for PUT_SCRIPT and GET_SCRIPT
+PUT_SCRIPT = """
+$ErrorActionPreference = 'Stop'
+$ProgressPreference = 'SilentlyContinue'
+$file = [IO.File]::Open($path, [IO.FileMode]::OpenOrCreate, [IO.FileAccess]::ReadWrite, [IO.FileShare]::None)
+try {
+    if ($offset -gt $file.Length) { throw "offset $offset is past the end of $path" }
+    $file.SetLength($offset)
+    $file.Position = $offset
+    $stdin = [Console]::OpenStandardInput()
+    $buffer = New-Object byte[] 1048576
+    while (($read = $stdin.Read($buffer, 0, $buffer.Length)) -gt 0) {
+        $file.Write($buffer, 0, $read)
+    }
+    $file.Flush()
+    $file.Position = 0
+    $hash = [BitConverter]::ToString([Security.Cryptography.SHA256]::Create().ComputeHash($file)).Replace('-', '').ToLowerInvariant()
+    [Console]::Out.WriteLine("$($file.Length) $hash")
+}
+finally {
+    $file.Dispose()
+}
+"""
+
+GET_SCRIPT = """
+$ErrorActionPreference = 'Stop'
+$ProgressPreference = 'SilentlyContinue'
+$file = [IO.File]::Open($path, [IO.FileMode]::Open, [IO.FileAccess]::Read, [IO.FileShare]::Read)
+try {
+    if ($offset -gt $file.Length) { throw "offset $offset is past the end of $path" }
+    $sha = [Security.Cryptography.SHA256]::Create()
+    $stdout = [Console]::OpenStandardOutput()
+    $buffer = New-Object byte[] 1048576
+    while (($read = $file.Read($buffer, 0, $buffer.Length)) -gt 0) {
+        $null = $sha.TransformBlock($buffer, 0, $read, $null, 0)
+        $start = [Math]::Max(0, $read - ($file.Position - $offset))
+        if ($start -lt $read) { $stdout.Write($buffer, $start, $read - $start) }
+    }
+    $null = $sha.TransformFinalBlock($buffer, 0, 0)
+    $stdout.Flush()
+    $hash = [BitConverter]::ToString($sha.Hash).Replace('-', '').ToLowerInvariant()
+    [Console]::Error.WriteLine("$($file.Length) $hash")
+}
+finally {
+    $file.Dispose()
+}
+"""
+
+SIZE_SCRIPT = """
+$item = Get-Item -LiteralPath $path -ErrorAction SilentlyContinue
+if ($item) { $item.Length } else { 0 }
+"""
+
+# writes a line per file under $path: the relative path encoded as base64 of
+# its UTF-8 bytes, the size, the hash of the file and the hashes of each $block
+# bytes of it
+HASH_SCRIPT = """
+$ErrorActionPreference = 'Stop'
+$ProgressPreference = 'SilentlyContinue'
+if (-not (Test-Path -LiteralPath $path -PathType Container)) { exit 0 }
+$root = (Get-Item -LiteralPath $path).FullName.TrimEnd('\\') + '\\'
+$sha = [Security.Cryptography.SHA256]::Create()
+$buffer = New-Object byte[] $block
+$out = [Console]::Out
+foreach ($item in Get-ChildItem -LiteralPath $path -Recurse -Force | Where-Object { -not $_.PSIsContainer }) {
+    $blocks = New-Object Text.StringBuilder
+    $file = [IO.File]::OpenRead($item.FullName)
+    try {
+        $whole = [Security.Cryptography.SHA256]::Create()
+        do {
+            $read = 0
+            while ($read -lt $block -and ($count = $file.Read($buffer, $read, $block - $read)) -gt 0) { $read += $count }
+            if ($read -gt 0) {
+                $null = $whole.TransformBlock($buffer, 0, $read, $null, 0)
+                $null = $blocks.Append([BitConverter]::ToString($sha.ComputeHash($buffer, 0, $read)).Replace('-', ''))
+            }
+        } while ($read -eq $block)
+        $null = $whole.TransformFinalBlock($buffer, 0, 0)
+    }
+    finally {
+        $file.Dispose()
+    }
+    $name = [Convert]::ToBase64String([Text.Encoding]::UTF8.GetBytes($item.FullName.Substring($root.Length)))
+    $hashes = "$([BitConverter]::ToString($whole.Hash).Replace('-', '')) $blocks".ToLowerInvariant()
+    $out.WriteLine("$name $($item.Length) $hashes")
+}
+"""
+
+# reads the records built by _patch_records from stdin and writes the size
+# and hash of each file it writes. The lines are only written once stdin has
+# been read, _run makes no Receive before all of it is sent and the output
+# of many small files could otherwise fill the buffer of the server and stop
+# the script from reading
+PATCH_SCRIPT = """
+$ErrorActionPreference = 'Stop'
+$ProgressPreference = 'SilentlyContinue'
+$null = [IO.Directory]::CreateDirectory($path)
+$reader = New-Object IO.BinaryReader([Console]::OpenStandardInput())
+$sha = [Security.Cryptography.SHA256]::Create()
+$results = New-Object Text.StringBuilder
+while (($kind = $reader.ReadByte()) -ne 0) {
+    $target = Join-Path $path ([Text.Encoding]::UTF8.GetString($reader.ReadBytes($reader.ReadInt32())))
+    if ($kind -eq 2) {
+        Remove-Item -LiteralPath $target -Force
+        continue
+    }
+    $null = [IO.Directory]::CreateDirectory([IO.Path]::GetDirectoryName($target))
+    $file = [IO.File]::Open($target, [IO.FileMode]::OpenOrCreate, [IO.FileAccess]::ReadWrite, [IO.FileShare]::None)
+    try {
+        $file.SetLength($reader.ReadInt64())
+        for ($count = $reader.ReadInt32(); $count -gt 0; $count--) {
+            $file.Position = $reader.ReadInt64()
+            $data = $reader.ReadBytes($reader.ReadInt32())
+            $file.Write($data, 0, $data.Length)
+        }
+        $file.Flush()
+        $file.Position = 0
+        $hash = [BitConverter]::ToString($sha.ComputeHash($file)).Replace('-', '').ToLowerInvariant()
+        $null = $results.AppendLine("$($file.Length) $hash")
+    }
+    finally {
+        $file.Dispose()
+    }
+}
+[Console]::Out.Write($results.ToString())
+"""
+
+_RESULT = re.compile(rb"(\d+) ([0-9a-f]{64})")
+
+# the record kinds of PATCH_SCRIPT
+_END = 0
+_WRITE = 1
+_DELETE = 2
+
+
+class TransferResult(t.NamedTuple):
+    """The outcome of put_file or get_file"""
+
+    size: int
+    transferred: int
+    sha256: str
+    elapsed: float
+
+    @property
+    def bytes_per_sec(self) -> float:
+        return self.transferred / self.elapsed if self.elapsed else 0.0
+
+
+class SyncResult(t.NamedTuple):
+    """The outcome of sync_dir, the paths are relative with / separators"""
+
+    copied: list[str]
+    updated: list[str]
+    deleted: list[str]
+    unchanged: int
+    bytes_sent: int
+    elapsed: float
+
+
+class _FileDigest(t.NamedTuple):
+    size: int
+    sha256: str
+    blocks: list[str]
+
+
+class _HashingReader(object):
+    """Reads a file for Protocol.stream_command_input and hashes what it reads"""
+
+    def __init__(self, file: t.BinaryIO, sha: t.Any) -> None:
+        self.file = file
+        self.sha = sha
+
+    def read(self, size: int) -> bytes:
+        data = self.file.read(size)
+        self.sha.update(data)
+        return data
+
+
+def put_file(session: Session, local_path: str, remote_path: str, offset: int = 0, resume: bool = False) -> TransferResult:
+    """
+    Copies a local file to the remote host.
+    @param Session session: The session to the remote host.
+    @param string local_path: The file to copy.
+    @param string remote_path: The absolute path to copy it to.
+    @param int offset: The number of bytes at the start of the remote file
+        that are already the same as the local file and are not sent again.
+    @param bool resume: Continue an interrupted copy, the offset is set to
+        the size of the remote file.
+    @returns The size and hash of the file and the bytes sent.
+    @rtype TransferResult
+    @raises WinRMTransferError: The copy failed on the remote host or the
+        remote file does not match the local one.
+    """
+    size = os.path.getsize(local_path)
+    if resume:
+        offset = min(_remote_size(session, remote_path), size)
+    if not 0 <= offset <= size:
+        raise WinRMError("offset %d is outside of %s with %d bytes" % (offset, local_path, size))
+
+    start = time.monotonic()
+    sha = hashlib.sha256()
+    with open(local_path, "rb") as file:
+        _hash_prefix(file, sha, offset)
+        stdout, stderr = _run(session, build_command(PUT_SCRIPT, path=remote_path, offset=offset), stdin=_HashingReader(file, sha))
+
+    _verify(stdout, size, sha.hexdigest(), remote_path)
+    return TransferResult(size, size - offset, sha.hexdigest(), time.monotonic() - start)
+
+
+def get_file(session: Session, remote_path: str, local_path: str, offset: int = 0, resume: bool = False) -> TransferResult:
+    """
+    Copies a file from the remote host.
+    @param Session session: The session to the remote host.
+    @param string remote_path: The absolute path of the file to copy.
+    @param string local_path: The file to copy it to.
+    @param int offset: The number of bytes at the start of the local file
+        that are already the same as the remote file and are not received
+        again.
+    @param bool resume: Continue an interrupted copy, the offset is set to
+        the size of the local file.
+    @returns The size and hash of the file and the bytes received.
+    @rtype TransferResult
+    @raises WinRMTransferError: The copy failed on the remote host or the
+        local file does not match the remote one.
+    """
+    exists = os.path.exists(local_path)
+    if resume:
+        offset = os.path.getsize(local_path) if exists else 0
+    if offset < 0 or offset > (os.path.getsize(local_path) if exists else 0):
+        raise WinRMError("offset %d is past the end of %s" % (offset, local_path))
+
+    start = time.monotonic()
+    sha = hashlib.sha256()
+    with open(local_path, "r+b" if exists else "wb") as file:
+        _hash_prefix(file, sha, offset)
+        file.truncate()
+
+        def write(data: bytes) -> None:
+            file.write(data)
+            sha.update(data)
+
+        stdout, stderr = _run(session, build_command(GET_SCRIPT, path=remote_path, offset=offset), on_stdout=write)
+        size = file.tell()
+
+    _verify(stderr, size, sha.hexdigest(), remote_path)
+    return TransferResult(size, size - offset, sha.hexdigest(), time.monotonic() - start)
+
+
+def sync_dir(
+    session: Session,
+    local_dir: str,
+    remote_dir: str,
+    delete: bool = False,
+    block_size: int = SYNC_BLOCK_SIZE,
+    processes: int | None = None,
+) -> SyncResult:
+    """
+    Makes a remote directory a copy of a local one, only the files and the
+    blocks of them that differ are sent.
+
+    The remote files are hashed by one PowerShell process while the local
+    files are hashed by a process pool, then a second PowerShell process
+    receives the changed blocks through its stdin and reports the hash of
+    every file it wrote. Empty directories are not copied.
+    @param Session session: The session to the remote host.
+    @param string local_dir: The directory to copy.
+    @param string remote_dir: The absolute path of the directory to copy it
+        to, it is created when it does not exist.
+    @param bool delete: Delete the remote files that are not in local_dir.
+    @param int block_size: The number of bytes hashed per block, a changed
+        block is sent as a whole.
+    @param int processes: The number of processes hashing the local files,
+        defaults to the number of CPUs. 0 hashes them in this process.
+    @returns The relative paths copied, updated and deleted and the bytes
+        sent.
+    @rtype SyncResult
+    @raises WinRMTransferError: A script failed on the remote host or a
+        remote file does not match the local one after the transfer.
+    """
+    if block_size <= 0:
+        raise WinRMError("block_size must be positive")
+    if not os.path.isdir(local_dir):
+        raise WinRMError("%s is not a directory" % local_dir)
+
+    start = time.monotonic()
+    names = _list_files(local_dir)
+    paths = [os.path.join(local_dir, *name.split("/")) for name in names]
+    if processes == 0:
+        local = dict(zip(names, [_hash_file(path, block_size) for path in paths]))
+        remote = _remote_digests(session, remote_dir, block_size)
+    else:
+        # the remote files are hashed while the pool hashes the local ones
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(_hash_file, path, block_size) for path in paths]
+            remote = _remote_digests(session, remote_dir, block_size)
+            local = dict(zip(names, [future.result() for future in futures]))
+
+    copied: list[str] = []
+    updated: list[str] = []
+    writes: list[tuple[str, str, _FileDigest, list[int]]] = []
+    for name, path in zip(names, paths):
+        digest = local[name]
+        remote_digest = remote.get(name)
+        if remote_digest is None:
+            copied.append(name)
+            writes.append((name, path, digest, list(range(len(digest.blocks)))))
+        elif remote_digest.size != digest.size or remote_digest.sha256 != digest.sha256:
+            # a hash also covers the length of a partial last block
+            changed = [i for i, block in enumerate(digest.blocks) if i >= len(remote_digest.blocks) or remote_digest.blocks[i] != block]
+            updated.append(name)
+            writes.append((name, path, digest, changed))
+    deleted = sorted(set(remote) - set(local)) if delete else []
+
+    bytes_sent = 0
+    if writes or deleted:
+        sent = [0]
+        stdout, _ = _run(
+            session,
+            build_command(PATCH_SCRIPT, path=remote_dir),
+            stdin=_patch_records(writes, deleted, block_size, sent),
+        )
+        bytes_sent = sent[0]
+
+        reports = _RESULT.findall(stdout)
+        if len(reports) != len(writes):
+            raise WinRMTransferError("the sync script reported %d of the %d files written: %r" % (len(reports), len(writes), stdout[-200:]))
+        mismatched = [name for (name, _, digest, _), (size, sha256) in zip(writes, reports) if int(size) != digest.size or sha256.decode() != digest.sha256]
+        if mismatched:
+            raise WinRMTransferError("%d files do not match after the sync: %s" % (len(mismatched), ", ".join(mismatched)))
+
+    unchanged = len(names) - len(writes)
+    return SyncResult(copied, updated, deleted, unchanged, bytes_sent, time.monotonic() - start)
+
+
+def _list_files(local_dir: str) -> list[str]:
+    names: list[str] = []
+    for directory, _, files in os.walk(local_dir):
+        relative = os.path.relpath(directory, local_dir)
+        prefix = "" if relative == os.curdir else relative.replace(os.sep, "/") + "/"
+        names.extend(prefix + name for name in files)
+    return sorted(names)
+
+
+def _hash_file(path: str, block_size: int) -> _FileDigest:
+    """Hashes a local file and its blocks, runs in the process pool"""
+    sha = hashlib.sha256()
+    size = 0
+    blocks = []
+    with open(path, "rb") as file:
+        while True:
+            data = file.read(block_size)
+            if not data:
+                break
+            sha.update(data)
+            size += len(data)
+            blocks.append(hashlib.sha256(data).hexdigest())
+    return _FileDigest(size, sha.hexdigest(), blocks)
+
+
+def _remote_digests(session: Session, remote_dir: str, block_size: int) -> dict[str, _FileDigest]:
+    stdout, _ = _run(session, build_command(HASH_SCRIPT, path=remote_dir, block=block_size))
+    digests = {}
+    for line in stdout.splitlines():
+        if not line.strip():
+            continue
+        try:
+            name, size, sha256, blocks = line.decode("ascii").split(" ")
+            digests[b64decode(name).decode("utf-8").replace("\\", "/")] = _FileDigest(int(size), sha256, re.findall("[0-9a-f]{64}", blocks))
+        except ValueError:
+            raise WinRMTransferError("unexpected output of the hash script: %r" % line[:200])
+    return digests
+
+
+def _patch_records(
+    writes: list[tuple[str, str, _FileDigest, list[int]]],
+    deleted: list[str],
+    block_size: int,
+    sent: list[int],
+) -> collections.abc.Iterator[bytes]:
+    """Yields the input of PATCH_SCRIPT, the deletions come first so a file
+    whose name only changed case is written again after the old one is gone.
+    The number of bytes of file content is added to sent[0].
+    """
+    for name in deleted:
+        path = name.encode("utf-8")
+        yield struct.pack("<Bi", _DELETE, len(path)) + path
+
+    for name, local_path, digest, blocks in writes:
+        path = name.encode("utf-8")
+        yield struct.pack("<Bi", _WRITE, len(path)) + path + struct.pack("<qi", digest.size, len(blocks))
+        with open(local_path, "rb") as file:
+            for index in blocks:
+                file.seek(index * block_size)
+                data = file.read(block_size)
+                sent[0] += len(data)
+                yield struct.pack("<qi", index * block_size, len(data)) + data
+
+    yield struct.pack("<B", _END)
+
+
+def _remote_size(session: Session, remote_path: str) -> int:
+    stdout, _ = _run(session, build_command(SIZE_SCRIPT, path=remote_path))
+    return int(stdout.strip() or 0)
+
+
+def _run(
+    session: Session,
+    command: str,
+    stdin: CommandInput | _HashingReader | None = None,
+    on_stdout: t.Callable[[bytes], None] | None = None,
+) -> tuple[bytes, bytes]:
+    """Runs a transfer script and returns its stdout, unless on_stdout
+    consumes it, and stderr. The script runs without cmd.exe and its stdin is
+    a pipe so binary input is passed through as is. The output is only
+    received once all of stdin has been sent, scripts that take input write
+    their output after reading it.
+    """
+    stdout: list[bytes] = []
+    stderr: list[bytes] = []
+    return_code = -1
+    with session._command(command, (), {}, console_mode_stdin=False, skip_cmd_shell=True) as (shell_id, command_id):
+        # stdin is closed even when there is no input so a read ends
+        session.protocol.stream_command_input(shell_id, command_id, t.cast("CommandInput", stdin) if stdin is not None else b"")
+
+        for stream, data in session.protocol.iter_command_output(shell_id, command_id):
+            if isinstance(data, int):
+                return_code = data
+            elif stream == "stdout" and on_stdout:
+                on_stdout(data)
+            elif stream == "stdout":
+                stdout.append(data)
+            else:
+                stderr.append(data)
+        session._cleanup_command(shell_id, command_id)
+
+    if return_code != 0:
+        message = session._clean_error_msg(b"".join(stderr)).decode("utf-8", errors="replace")
+        raise WinRMTransferError("the transfer script failed with exit code %d: %s" % (return_code, message))
+    return b"".join(stdout), b"".join(stderr)
+
+
+def _hash_prefix(file: t.BinaryIO, sha: t.Any, offset: int) -> None:
+    remaining = offset
+    while remaining:
+        data = file.read(min(remaining, READ_SIZE))
+        if not data:
+            raise WinRMError("offset %d is past the end of the local file" % offset)
+        sha.update(data)
+        remaining -= len(data)
+
+
+def _verify(report: bytes, size: int, digest: str, remote_path: str) -> None:
+    # the size and hash are the last thing the script writes
+    match = None
+    for match in _RESULT.finditer(report):
+        pass
+    if not match:
+        raise WinRMTransferError("the transfer script did not report the size and hash of %s: %r" % (remote_path, report[-200:]))
+
+    remote_size = int(match.group(1))
+    remote_digest = match.group(2).decode()
+    if remote_size != size or remote_digest != digest:
+        raise WinRMTransferError(
+            "%s does not match after the transfer, local %d bytes sha256 %s, remote %d bytes sha256 %s"
+            % (remote_path, size, digest, remote_size, remote_digest)
+        )
@@ -1,10 +1,16 @@
 from __future__ import annotations
 
+import contextlib
+import hashlib
 import os
+import threading
+import time
 import typing as t
 import warnings
+from urllib.parse import urlsplit
 
 import requests
+import requests.adapters
 import requests.auth
 
 from winrm.encryption import Encryption
@@ -41,6 +47,40 @@ except ImportError as ie:
 __all__ = ["Transport"]
 
 
+def password_digest(password: str | None) -> str | None:
+    """Returns the SHA-256 hex digest of a password, to key the sessions and
+    shell pools shared in the process without keeping the password itself
+    """
+    return None if password is None else hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+
+# auth methods that authenticate every request on its own, NTLM, Kerberos and
+# CredSSP authenticate the connection and can keep encryption keys for it
+STATELESS_AUTH_METHODS = ("basic", "plaintext", "certificate", "ssl")
+
+
+class _PooledSession(object):
+    """A requests session with the number of Transports using it and when it
+    last sent a message
+    """
+
+    def __init__(self, session: requests.Session, idle_timeout_sec: float | None) -> None:
+        self.session = session
+        self.idle_timeout_sec = idle_timeout_sec
+        self.refs = 1
+        self.last_used = time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.idle_timeout_sec is not None and time.monotonic() - self.last_used > self.idle_timeout_sec
+
+
+# the sessions of Transports created with share_connections, keyed by their
+# endpoint, credentials and connection settings
+_shared_sessions: dict[tuple[t.Any, ...], _PooledSession] = {}
+_shared_sessions_lock = threading.Lock()
+
+
 def strtobool(value: str) -> bool:
     value = value.lower()
     if value in ("true", "t", "yes", "y", "on", "1"):
@@ -58,6 +98,9 @@ class UnsupportedAuthArgument(Warning):
 
 
 class Transport(object):
+    STREAM_CHUNK_SIZE = 64 * 1024
+    DEFAULT_POOL_MAXSIZE = requests.adapters.DEFAULT_POOLSIZE
+
     def __init__(
         self,
         endpoint: str,
@@ -80,6 +123,9 @@ class Transport(object):
         credssp_minimum_version: int = 2,
         send_cbt: bool = True,
         proxy: t.Literal["legacy_requests"] | str | None = "legacy_requests",
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        pool_idle_timeout_sec: float | None = None,
+        share_connections: bool = False,
     ) -> None:
         self.endpoint = endpoint
         self.username = username
@@ -99,6 +145,12 @@ class Transport(object):
         self.credssp_minimum_version = credssp_minimum_version
         self.send_cbt = send_cbt
         self.proxy = proxy
+        self.pool_maxsize = pool_maxsize
+        self.pool_idle_timeout_sec = pool_idle_timeout_sec
+        self.share_connections = share_connections
+
+        if pool_maxsize < 1:
+            raise WinRMError("pool_maxsize must be at least 1")
 
         if self.server_cert_validation not in [None, "validate", "ignore"]:
             raise WinRMError("invalid server_cert_validation mode: %s" % self.server_cert_validation)
@@ -163,6 +215,12 @@ class Transport(object):
                     raise InvalidCredentialsError("auth method %s requires a password" % self.auth_method)
 
         self.session: requests.Session | None = None
+        self._pooled: _PooledSession | None = None
+        self._shared_key: tuple[t.Any, ...] | None = None
+        self._session_lock = threading.RLock()
+        # wrapping a message assigns it the next sequence number and the
+        # replies have to be unwrapped in the same order, see _exchange
+        self._encryption_lock = threading.Lock()
 
         # Used for encrypting messages
         self.encryption: Encryption | None = None  # The Pywinrm Encryption class used to encrypt/decrypt messages
@@ -170,10 +228,103 @@ class Transport(object):
             raise WinRMError("invalid message_encryption arg: %s. Should be 'auto', 'always', or 'never'" % self.message_encryption)
 
     def build_session(self) -> requests.Session:
-        if self.session:
-            return self.session
-
+        """
+        Returns the requests session used to send messages, creating it on
+        first use.
+
+        The session keeps up to pool_maxsize connections to the endpoint.
+        When it has been idle for more than pool_idle_timeout_sec they are
+        closed before the next message, the server may have dropped them in
+        the meantime. A session with message encryption is built again
+        instead as its keys belong to the connection.
+
+        With share_connections the Transports with the same endpoint,
+        credentials and connection settings share one session and its
+        connections. This only applies to basic and certificate auth, the
+        connection-bound auth of NTLM, Kerberos and CredSSP keeps a session
+        per Transport.
+        """
+        with self._exchange() as (session, _):
+            return session
+
+    def _acquire_session(self, rebuild_expired: bool) -> tuple[requests.Session, Encryption | None]:
+        """Returns the session and the encryption of its connection as one
+        pair. An expired encrypted session is only built again with
+        rebuild_expired, when the caller holds _encryption_lock and no other
+        thread can still be using the old pair.
+        """
+        with self._session_lock:
+            if self.session and self._pooled:
+                if self._pooled.expired:
+                    if not self.encryption:
+                        self._pooled.session.close()
+                    elif not rebuild_expired:
+                        # the caller asks again holding _encryption_lock
+                        return self.session, self.encryption
+                    else:
+                        self.close_session()
+                if self.session:
+                    self._pooled.last_used = time.monotonic()
+                    return self.session, self.encryption
+
+            if self.share_connections and self.auth_method in STATELESS_AUTH_METHODS:
+                self.session = self._acquire_shared_session()
+                return self.session, None
+
+            self.session = self._build_session()
+            self._pooled = _PooledSession(self.session, self.pool_idle_timeout_sec)
+            return self.session, self.encryption
+
+    def _shared_session_key(self) -> tuple[t.Any, ...]:
+        return (
+            self.endpoint,
+            self.auth_method,
+            self.username,
+            password_digest(self.password),
+            self.cert_pem,
+            self.cert_key_pem,
+            self.server_cert_validation,
+            self.ca_trust_path,
+            self.proxy,
+            self.pool_maxsize,
+            self.pool_idle_timeout_sec,
+        )
+
+    def _acquire_shared_session(self) -> requests.Session:
+        key = self._shared_session_key()
+        with _shared_sessions_lock:
+            # sessions no Transport uses are kept until they expire
+            for other_key, unused in list(_shared_sessions.items()):
+                if unused.refs == 0 and unused.expired:
+                    del _shared_sessions[other_key]
+                    unused.session.close()
+
+            pooled = _shared_sessions.get(key)
+            if pooled is None:
+                pooled = _shared_sessions[key] = _PooledSession(self._build_session(), self.pool_idle_timeout_sec)
+            else:
+                pooled.refs += 1
+                pooled.last_used = time.monotonic()
+            self._pooled = pooled
+            self._shared_key = key
+            return pooled.session
+
+    def _release_shared_session(self, key: tuple[t.Any, ...]) -> None:
+        with _shared_sessions_lock:
+            pooled = _shared_sessions.get(key)
+            # the session may have expired and been replaced meanwhile
+            if pooled is None or pooled is not self._pooled:
+                return
+            pooled.refs -= 1
+            if pooled.refs == 0 and pooled.idle_timeout_sec is None:
+                del _shared_sessions[key]
+                pooled.session.close()
+
+    def _build_session(self) -> requests.Session:
         session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
         proxies = dict()
 
         if self.proxy is None:
@@ -293,7 +444,6 @@ class Transport(object):
             raise WinRMError("unsupported auth method: %s" % self.auth_method)
 
         session.headers.update(self.default_headers)
-        self.session = session
 
         # Will check the current config and see if we need to setup message encryption
         if self.message_encryption == "always" and not encryption_available:
@@ -307,6 +457,12 @@ class Transport(object):
         return session
 
     def setup_encryption(self, session: requests.Session) -> None:
+        # the encryption keys belong to the connection the context is set up
+        # on, _exchange makes sure only one message uses it at a time
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1, pool_block=True)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
         # Security context doesn't exist, sending blank message to initialise context
         request = requests.Request("POST", self.endpoint, data=None)
         prepared_request = session.prepare_request(request)
@@ -314,46 +470,109 @@ class Transport(object):
         self.encryption = Encryption(session, self.auth_method)
 
     def close_session(self) -> None:
+        """Closes the connections of the session, a shared session is only
+        closed once no Transport uses it and pool_idle_timeout_sec is unset
+        """
         if not self.session:
             return
-        self.session.close()
+        if self._shared_key is not None:
+            self._release_shared_session(self._shared_key)
+            self._shared_key = None
+        else:
+            self.session.close()
         self.session = None
+        self._pooled = None
 
     def send_message(self, message: str | bytes) -> bytes:
-        session = self.build_session()
+        with self._exchange() as (session, encryption):
+            prepared_request = self._prepare_message_request(session, message, encryption)
+            response = self._send_message_request(session, prepared_request, encryption=encryption)
+            return self._get_message_response_text(response, encryption)
+
+    def send_message_stream(self, message: str | bytes) -> t.Iterator[bytes]:
+        """
+        Sends a message like send_message but yields the response body in
+        pieces of STREAM_CHUNK_SIZE bytes as it is read from the connection.
+
+        An encrypted response is decrypted one part at a time as it is read,
+        the parts are only yielded once the whole response has been read.
+        A consumer that stops in between would otherwise keep the only
+        connection of the session and block every other message.
+        """
+        with self._exchange() as (session, encryption):
+            prepared_request = self._prepare_message_request(session, message, encryption)
+            response = self._send_message_request(session, prepared_request, stream=True, encryption=encryption)
+            if encryption:
+                try:
+                    host = urlsplit(self.endpoint).hostname
+                    chunks = response.iter_content(self.STREAM_CHUNK_SIZE)
+                    parts = list(encryption.decrypt_stream(chunks, response.headers.get("Content-Type", ""), host))
+                finally:
+                    response.close()
+
+        if encryption:
+            yield from parts
+            return
 
+        try:
+            yield from response.iter_content(self.STREAM_CHUNK_SIZE)
+        finally:
+            response.close()
+
+    @contextlib.contextmanager
+    def _exchange(self) -> t.Iterator[tuple[requests.Session, Encryption | None]]:
+        """Yields the session and encryption to send a message with. The
+        messages of an encrypted session are serialized from wrapping the
+        request to unwrapping the response, the sequence numbers of the
+        security context would get out of order when the messages of several
+        threads, e.g. of a shared ShellPool or a background shell Delete,
+        overlap. The pair is taken again under the lock as another thread
+        may have built a new session with a new security context meanwhile.
+        """
+        session, encryption = self._acquire_session(rebuild_expired=False)
+        if encryption is None:
+            yield session, None
+            return
+
+        with self._encryption_lock:
+            yield self._acquire_session(rebuild_expired=True)
+
+    def _prepare_message_request(self, session: requests.Session, message: str | bytes, encryption: Encryption | None = None) -> requests.PreparedRequest:
         # urllib3 fails on SSL retries with unicode buffers- must send it a byte string
         # see https://github.com/shazow/urllib3/issues/717
         if isinstance(message, str):
             message = message.encode("utf-8")
 
-        if self.encryption:
-            prepared_request = self.encryption.prepare_encrypted_request(session, self.endpoint, message)
-        else:
-            request = requests.Request("POST", self.endpoint, data=message)
-            prepared_request = session.prepare_request(request)
+        if encryption:
+            return encryption.prepare_encrypted_request(session, self.endpoint, message)
 
-        response = self._send_message_request(session, prepared_request)
-        return self._get_message_response_text(response)
+        request = requests.Request("POST", self.endpoint, data=message)
+        return session.prepare_request(request)
 
-    def _send_message_request(self, session: requests.Session, prepared_request: requests.PreparedRequest) -> requests.Response:
+    def _send_message_request(
+        self,
+        session: requests.Session,
+        prepared_request: requests.PreparedRequest,
+        stream: bool = False,
+        encryption: Encryption | None = None,
+    ) -> requests.Response:
         try:
-            response = session.send(prepared_request, timeout=self.read_timeout_sec)
+            response = session.send(prepared_request, timeout=self.read_timeout_sec, stream=stream)
             response.raise_for_status()
             return response
         except requests.HTTPError as ex:
             if ex.response.status_code == 401:
                 raise InvalidCredentialsError("the specified credentials were rejected by the server")
             if ex.response.content:
-                response_text = self._get_message_response_text(ex.response)
+                response_text = self._get_message_response_text(ex.response, encryption)
             else:
                 response_text = b""
 
             raise WinRMTransportError("http", ex.response.status_code, response_text.decode())
 
-    def _get_message_response_text(self, response: requests.Response) -> bytes:
-        if self.encryption:
-            response_text = self.encryption.parse_encrypted_response(response)
+    def _get_message_response_text(self, response: requests.Response, encryption: Encryption | None = None) -> bytes:
+        if encryption:
+            response_text = encryption.parse_encrypted_response(response)
         else:
             response_text = response.content
         return response_text
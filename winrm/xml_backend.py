@@ -0,0 +1,106 @@
+"""Selects the parser used for WSMan responses, lxml when it is installed and
+xml.etree.ElementTree otherwise.
+
+Both return elements with the ElementTree API so the callers do not need to
+know which one is in use.
+"""
+
+from __future__ import annotations
+
+import collections.abc
+import typing as t
+import xml.etree.ElementTree as ET
+
+from winrm.exceptions import WinRMError
+
+HAVE_LXML = True
+try:
+    from lxml import etree
+except ImportError:  # pragma: no cover
+    HAVE_LXML = False
+
+__all__ = ["XmlBackend", "LxmlBackend", "get_backend", "set_backend", "fromstring", "iter_elements", "pull_parser"]
+
+
+class XmlBackend(object):
+    """Parses with xml.etree.ElementTree from the standard library"""
+
+    name = "stdlib"
+
+    def fromstring(self, text: str | bytes) -> ET.Element:
+        return ET.fromstring(text)
+
+    def iter_elements(self, root: ET.Element) -> collections.abc.Iterator[ET.Element]:
+        # the tree builder drops comments and processing instructions
+        return root.iter()
+
+    def pull_parser(self) -> ET.XMLPullParser:
+        return ET.XMLPullParser(events=("end",))
+
+
+class LxmlBackend(XmlBackend):
+    """Parses with lxml. Entities are not resolved and nothing is fetched
+    from the network, text nodes are limited to lxml's default of 10MB.
+    """
+
+    name = "lxml"
+
+    def __init__(self) -> None:
+        self._parser = etree.XMLParser(resolve_entities=False, no_network=True)
+
+    def fromstring(self, text: str | bytes) -> ET.Element:
+        # lxml refuses str with an encoding declaration
+        if isinstance(text, str):
+            text = text.encode("utf-8")
+        return t.cast(ET.Element, etree.fromstring(text, self._parser))
+
+    def iter_elements(self, root: ET.Element) -> collections.abc.Iterator[ET.Element]:
+        # skips comments and processing instructions which lxml keeps
+        return t.cast(collections.abc.Iterator[ET.Element], root.iter(etree.Element))
+
+    def pull_parser(self) -> ET.XMLPullParser:
+        return t.cast(ET.XMLPullParser, etree.XMLPullParser(events=("end",), resolve_entities=False, no_network=True))
+
+
+_BACKENDS: dict[str, t.Callable[[], XmlBackend]] = {"stdlib": XmlBackend}
+if HAVE_LXML:
+    _BACKENDS["lxml"] = LxmlBackend
+
+_backend: XmlBackend = LxmlBackend() if HAVE_LXML else XmlBackend()
+
+
+def get_backend() -> XmlBackend:
+    """Returns the backend in use"""
+    return _backend
+
+
+def set_backend(name: str | None = None) -> XmlBackend:
+    """
+    Changes the backend used by every Protocol and Session.
+    @param string name: 'lxml', 'stdlib' or None to pick lxml when it is
+        installed.
+    @returns The backend now in use.
+    @rtype XmlBackend
+    """
+    global _backend
+    if name is None:
+        name = "lxml" if HAVE_LXML else "stdlib"
+    if name not in _BACKENDS:
+        raise WinRMError("invalid or unavailable XML backend: %s. Should be one of %s" % (name, ", ".join(sorted(_BACKENDS))))
+    _backend = _BACKENDS[name]()
+    return _backend
+
+
+def fromstring(text: str | bytes) -> ET.Element:
+    """Parses a whole document and returns its root element"""
+    return _backend.fromstring(text)
+
+
+def iter_elements(root: ET.Element) -> collections.abc.Iterator[ET.Element]:
+    """Iterates over root and all the elements below it in document order"""
+    return _backend.iter_elements(root)
+
+
+def pull_parser() -> ET.XMLPullParser:
+    """Returns an incremental parser reporting the end of every element"""
+    return _backend.pull_parser()